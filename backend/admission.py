@@ -0,0 +1,282 @@
+# admission.py
+#
+# Contrôle d'admission des appels entrants selon la capacité des workers de l'agent.
+#
+# Côté worker (agent.py) : avec AGENT_MAX_CALLS > 0, la charge déclarée à LiveKit devient
+# appels actifs / (capacité + AGENT_OVERFLOW_HEADROOM) (worker_load, passé en load_fnc), et un thread
+# publie toutes les ADMISSION_HEARTBEAT_SECONDS le nombre d'appels actifs dans la table agent_workers
+# (migration 006). Seule la capacité est publiée : la marge reste libre pour les appels en débordement
+# « message », qui sont eux aussi confiés à un worker (message d'attente puis raccroché).
+#
+# Côté webhook (inbound_sip_handler.py) : AdmissionController relit la capacité totale en tâche de
+# fond (aucune requête BD pendant le webhook) et décide pour chaque appel :
+# - place libre : admis ;
+# - sinon mise en attente (au plus SIP_ADMISSION_QUEUE_MAX appels, SIP_ADMISSION_QUEUE_TIMEOUT secondes) ;
+# - au-delà : débordement selon SIP_OVERFLOW_ACTION (refus | message | transfert).
+# Les appels admis depuis le dernier battement de cœur sont comptés localement (réservations)
+# jusqu'à ce que les workers aient pu les déclarer.
+# Sans battement de cœur récent (fonction désactivée, table absente, BD indisponible), tout est admis.
+
+import asyncio
+import atexit
+import logging
+import os
+import socket
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Deque, Optional
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+MAX_CALLS_PER_WORKER = int(os.getenv("AGENT_MAX_CALLS", "0")) # 0 : pas de battement de cœur
+OVERFLOW_HEADROOM = int(os.getenv("AGENT_OVERFLOW_HEADROOM", "2")) # Jobs acceptés au-delà de la capacité (débordement)
+HEARTBEAT_SECONDS = float(os.getenv("ADMISSION_HEARTBEAT_SECONDS", "2"))
+HEARTBEAT_STALE_SECONDS = 3 * HEARTBEAT_SECONDS
+DISPATCH_GRACE_SECONDS = 3.0 # Délai entre l'admission et la prise en charge du job par un worker
+
+OVERFLOW_ACTIONS = ("refus", "message", "transfert")
+
+ADMISSION_DECISIONS = metrics.REGISTRY.counter("artex_sip_admission", "Décisions d'admission des appels entrants.", ["decision"])
+ADMISSION_WAIT = metrics.REGISTRY.histogram(
+    "artex_sip_admission_wait_seconds", "Attente d'une place libre avant admission ou débordement.",
+    buckets=(0.01, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30),
+)
+AGENT_CAPACITY = metrics.REGISTRY.gauge("artex_agent_capacity", "Capacité des workers de l'agent vue par le webhook.", ["etat"])
+
+
+def default_worker_id() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+# --- Côté worker ---
+
+_active_calls = 0
+
+
+def worker_load(*args) -> float:
+    """
+    load_fnc de WorkerOptions (appelée périodiquement dans le processus principal du worker) :
+    retient le nombre de jobs en cours pour le battement de cœur et déclare la charge à LiveKit.
+    La charge n'atteint 1 (plus aucun job) qu'une fois la marge de débordement occupée : un worker
+    plein au sens de l'admission reçoit encore les appels en débordement.
+    """
+    global _active_calls
+    worker = args[0] if args else None
+    jobs = getattr(worker, "active_jobs", None)
+    if jobs is not None:
+        _active_calls = len(jobs)
+    if MAX_CALLS_PER_WORKER <= 0:
+        return 0.0
+    return min(1.0, _active_calls / (MAX_CALLS_PER_WORKER + max(0, OVERFLOW_HEADROOM)))
+
+
+class WorkerHeartbeat:
+    def __init__(self, db, worker_id: Optional[str] = None, capacity: int = MAX_CALLS_PER_WORKER,
+                 interval: float = HEARTBEAT_SECONDS):
+        self.db = db
+        self.worker_id = worker_id or default_worker_id()
+        self.capacity = capacity
+        self.interval = interval
+        self._stop = threading.Event()
+
+    def beat(self):
+        with self.db._get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                INSERT INTO agent_workers (id_worker, capacite, appels_actifs, derniere_activite)
+                VALUES (%s, %s, %s, NOW())
+                ON DUPLICATE KEY UPDATE capacite = VALUES(capacite), appels_actifs = VALUES(appels_actifs),
+                                        derniere_activite = NOW()
+            """, (self.worker_id, self.capacity, _active_calls))
+            conn.commit()
+
+    def unregister(self):
+        self._stop.set()
+        try:
+            with self.db._get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("DELETE FROM agent_workers WHERE id_worker = %s", (self.worker_id,))
+                conn.commit()
+        except Exception as e:
+            logger.warning(f"Désinscription du worker {self.worker_id} impossible : {e}")
+
+    def run(self):
+        failing = False
+        while not self._stop.is_set():
+            try:
+                self.beat()
+                if failing:
+                    logger.info("Battement de cœur de capacité rétabli.")
+                failing = False
+            except Exception as e:
+                if not failing:
+                    logger.warning(f"Battement de cœur de capacité en échec : {e}")
+                failing = True
+            self._stop.wait(self.interval)
+
+
+_heartbeat: Optional[WorkerHeartbeat] = None
+
+
+def start_worker_heartbeat() -> Optional[WorkerHeartbeat]:
+    """Démarre (une fois) le battement de cœur du worker si AGENT_MAX_CALLS > 0."""
+    global _heartbeat
+    if MAX_CALLS_PER_WORKER <= 0 or _heartbeat is not None:
+        return _heartbeat
+    from db_driver import ExtranetDatabaseDriver
+    _heartbeat = WorkerHeartbeat(ExtranetDatabaseDriver(pool_size=1, pool_name="agent_heartbeat"))
+    threading.Thread(target=_heartbeat.run, name="admission_heartbeat", daemon=True).start()
+    atexit.register(_heartbeat.unregister)
+    logger.info(f"Capacité du worker {_heartbeat.worker_id} publiée : {MAX_CALLS_PER_WORKER} appels simultanés.")
+    return _heartbeat
+
+
+# --- Côté webhook ---
+
+@dataclass
+class CapacitySnapshot:
+    workers: int
+    capacity: int
+    active: int
+    read_at: float # time.monotonic() de la lecture
+
+
+@dataclass
+class AdmissionDecision:
+    admitted: bool
+    waited: float = 0.0
+    overflow_action: Optional[str] = None
+
+
+def read_capacity(db, stale_seconds: float = HEARTBEAT_STALE_SECONDS) -> CapacitySnapshot:
+    with db._get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT COUNT(*), COALESCE(SUM(capacite), 0), COALESCE(SUM(LEAST(appels_actifs, capacite)), 0)
+            FROM agent_workers
+            WHERE derniere_activite >= NOW() - INTERVAL %s SECOND
+        """, (int(stale_seconds + 0.999),))
+        workers, capacity, active = cursor.fetchone()
+    return CapacitySnapshot(int(workers), int(capacity), int(active), time.monotonic())
+
+
+class AdmissionController:
+    def __init__(self, db, overflow_action: str = "refus", max_queue: int = 20, queue_timeout: float = 5.0,
+                 refresh_interval: float = 1.0):
+        if overflow_action not in OVERFLOW_ACTIONS:
+            raise ValueError(f"Action de débordement inconnue : {overflow_action} (attendu : {', '.join(OVERFLOW_ACTIONS)})")
+        self.db = db
+        self.overflow_action = overflow_action
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.refresh_interval = refresh_interval
+        self.snapshot: Optional[CapacitySnapshot] = None
+        self._reservations: Deque[float] = deque() # Dates d'admission pas encore déclarées par les workers
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._task: Optional[asyncio.Task] = None
+
+    # -- Capacité --
+
+    def free_slots(self) -> Optional[int]:
+        """Places libres, ou None si la capacité est inconnue (admission sans contrôle)."""
+        if self.snapshot is None or self.snapshot.workers == 0:
+            return None
+        return self.snapshot.capacity - self.snapshot.active - len(self._reservations)
+
+    def _expire_reservations(self):
+        if self.snapshot is None:
+            return
+        # Une admission antérieure à ce seuil figure dans les appels actifs déclarés par les workers.
+        reflected_before = self.snapshot.read_at - HEARTBEAT_SECONDS - DISPATCH_GRACE_SECONDS
+        while self._reservations and self._reservations[0] < reflected_before:
+            self._reservations.popleft()
+
+    async def refresh(self):
+        try:
+            snapshot = await asyncio.to_thread(read_capacity, self.db)
+        except Exception as e:
+            if self.snapshot is not None:
+                logger.warning(f"Capacité des workers illisible, admission sans contrôle : {e}")
+            self.snapshot = None
+            self._reservations.clear()
+        else:
+            if self.snapshot is None:
+                logger.info(f"Capacité des workers : {snapshot.active}/{snapshot.capacity} appels ({snapshot.workers} worker(s)).")
+            self.snapshot = snapshot
+            self._expire_reservations()
+        self._wake_waiters()
+
+    async def _refresh_loop(self):
+        while True:
+            await self.refresh()
+            await asyncio.sleep(self.refresh_interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._refresh_loop(), name="admission_refresh")
+            metrics.QUEUE_DEPTH.labels("admission_sip").set_function(lambda: len(self._waiters))
+            AGENT_CAPACITY.labels("totale").set_function(lambda: self.snapshot.capacity if self.snapshot else 0)
+            AGENT_CAPACITY.labels("libre").set_function(lambda: max(0, self.free_slots() or 0))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for waiter in self._waiters:
+            if not waiter.done():
+                waiter.set_result(False)
+        self._waiters.clear()
+
+    # -- Décision --
+
+    def _wake_waiters(self):
+        while self._waiters:
+            free = self.free_slots()
+            if free is not None and free <= 0:
+                return
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self._reservations.append(time.monotonic())
+                waiter.set_result(True)
+
+    async def admit(self) -> AdmissionDecision:
+        free = self.free_slots()
+        if free is None or (free > 0 and not self._waiters):
+            if free is not None:
+                self._reservations.append(time.monotonic())
+            ADMISSION_DECISIONS.labels("admis" if free is not None else "sans_controle").inc()
+            return AdmissionDecision(True)
+
+        started = time.monotonic()
+        if len(self._waiters) < self.max_queue and self.queue_timeout > 0:
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await asyncio.wait_for(asyncio.shield(waiter), self.queue_timeout)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                if not waiter.done():
+                    waiter.cancel()
+                    try:
+                        self._waiters.remove(waiter)
+                    except ValueError:
+                        pass
+            # Une place attribuée au moment même de l'expiration du délai est conservée.
+            admitted = not waiter.cancelled() and waiter.result()
+            waited = time.monotonic() - started
+            ADMISSION_WAIT.observe(waited)
+            if admitted:
+                ADMISSION_DECISIONS.labels("admis_apres_attente").inc()
+                return AdmissionDecision(True, waited)
+        waited = time.monotonic() - started
+        ADMISSION_DECISIONS.labels(f"debordement_{self.overflow_action}").inc()
+        return AdmissionDecision(False, waited, self.overflow_action)
@@ -4,21 +4,32 @@ import logging
 import os
 import asyncio
 import json
+import time
 from dotenv import load_dotenv
 from livekit.agents import (
     JobContext,
+    JobProcess,
     WorkerOptions,
     cli,
     AgentSession,
+    JobExecutorType,
 )
 from api import ArtexAgent
 from db_driver import ExtranetDatabaseDriver
-from prompts import WELCOME_MESSAGE
+from prompts import WELCOME_MESSAGE, OVERFLOW_BUSY_MESSAGE, CALLBACK_MESSAGE
 from tools import lookup_adherent_by_telephone
 from error_logger import log_system_error, set_db_connection_params
+from kb_index import get_knowledge_index
+from log_config import configure_logging, set_log_context
+import admission
+import caller_identification
+import metrics
+import loop_watchdog
+import post_call
 
-# --- Configuration du Logging (Inchangé) ---
-logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+# --- Configuration du Logging ---
+# Lignes JSON dans agent.log (lues par la page de contrôle), écrites hors des threads de l'agent.
+configure_logging()
 logger = logging.getLogger("artex_agent")
 logger.setLevel(logging.INFO)
 
@@ -38,6 +49,74 @@ except Exception as e:
     logger.critical(f"CRITICAL: Échec de la configuration du error_logger au démarrage: {e}", exc_info=True)
 
 
+# --- Préchargement du processus (Base de Connaissances) ---
+def prewarm(proc: JobProcess):
+    """
+    Exécutée une fois par processus avant qu'il ne reçoive un appel :
+    charge l'index de la base de connaissances hors du chemin critique de l'appel,
+    et expose les métriques du processus (ou les transmet au worker principal, voir metrics.py).
+    """
+    get_knowledge_index().load_current_blocking()
+    metrics.start_metrics_server()
+
+
+# Une tâche de mesure du retard de la boucle asyncio par boucle (donc par processus d'appels).
+# Avec AGENT_LOOP_WATCHDOG=1, la surveillance des appels bloquants prend en charge cette mesure.
+_loop_lag_tasks = {}
+
+def _ensure_loop_lag_sampler(job_id: str):
+    if loop_watchdog.watchdog_enabled():
+        loop_watchdog.ensure_watchdog(job_id)
+        return
+    loop = asyncio.get_running_loop()
+    task = _loop_lag_tasks.get(id(loop))
+    if task is None or task.done():
+        _loop_lag_tasks[id(loop)] = loop.create_task(metrics.sample_event_loop_lag())
+
+
+_background_tasks = set() # Références fortes vers les tâches lancées sans être attendues
+
+def _record_pre_identification(db_driver: ExtranetDatabaseDriver, id_appel: int, caller_number: str,
+                               greeting: str):
+    """
+    Journalise la recherche par téléphone faite au webhook (sans id d'appel à ce moment-là) comme
+    l'aurait fait lookup_adherent_by_telephone : interactions_bd, puis TOOL_CALL/TOOL_RESULT.
+    """
+    tool_name = "lookup_adherent_by_telephone"
+    db_driver._log_db_interaction(
+        type_requete="SELECT",
+        table_affectee="adherents",
+        description_action=f"Consultation adhérents par téléphone: {caller_number} (pré-identification webhook)",
+        id_appel_fk=id_appel
+    )
+    db_driver.enregistrer_action_agent(id_appel_fk=id_appel, type_action='TOOL_CALL', nom_outil=tool_name,
+                                       parametres_outil={"telephone": caller_number})
+    db_driver.enregistrer_action_agent(id_appel_fk=id_appel, type_action='TOOL_RESULT', nom_outil=tool_name,
+                                       resultat_outil=greeting)
+
+
+async def _load_pre_identified_adherent(session: AgentSession, db_driver: ExtranetDatabaseDriver,
+                                         id_adherent: int, id_appel: int, caller_number: str, greeting: str):
+    """
+    L'appelant a été pré-identifié au webhook et salué par son nom : journalise la recherche et charge
+    sa fiche en arrière-plan comme candidat à confirmer (équivalent de lookup_adherent_by_telephone,
+    hors chemin critique).
+    """
+    if id_appel:
+        try:
+            await asyncio.to_thread(_record_pre_identification, db_driver, id_appel, caller_number, greeting)
+        except Exception as e:
+            logger.warning(f"Journalisation de la pré-identification impossible pour l'appel {id_appel} : {e}")
+    try:
+        adherent = await asyncio.to_thread(db_driver.get_adherent_by_id, id_adherent, id_appel)
+    except Exception as e:
+        logger.warning(f"Chargement de l'adhérent pré-identifié {id_adherent} impossible : {e}")
+        return
+    session.userdata["unconfirmed_adherent"] = adherent
+    if adherent:
+        logger.info(f"Adhérent non confirmé trouvé via webhook: {adherent.prenom} {adherent.nom} (ID: {adherent.id_adherent})")
+
+
 # --- Main Agent Entrypoint ---
 async def entrypoint(ctx: JobContext):
     """
@@ -46,11 +125,31 @@ async def entrypoint(ctx: JobContext):
     await asyncio.sleep(2)
 
     call_id_log_prefix = f"[{ctx.job.id}]"
+    set_log_context(job_id=ctx.job.id)
     logger.info(f"{call_id_log_prefix} Nouvel appel reçu pour la room: {ctx.room.name}")
 
+    # Métriques de l'appel : l'appel se poursuit après la fin de l'entrypoint, on clôture donc à l'arrêt du job.
+    call_started_at = time.monotonic()
+    call_outcome = {"statut": "termine"}
+    metrics.ACTIVE_CALLS.inc()
+
+    async def record_call_metrics():
+        metrics.ACTIVE_CALLS.dec()
+        metrics.CALL_DURATION.observe(time.monotonic() - call_started_at)
+        metrics.CALLS_TOTAL.labels(call_outcome["statut"]).inc()
+        loop_watchdog.release_job(ctx.job.id)
+        # Le processus d'appels peut s'arrêter avant la prochaine écriture périodique de ses métriques.
+        await asyncio.to_thread(metrics.flush_process_metrics)
+
+    ctx.add_shutdown_callback(record_call_metrics)
+    _ensure_loop_lag_sampler(ctx.job.id)
+
     # Initialisation avant le bloc try pour qu'ils soient accessibles partout
     db_driver = None
     session = None
+
+    # Les nouvelles versions de l'index sont chargées en arrière-plan et activées entre deux requêtes.
+    get_knowledge_index().start_watching()
     
     try:
         db_driver = ExtranetDatabaseDriver()
@@ -61,12 +160,14 @@ async def entrypoint(ctx: JobContext):
 
         async def shutdown_hook():
             # Ce hook s'exécute lors d'une déconnexion NORMALE
+            set_log_context(job_id=ctx.job.id)
             if session:
                 logger.info(f"{call_id_log_prefix} Le crochet d'arrêt est initié (déconnexion normale). Sauvegarde des données finales...")
                 history_list = [item.model_dump() for item in session.history.items]
                 transcription_json = json.dumps(history_list, ensure_ascii=False)
                 
                 call_journal_id = session.userdata.get('current_call_journal_id')
+                set_log_context(call_id=call_journal_id)
                 if call_journal_id and db_driver:
                     db_driver.enregistrer_fin_appel(
                         id_appel=call_journal_id,
@@ -74,25 +175,54 @@ async def entrypoint(ctx: JobContext):
                         statut='Terminé'
                     )
                     logger.info(f"{call_id_log_prefix} Données finales sauvegardées pour l'ID: {call_journal_id}")
+                    # Résumé / évaluation : traités par le processeur post-appel quelques secondes après la fin.
+                    await asyncio.to_thread(post_call.enqueue_post_call, call_journal_id, ctx.job.id)
 
         ctx.add_shutdown_callback(shutdown_hook)
 
         session = AgentSession()
         
-        caller_number = None
-        if ctx.room.metadata:
-            metadata = json.loads(ctx.room.metadata)
-            caller_number = metadata.get('caller_number')
-        
+        # Métadonnées posées par le webhook SIP sur le participant (à défaut, ancienne convention sur la salle).
+        participant = await ctx.wait_for_participant()
+        metadata = caller_identification.parse_metadata(participant.metadata) or caller_identification.parse_metadata(ctx.room.metadata)
+        caller_number = metadata.get('caller_number')
+        identification = metadata.get('identification')
+        identification = identification if isinstance(identification, dict) else {}
+
+        overflow = metadata.get('debordement')
+        if overflow:
+            # Appel non admis par le webhook (tous les agents occupés), reçu dans la marge de débordement
+            # du worker (AGENT_OVERFLOW_HEADROOM) : ni journal d'appel ni LLM.
+            call_outcome["statut"] = "debordement"
+            logger.info(f"{call_id_log_prefix} Appel en débordement ({overflow}).")
+            if overflow == "message":
+                session.userdata = {}
+                await session.start(artex_agent, room=ctx.room)
+                await session.say(OVERFLOW_BUSY_MESSAGE, allow_interruptions=False)
+            ctx.shutdown(reason=f"debordement_{overflow}")
+            return
+
         current_call_journal_id = db_driver.enregistrer_debut_appel(id_livekit_room=ctx.job.id, numero_appelant=caller_number)
+        set_log_context(call_id=current_call_journal_id)
         logger.info(f"{call_id_log_prefix} Appel enregistré dans la BDD avec l'ID: {current_call_journal_id}. Appelant: {caller_number or 'Inconnu'}")
         
         initial_userdata = artex_agent.get_initial_userdata()
         initial_userdata["current_call_journal_id"] = current_call_journal_id
         session.userdata = initial_userdata
 
-        initial_message = WELCOME_MESSAGE
-        if caller_number:
+        # Appel sortant d'une campagne de rappels : l'agent se présente comme rappelant.
+        initial_message = CALLBACK_MESSAGE if metadata.get('rappel') else WELCOME_MESSAGE
+        if identification.get('statut') == 'unique':
+            initial_message = caller_identification.greeting(identification['adherent'])
+            logger.info(f"{call_id_log_prefix} Appelant pré-identifié au webhook.")
+            preload = asyncio.create_task(_load_pre_identified_adherent(
+                session, db_driver, identification['adherent']['id_adherent'], current_call_journal_id,
+                caller_number, initial_message
+            ))
+            _background_tasks.add(preload)
+            preload.add_done_callback(_background_tasks.discard)
+        elif caller_number and identification.get('statut') not in caller_identification.SETTLED_STATUSES:
+            # Pas de pré-identification exploitable (désactivée, délai dépassé) : recherche ici.
             lookup_result = await lookup_adherent_by_telephone(session, telephone=caller_number)
             if "Bonjour, je m'adresse bien à" in lookup_result:
                 initial_message = lookup_result
@@ -104,6 +234,7 @@ async def entrypoint(ctx: JobContext):
 
     except Exception as e:
         logger.error(f"{call_id_log_prefix} Une erreur irrécupérable s'est produite: {e}", exc_info=True)
+        call_outcome["statut"] = "erreur"
         
         # --- AJOUT DE LA SAUVEGARDE DE SECOURS ---
         # Cette partie s'exécute si l'appel est interrompu par une ERREUR
@@ -127,4 +258,21 @@ async def entrypoint(ctx: JobContext):
 
 # --- Standard CLI Runner ---
 if __name__ == "__main__":
-    cli.run_app(WorkerOptions(entrypoint_fnc=entrypoint))
\ No newline at end of file
+    # AGENT_JOB_EXECUTOR=thread : appels traités dans des threads du worker (un seul registre de métriques)
+    # au lieu d'un processus par appel ; en mode process, le worker agrège les métriques des processus d'appels.
+    executor_type = JobExecutorType.THREAD if os.getenv("AGENT_JOB_EXECUTOR", "process").lower() == "thread" else JobExecutorType.PROCESS
+    if executor_type == JobExecutorType.PROCESS:
+        metrics.enable_process_aggregation(os.getenv("AGENT_METRICS_DIR"))
+    metrics.start_metrics_server()
+    post_call.start_post_call_worker()
+    admission.start_worker_heartbeat()
+    # AGENT_NAME : dispatch explicite (le webhook SIP et le composeur de campagnes dispatchent l'agent dans
+    # la salle de l'appel) ; vide : dispatch automatique dans chaque salle créée, incompatible avec SIP_WARM_ROOMS.
+    worker_options = WorkerOptions(entrypoint_fnc=entrypoint, prewarm_fnc=prewarm, job_executor_type=executor_type,
+                                   agent_name=os.getenv("AGENT_NAME", ""))
+    if admission.MAX_CALLS_PER_WORKER > 0:
+        # AGENT_MAX_CALLS : charge = appels actifs / (capacité + marge de débordement) ; LiveKit n'envoie plus
+        # de job à un worker plein, mais la marge lui permet d'accepter les appels en débordement « message ».
+        worker_options.load_fnc = admission.worker_load
+        worker_options.load_threshold = 1.0
+    cli.run_app(worker_options)
\ No newline at end of file
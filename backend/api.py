@@ -19,6 +19,7 @@ from tools import (
     update_contact_information,
     list_available_products,
     get_product_guarantees,  
+    rechercher_documentation_produit,
     # Outils de Contrat & Sinistre (Base Transactionnelle)
     list_adherent_contracts,
     create_claim,    
@@ -53,6 +54,7 @@ class ArtexAgent(Agent):
                 clear_context,
                 list_available_products,
                 get_product_guarantees,               
+                rechercher_documentation_produit,
                 # Libre-Service
                 update_contact_information,               
                 # Contrats & Sinistres (Transactionnel)
@@ -1,19 +1,147 @@
 # backend/build_knowledge_base.py
 import os
-import pickle
+import re
 import pandas as pd
 from io import StringIO # Nécessaire pour la nouvelle version de pandas
 from unstructured.partition.pdf import partition_pdf
-from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_community.vectorstores import FAISS
 from langchain_community.embeddings import HuggingFaceEmbeddings
+from kb_index import publish_index, DEFAULT_INDEX_ROOT
+
+# Taille cible d'un morceau (en caractères). Un morceau n'est jamais coupé au milieu
+# d'une ligne de tableau ou d'un paragraphe : il peut donc dépasser légèrement cette cible.
+MAX_CHUNK_CHARS = 1200
+
+# Éléments de mise en page sans valeur informative (en-têtes/pieds de page répétés, numéros de page).
+IGNORED_CATEGORIES = {"Header", "Footer", "PageNumber", "PageBreak"}
+
+
+def _context_line(document_name, section_title):
+    """Ligne de contexte placée en tête de chaque morceau pour qu'il reste compréhensible seul."""
+    if section_title:
+        return f"Document : {document_name} | Section : {section_title}"
+    return f"Document : {document_name}"
+
+
+def _split_long_text(text, max_chars):
+    """Découpe un paragraphe trop long aux limites de phrases."""
+    sentences = re.split(r'(?<=[.!?;])\s+', text)
+    parts, current = [], ""
+    for sentence in sentences:
+        if current and len(current) + len(sentence) + 1 > max_chars:
+            parts.append(current)
+            current = sentence
+        else:
+            current = f"{current} {sentence}".strip()
+    if current:
+        parts.append(current)
+    return parts
+
+
+def _parse_table(element):
+    """
+    Extrait l'en-tête et les lignes d'un tableau via sa représentation HTML.
+    Retourne (colonnes, lignes) ou None si la structure n'a pas pu être analysée.
+    """
+    table_html = getattr(element.metadata, 'text_as_html', None)
+    if not table_html:
+        return None
+    try:
+        df_list = pd.read_html(StringIO(table_html), header=0)
+    except Exception:
+        return None
+    if not df_list or df_list[0].empty:
+        return None
+    df = df_list[0]
+    columns = [str(col) for col in df.columns]
+    rows = []
+    for _, row in df.iterrows():
+        cells = [f"{col}: {val}" for col, val in row.dropna().items() if str(val).strip()]
+        if cells:
+            rows.append(" ; ".join(cells))
+    return (columns, rows) if rows else None
+
+
+def _table_chunks(context, columns, rows, max_chars):
+    """
+    Regroupe les lignes d'un tableau en morceaux autonomes : chaque morceau répète le titre
+    de section et l'en-tête du tableau, et ne contient que des lignes complètes.
+    """
+    header = f"{context}\nTableau (colonnes : {' | '.join(columns)})"
+    chunks, current = [], []
+    current_len = len(header)
+    for row in rows:
+        if current and current_len + len(row) + 1 > max_chars:
+            chunks.append("\n".join([header] + current))
+            current, current_len = [], len(header)
+        current.append(row)
+        current_len += len(row) + 1
+    if current:
+        chunks.append("\n".join([header] + current))
+    return chunks
+
+
+def chunk_document_elements(elements, document_name, max_chars=MAX_CHUNK_CHARS):
+    """
+    Découpe les éléments `unstructured` d'un document en suivant sa structure :
+    - un Title ouvre une nouvelle section (le texte en cours est clôturé) ;
+    - les paragraphes (NarrativeText, ListItem, ...) d'une même section sont regroupés jusqu'à la taille cible ;
+    - chaque Table produit ses propres morceaux, ligne par ligne, avec en-tête et titre de section.
+    Retourne une liste de (texte, métadonnées).
+    """
+    chunks = []
+    section_title = None
+    buffer = []
+
+    def flush_text():
+        if buffer:
+            text = "\n".join([_context_line(document_name, section_title)] + buffer)
+            chunks.append((text, {"source": document_name, "section": section_title or ""}))
+            buffer.clear()
+
+    for element in elements:
+        category = getattr(element, "category", None)
+        text = (element.text or "").strip()
+        if category in IGNORED_CATEGORIES:
+            continue
+
+        if category == "Title":
+            if text:
+                flush_text()
+                section_title = text
+            continue
+
+        if category == "Table":
+            flush_text()
+            context = _context_line(document_name, section_title)
+            parsed = _parse_table(element)
+            if parsed:
+                table_texts = _table_chunks(context, parsed[0], parsed[1], max_chars)
+            elif text:
+                # Repli : structure non analysable, on garde le texte brut du tableau avec son contexte.
+                table_texts = [f"{context}\nTableau (texte brut) : {part}" for part in _split_long_text(text, max_chars)]
+            else:
+                table_texts = []
+            chunks.extend((t, {"source": document_name, "section": section_title or "", "type": "tableau"}) for t in table_texts)
+            continue
+
+        if not text:
+            continue
+        for part in (_split_long_text(text, max_chars) if len(text) > max_chars else [text]):
+            if buffer and sum(len(b) + 1 for b in buffer) + len(part) > max_chars:
+                flush_text()
+            buffer.append(part)
+
+    flush_text()
+    return chunks
+
 
 def process_document_elements_final(docs_path):
     """
-    Analyse les documents PDF en extrayant les tableaux de manière robuste.
+    Analyse les documents PDF et les découpe en morceaux structurés (sections, paragraphes, tableaux).
     S'il ne peut pas parser la structure d'un tableau, il utilise son contenu textuel comme repli.
     """
-    all_texts = []
+    all_chunks = []
     print(f"Début de l'analyse structurelle des documents (mode final) dans : {docs_path}")
 
     for root, _, files in os.walk(docs_path):
@@ -23,71 +151,48 @@ def process_document_elements_final(docs_path):
 
             file_path = os.path.join(root, filename)
             print(f"  -> Traitement du PDF : {file_path}")
-            
+
             try:
                 elements = partition_pdf(filename=file_path, strategy="hi_res", infer_table_structure=True)
-
-                for element in elements:
-                    is_table = "unstructured.documents.elements.Table" in str(type(element))
-                    
-                    if is_table:
-                        table_html = getattr(element.metadata, 'text_as_html', None)
-                        table_parsed = False
-                        
-                        if table_html:
-                            try:
-                                # Correction pour le FutureWarning de pandas
-                                df_list = pd.read_html(StringIO(table_html), header=0)
-                                if df_list:
-                                    df = df_list[0]
-                                    if not df.empty:
-                                        print(f"    -> Tableau détecté, conversion via HTML réussie.")
-                                        for _, row in df.iterrows():
-                                            row_text = ", ".join([f"{col}: {val}" for col, val in row.dropna().items()])
-                                            all_texts.append(f"Information d'un tableau : {row_text}.")
-                                        table_parsed = True
-                            except Exception:
-                                # L'analyse HTML a échoué, on passera au texte brut
-                                pass
-                        
-                        # Stratégie de repli : si le tableau n'a pas pu être parsé, on prend son texte brut.
-                        if not table_parsed:
-                            print(f"    -> Avertissement : Impossible de parser la structure du tableau. Utilisation du texte brut de l'élément.")
-                            if element.text:
-                                all_texts.append(f"Texte brut d'un tableau : {element.text}")
-                    else:
-                        all_texts.append(element.text)
-            
+                document_name = os.path.splitext(os.path.relpath(file_path, docs_path))[0]
+                document_chunks = chunk_document_elements(elements, document_name)
+                print(f"    -> {len(document_chunks)} morceaux structurés.")
+                all_chunks.extend(document_chunks)
             except Exception as e:
                 print(f"    /!\\ Erreur majeure lors du traitement du fichier {filename}: {e}")
 
-    return "\n\n".join(all_texts)
+    return all_chunks
 
 def main():
     print("Construction de la base de connaissances (Mode Final et Robuste)...")
     docs_path = os.path.join(os.path.dirname(__file__), 'knowledge_documents')
-    
+
     if not os.path.exists(docs_path):
         print(f"ERREUR : Le dossier '{docs_path}' n'existe pas.")
         return
 
-    structured_text = process_document_elements_final(docs_path)
-    if not structured_text:
+    chunks = process_document_elements_final(docs_path)
+    if not chunks:
         print("Aucun contenu n'a pu être extrait. Arrêt.")
         return
-    
-    # Le reste du script est inchangé
-    print(f"\nExtraction terminée. Total de {len(structured_text)} caractères structurés.")
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200, length_function=len)
-    chunks = text_splitter.split_text(text=structured_text)
-    print(f"Texte global découpé en {len(chunks)} morceaux.")
-    embeddings = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
-    vector_store_path = os.path.join(os.path.dirname(__file__), 'vector_store.pkl')
+
+    texts = [text for text, _ in chunks]
+    metadatas = [metadata for _, metadata in chunks]
+    total_chars = sum(len(t) for t in texts)
+    print(f"\nExtraction terminée. {len(texts)} morceaux, {total_chars} caractères "
+          f"(moyenne {total_chars // len(texts)} caractères par morceau).")
+    embedding_model = "sentence-transformers/all-MiniLM-L6-v2"
+    embeddings = HuggingFaceEmbeddings(model_name=embedding_model)
     print("Création de la base de données vectorielle...")
-    vector_store = FAISS.from_texts(chunks, embedding=embeddings)
-    with open(vector_store_path, "wb") as f:
-        pickle.dump(vector_store, f)
-    print(f"\nSuccès ! La base de connaissances avancée a été sauvegardée dans '{vector_store_path}'.")
+    vector_store = FAISS.from_texts(texts, embedding=embeddings, metadatas=metadatas)
+    # Publication en version immuable : les workers de l'agent la chargent à chaud, sans redémarrage.
+    version = publish_index(vector_store, {
+        "nombre_morceaux": len(texts),
+        "nombre_caracteres": total_chars,
+        "taille_cible_morceau": MAX_CHUNK_CHARS,
+        "modele_embeddings": embedding_model,
+    }, root=os.getenv("KB_INDEX_ROOT", DEFAULT_INDEX_ROOT))
+    print(f"\nSuccès ! La version '{version}' de la base de connaissances a été publiée.")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
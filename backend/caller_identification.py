@@ -0,0 +1,100 @@
+# caller_identification.py
+#
+# Pré-identification de l'appelant au moment du webhook SIP (inbound_sip_handler.py).
+# Le numéro de l'appelant est connu avant même le démarrage du job de l'agent : le webhook lance la
+# recherche par téléphone en parallèle de la préparation de la salle, l'attend au plus
+# SIP_CALLER_LOOKUP_TIMEOUT_MS, et place le résultat dans les métadonnées du participant SIP :
+#
+#   {"caller_number": "+33612345678",
+#    "identification": {"statut": "unique", "adherent": {"id_adherent": 42, "prenom": "Marie", "nom": "Dupont"}}}
+#
+# statut : unique | multiple | aucun (recherche faite) ; delai_depasse | erreur (l'agent refait la recherche).
+# agent.py salue alors l'appelant par son nom sans requête BD sur le chemin critique.
+# La recherche du webhook est un simple SELECT, sans journalisation dans interactions_bd (pas encore
+# d'id d'appel, et pas de seconde connexion ni d'INSERT dans le budget) : agent.py journalise la
+# recherche une fois l'appel créé.
+# Un appel en débordement (admission.py) porte en plus "debordement": "message".
+# Comme kpi_rollups, ce module n'importe pas db_driver : les fonctions reçoivent le driver.
+
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import Any, Dict, Optional
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+LOOKUP_TIMEOUT_SECONDS = float(os.getenv("SIP_CALLER_LOOKUP_TIMEOUT_MS", "300")) / 1000
+SETTLED_STATUSES = ("unique", "multiple", "aucun")
+
+CALLER_LOOKUPS = metrics.REGISTRY.counter("artex_sip_caller_lookups", "Pré-identifications de l'appelant au webhook, par résultat.", ["resultat"])
+CALLER_LOOKUP_LATENCY = metrics.REGISTRY.histogram("artex_sip_caller_lookup_seconds", "Durée de la recherche de l'appelant par téléphone (webhook).")
+
+
+def lookup_candidate(db, caller_number: str) -> Dict[str, Any]:
+    """Recherche bloquante (à exécuter dans un thread) : un candidat seulement si le numéro est sans ambiguïté."""
+    with CALLER_LOOKUP_LATENCY.time():
+        with db._get_connection() as conn:
+            cursor = conn.cursor()
+            # Même critère que get_adherents_by_telephone ; deux lignes suffisent à détecter l'ambiguïté.
+            cursor.execute(
+                "SELECT id_adherent, prenom, nom FROM adherents WHERE telephone LIKE %s LIMIT 2",
+                (f"%{caller_number.strip()}",),
+            )
+            rows = cursor.fetchall()
+    if len(rows) == 1:
+        id_adherent, prenom, nom = rows[0]
+        return {"statut": "unique", "adherent": {"id_adherent": id_adherent, "prenom": prenom, "nom": nom}}
+    return {"statut": "multiple" if rows else "aucun"}
+
+
+def start_lookup(db, caller_number: str) -> "asyncio.Future":
+    """Lance la recherche en arrière-plan ; le résultat est récupéré par await_lookup."""
+    return asyncio.ensure_future(asyncio.to_thread(lookup_candidate, db, caller_number))
+
+
+async def await_lookup(lookup: "asyncio.Future", deadline: float) -> Dict[str, Any]:
+    """
+    Attend le résultat jusqu'à `deadline` (horloge time.monotonic). Une recherche trop lente
+    n'est pas attendue : le thread se termine en arrière-plan et son résultat est ignoré.
+    """
+    try:
+        result = await asyncio.wait_for(lookup, timeout=max(0.0, deadline - time.monotonic()))
+    except asyncio.TimeoutError:
+        result = {"statut": "delai_depasse"}
+    except Exception as e:
+        logger.warning(f"Pré-identification de l'appelant impossible : {e}")
+        result = {"statut": "erreur"}
+    CALLER_LOOKUPS.labels(result["statut"]).inc()
+    return result
+
+
+def build_participant_metadata(caller_number: str, identification: Optional[Dict[str, Any]] = None,
+                               overflow: Optional[str] = None) -> str:
+    """`overflow` : action de débordement (admission.py) si l'appel n'a pas été admis."""
+    data: Dict[str, Any] = {"caller_number": caller_number}
+    if identification is not None:
+        data["identification"] = identification
+    if overflow is not None:
+        data["debordement"] = overflow
+    return json.dumps(data, ensure_ascii=False)
+
+
+def parse_metadata(raw: Optional[str]) -> Dict[str, Any]:
+    """Métadonnées JSON d'un participant ou d'une salle ({} si absentes ou illisibles)."""
+    if not raw:
+        return {}
+    try:
+        data = json.loads(raw)
+    except ValueError:
+        logger.warning(f"Métadonnées illisibles ignorées : {raw[:200]}")
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+def greeting(adherent: Dict[str, Any]) -> str:
+    """Même formule que la recherche par téléphone de tools.py."""
+    return f"Bonjour, je m'adresse bien à {adherent['prenom']} {adherent['nom']} ?"
@@ -0,0 +1,665 @@
+# campaign_dialer.py
+#
+# Composeur de campagnes d'appels sortants (généralisation de call_test.py) : les numéros de la table
+# rappels (migration 007) sont composés via CreateSIPParticipant avec une concurrence et un nombre
+# d'appels par seconde bornés, uniquement dans les plages horaires autorisées (heure de Paris).
+# Chaque tentative est enregistrée (rappels_tentatives, écritures groupées) et, selon son issue,
+# le rappel est clos (joint, abandonne) ou reprogrammé par la politique de nouvelles tentatives.
+# L'agent est dispatché dans la salle de l'appel ; les métadonnées du participant SIP portent
+# caller_number et le rappel (voir caller_identification.py).
+#
+# Comme evaluation_queue, ce module n'importe pas db_driver : les fonctions reçoivent un curseur ou le driver.
+#
+#   python campaign_dialer.py run --concurrency 4 --cps 1 [--follow]
+#   python campaign_dialer.py enqueue --telephone +33612345678 --motif "Devis habitation"
+#   python campaign_dialer.py status
+#   python campaign_dialer.py simulate 500 --cps 20 --concurrency 30   # doublure locale de l'API SIP
+
+import asyncio
+import json
+import logging
+import os
+import random
+import socket
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from datetime import time as dtime
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+from zoneinfo import ZoneInfo
+
+import metrics
+from rate_limiter import AsyncRateLimiter
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONCURRENCY = int(os.getenv("CAMPAIGN_CONCURRENCY", "4"))
+DEFAULT_CALLS_PER_SECOND = float(os.getenv("CAMPAIGN_CALLS_PER_SECOND", "1"))
+DEFAULT_WRITE_BATCH_SIZE = int(os.getenv("CAMPAIGN_WRITE_BATCH_SIZE", "20"))
+LEASE_SECONDS = int(os.getenv("CAMPAIGN_LEASE_SECONDS", "300"))
+POLL_SECONDS = 5.0
+FLUSH_SECONDS = 2.0 # Écriture des issues au plus tard après ce délai, même si le lot n'est pas plein
+# Rappel demandé pendant un appel : l'appelant est encore en ligne, le composeur attend ce délai.
+CALLBACK_DELAY_SECONDS = int(os.getenv("CAMPAIGN_CALLBACK_DELAY_SECONDS", "900"))
+
+# Issues d'une tentative
+REPONDU = "repondu"
+OCCUPE = "occupe"
+PAS_DE_REPONSE = "pas_de_reponse"
+NUMERO_INVALIDE = "numero_invalide"
+REFUSE = "refuse"
+ERREUR = "erreur"
+
+# Codes SIP de l'échec de CreateSIPParticipant (wait_until_answered) -> issue
+SIP_STATUS_OUTCOMES = {
+    486: OCCUPE, 600: OCCUPE,
+    408: PAS_DE_REPONSE, 480: PAS_DE_REPONSE, 487: PAS_DE_REPONSE,
+    404: NUMERO_INVALIDE, 484: NUMERO_INVALIDE, 604: NUMERO_INVALIDE,
+    403: REFUSE, 603: REFUSE,
+}
+
+DIAL_ATTEMPTS = metrics.REGISTRY.counter("artex_campaign_attempts", "Tentatives d'appel sortant, par issue.", ["issue"])
+DIAL_LATENCY = metrics.REGISTRY.histogram(
+    "artex_campaign_dial_seconds", "Durée d'une tentative (composition jusqu'au décroché ou à l'échec).",
+    buckets=(0.5, 1, 2.5, 5, 10, 20, 30, 45, 60, 90),
+)
+
+
+def default_dialer_id() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+@dataclass
+class CallbackJob:
+    id_rappel: int
+    telephone: str
+    motif: Optional[str] = None
+    tentatives: int = 0 # Tentatives déjà faites, celle-ci comprise une fois réservée
+    id_adherent: Optional[int] = None
+
+
+@dataclass
+class AttemptOutcome:
+    id_rappel: int
+    numero_tentative: int
+    debut: datetime
+    duree_ms: int
+    issue: str
+    code_sip: Optional[int] = None
+    detail: Optional[str] = None
+    salle: Optional[str] = None
+    statut: str = "abandonne" # Statut du rappel après cette tentative
+    delai_secondes: int = 0 # Avant la tentative suivante (statut en_attente)
+
+
+# --- Plages horaires et nouvelles tentatives ---
+
+@dataclass
+class CallingWindow:
+    """
+    Plages horaires d'appel, ex. "09:00-12:30,13:30-19:00" les jours `days` (0 = lundi),
+    dans le fuseau `timezone` (CAMPAIGN_WINDOWS, CAMPAIGN_DAYS, CAMPAIGN_TIMEZONE).
+    """
+    ranges: Sequence[Tuple[dtime, dtime]]
+    days: Sequence[int] = (0, 1, 2, 3, 4)
+    timezone: str = "Europe/Paris"
+
+    @classmethod
+    def parse(cls, ranges: str, days: str = "0-4", timezone: str = "Europe/Paris") -> "CallingWindow":
+        parsed = []
+        for part in ranges.split(","):
+            start, end = part.strip().split("-")
+            parsed.append((dtime.fromisoformat(start), dtime.fromisoformat(end)))
+        day_set = set()
+        for part in days.split(","):
+            first, _, last = part.strip().partition("-")
+            day_set.update(range(int(first), int(last or first) + 1))
+        return cls(sorted(parsed), tuple(sorted(day_set)), timezone)
+
+    @classmethod
+    def from_env(cls) -> "CallingWindow":
+        return cls.parse(
+            os.getenv("CAMPAIGN_WINDOWS", "09:00-12:30,13:30-19:00"),
+            os.getenv("CAMPAIGN_DAYS", "0-4"),
+            os.getenv("CAMPAIGN_TIMEZONE", "Europe/Paris"),
+        )
+
+    @classmethod
+    def always(cls) -> "CallingWindow":
+        return cls([(dtime(0, 0), dtime(23, 59, 59, 999999))], tuple(range(7)))
+
+    def _local(self, when: Optional[datetime]) -> datetime:
+        tz = ZoneInfo(self.timezone)
+        return datetime.now(tz) if when is None else when.astimezone(tz)
+
+    def is_open(self, when: Optional[datetime] = None) -> bool:
+        local = self._local(when)
+        if local.weekday() not in self.days:
+            return False
+        return any(start <= local.time() < end for start, end in self.ranges)
+
+    def next_open(self, when: Optional[datetime] = None) -> datetime:
+        """Premier instant >= `when` dans une plage (dans le fuseau de la campagne)."""
+        local = self._local(when)
+        if self.is_open(local):
+            return local
+        for offset in range(8):
+            day = (local + timedelta(days=offset)).date()
+            if day.weekday() not in self.days:
+                continue
+            for start, _ in self.ranges:
+                candidate = datetime.combine(day, start, tzinfo=local.tzinfo)
+                if candidate >= local:
+                    return candidate
+        raise ValueError("Aucune plage horaire d'appel configurée.")
+
+    def seconds_until_open(self, when: Optional[datetime] = None) -> float:
+        local = self._local(when)
+        return max(0.0, (self.next_open(local) - local).total_seconds())
+
+
+@dataclass
+class RetryPolicy:
+    """
+    Délai avant la tentative suivante selon l'issue, doublé à chaque tentative (plafonné à `max_delay`).
+    Les issues absentes de `delays` sont définitives (joint, numéro invalide, refus).
+    """
+    max_attempts: int = int(os.getenv("CAMPAIGN_MAX_ATTEMPTS", "4"))
+    delays: Dict[str, int] = field(default_factory=lambda: {OCCUPE: 600, PAS_DE_REPONSE: 1800, ERREUR: 300})
+    max_delay: int = 6 * 3600
+
+    def decide(self, issue: str, attempts: int) -> Tuple[str, int]:
+        """Retourne (statut du rappel, délai en secondes avant la tentative suivante)."""
+        if issue == REPONDU:
+            return "joint", 0
+        if issue not in self.delays or attempts >= self.max_attempts:
+            return "abandonne", 0
+        return "en_attente", min(self.max_delay, self.delays[issue] * 2 ** max(0, attempts - 1))
+
+
+# --- Clients SIP ---
+
+class LiveKitSipClient:
+    """
+    CreateSIPParticipant avec attente du décroché : l'appel aboutit dans une salle où l'agent est dispatché.
+    Avec `agent_name` (worker en dispatch explicite, AGENT_NAME), l'agent est dispatché dans la salle avant la composition.
+    Si l'appel n'est pas décroché (ou en cas d'erreur), la salle est supprimée : l'agent dispatché n'y attend pas
+    un participant qui ne viendra jamais.
+    """
+
+    def __init__(self, lk_api, trunk_id: str, agent_name: str = ""):
+        self.lk_api = lk_api
+        self.trunk_id = trunk_id
+        self.agent_name = agent_name
+
+    async def dial(self, job: CallbackJob, room_name: str) -> Tuple[str, Optional[int], Optional[str]]:
+        from livekit import api
+
+        answered = False
+        try:
+            if self.agent_name:
+                await self.lk_api.agent_dispatch.create_dispatch(
+                    api.CreateAgentDispatchRequest(agent_name=self.agent_name, room=room_name)
+                )
+            issue, code, detail = await self._create_participant(job, room_name)
+            answered = issue == REPONDU
+            return issue, code, detail
+        finally:
+            if not answered:
+                await self._delete_room(room_name)
+
+    async def _create_participant(self, job: CallbackJob, room_name: str) -> Tuple[str, Optional[int], Optional[str]]:
+        from livekit import api
+        from livekit.protocol.sip import CreateSIPParticipantRequest
+
+        request = CreateSIPParticipantRequest(
+            sip_trunk_id=self.trunk_id,
+            sip_call_to=job.telephone,
+            room_name=room_name,
+            participant_identity=f"rappel-{job.id_rappel}",
+            participant_name=f"Rappel ({job.telephone})",
+            participant_metadata=json.dumps(
+                {"caller_number": job.telephone, "rappel": {"id_rappel": job.id_rappel, "motif": job.motif}},
+                ensure_ascii=False,
+            ),
+            wait_until_answered=True,
+        )
+        try:
+            await self.lk_api.sip.create_sip_participant(request)
+        except api.TwirpError as e:
+            status = (e.metadata or {}).get("sip_status_code")
+            code = int(status) if status and str(status).isdigit() else None
+            if e.code == "resource_exhausted":
+                raise RateLimitedError(e.message) from e
+            return SIP_STATUS_OUTCOMES.get(code, ERREUR), code, e.message
+        return REPONDU, 200, None
+
+    async def _delete_room(self, room_name: str):
+        from livekit import api
+
+        try:
+            await self.lk_api.room.delete_room(api.DeleteRoomRequest(room=room_name))
+        except Exception as e:
+            logger.warning(f"Suppression de la salle {room_name} impossible : {e}")
+
+
+class RateLimitedError(Exception):
+    """Le serveur SIP refuse la composition (quota dépassé) : tentative non comptée, débit réduit."""
+
+
+class FakeSipClient:
+    """
+    Doublure locale de l'API SIP : durée de sonnerie aléatoire, issues tirées selon `outcomes`,
+    refus de quota au-delà de `max_calls_per_second` sur une fenêtre glissante d'une seconde.
+    Mesure la concurrence et le débit réellement observés.
+    """
+
+    def __init__(self, latency: float = 2.0, max_calls_per_second: float = 0,
+                 outcomes: Optional[Dict[str, float]] = None):
+        self.latency = latency
+        self.max_calls_per_second = max_calls_per_second
+        self.outcomes = outcomes or {REPONDU: 0.55, OCCUPE: 0.15, PAS_DE_REPONSE: 0.2, NUMERO_INVALIDE: 0.05, ERREUR: 0.05}
+        self.calls = 0
+        self.rejected = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.max_calls_in_one_second = 0
+        self._recent: List[float] = []
+
+    async def dial(self, job: CallbackJob, room_name: str) -> Tuple[str, Optional[int], Optional[str]]:
+        now = time.monotonic()
+        self._recent = [t for t in self._recent if now - t < 1.0]
+        if self.max_calls_per_second and len(self._recent) >= self.max_calls_per_second:
+            self.rejected += 1
+            raise RateLimitedError("429 trop d'appels par seconde (simulation)")
+        self._recent.append(now)
+        self.max_calls_in_one_second = max(self.max_calls_in_one_second, len(self._recent))
+        self.calls += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            issue = random.choices(list(self.outcomes), weights=list(self.outcomes.values()))[0]
+            # Un numéro invalide échoue tout de suite ; une absence de réponse sonne jusqu'au bout.
+            factor = {NUMERO_INVALIDE: 0.1, PAS_DE_REPONSE: 2.0}.get(issue, 1.0)
+            await asyncio.sleep(self.latency * factor * random.uniform(0.5, 1.5))
+        finally:
+            self.in_flight -= 1
+        code = {REPONDU: 200, OCCUPE: 486, PAS_DE_REPONSE: 480, NUMERO_INVALIDE: 404, ERREUR: 503}.get(issue)
+        return issue, code, None if issue == REPONDU else f"SIP {code} (simulation)"
+
+
+# --- File des rappels (MySQL) ---
+
+def enqueue_callback(cursor, telephone: Optional[str], motif: Optional[str], id_appel: Optional[int] = None,
+                     id_adherent: Optional[int] = None, campagne: str = "rappels_conseiller",
+                     delay_seconds: int = 0) -> Optional[int]:
+    """
+    Ajoute un rappel à la file, composable après `delay_seconds`. Sans `telephone`, le numéro de
+    l'appel d'origine est repris. Retourne l'id du rappel, ou None si aucun numéro n'est connu.
+    """
+    if telephone:
+        cursor.execute("""
+            INSERT INTO rappels (telephone, motif, campagne, id_appel_origine, id_adherent_fk, disponible_a)
+            VALUES (%s, %s, %s, %s, %s, NOW() + INTERVAL %s SECOND)
+        """, (telephone, motif, campagne, id_appel, id_adherent, delay_seconds))
+    elif id_appel:
+        cursor.execute("""
+            INSERT INTO rappels (telephone, motif, campagne, id_appel_origine, id_adherent_fk, disponible_a)
+            SELECT numero_appelant, %s, %s, id_appel, %s, NOW() + INTERVAL %s SECOND FROM journal_appels
+            WHERE id_appel = %s AND numero_appelant IS NOT NULL AND numero_appelant != ''
+        """, (motif, campagne, id_adherent, delay_seconds, id_appel))
+    else:
+        return None
+    return cursor.lastrowid if cursor.rowcount else None
+
+
+class MySQLCallbackStore:
+    """File des rappels en base (réservation SELECT ... FOR UPDATE SKIP LOCKED, comme evaluation_jobs)."""
+
+    def __init__(self, db, dialer_id: Optional[str] = None, campagne: Optional[str] = None,
+                 lease_seconds: int = LEASE_SECONDS):
+        self.db = db
+        self.dialer_id = dialer_id or default_dialer_id()
+        self.campagne = campagne
+        self.lease_seconds = lease_seconds
+
+    def claim(self, limit: int) -> List[CallbackJob]:
+        campaign_filter = "AND campagne = %s" if self.campagne else ""
+        with self.db._get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f"""
+                SELECT id_rappel, telephone, motif, nb_tentatives, id_adherent_fk FROM rappels
+                WHERE statut IN ('en_attente', 'en_cours') AND disponible_a <= NOW() {campaign_filter}
+                ORDER BY disponible_a
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            """, ((self.campagne,) if self.campagne else ()) + (limit,))
+            rows = cursor.fetchall()
+            if not rows:
+                conn.rollback()
+                return []
+            placeholders = ", ".join(["%s"] * len(rows))
+            cursor.execute(f"""
+                UPDATE rappels
+                SET statut = 'en_cours', nb_tentatives = nb_tentatives + 1, composeur = %s,
+                    disponible_a = NOW() + INTERVAL %s SECOND
+                WHERE id_rappel IN ({placeholders})
+            """, (self.dialer_id, self.lease_seconds, *[row[0] for row in rows]))
+            conn.commit()
+        return [CallbackJob(row[0], row[1], row[2], row[3] + 1, row[4]) for row in rows]
+
+    def save(self, outcomes: List[AttemptOutcome]) -> int:
+        """Écrit un lot de tentatives et met à jour les rappels correspondants (une transaction)."""
+        if not outcomes:
+            return 0
+        with self.db._get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.executemany("""
+                INSERT INTO rappels_tentatives (id_rappel_fk, numero_tentative, debut, duree_ms, issue, code_sip, detail, salle)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+            """, [(o.id_rappel, o.numero_tentative, o.debut, o.duree_ms, o.issue, o.code_sip,
+                   (o.detail or "")[:500] or None, o.salle) for o in outcomes])
+            cursor.executemany("""
+                UPDATE rappels
+                SET statut = %s, derniere_issue = %s, disponible_a = NOW() + INTERVAL %s SECOND
+                WHERE id_rappel = %s AND composeur = %s AND statut = 'en_cours'
+            """, [(o.statut, o.issue, o.delai_secondes, o.id_rappel, self.dialer_id) for o in outcomes])
+            conn.commit()
+        return len(outcomes)
+
+    def release(self, job: CallbackJob, delay_seconds: int):
+        """Rend un rappel réservé sans compter la tentative (plage horaire fermée, quota SIP)."""
+        with self.db._get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                UPDATE rappels
+                SET statut = 'en_attente', nb_tentatives = GREATEST(0, nb_tentatives - 1),
+                    disponible_a = NOW() + INTERVAL %s SECOND
+                WHERE id_rappel = %s AND composeur = %s AND statut = 'en_cours'
+            """, (delay_seconds, job.id_rappel, self.dialer_id))
+            conn.commit()
+
+    def pending(self) -> int:
+        with self.db._get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT COUNT(*) FROM rappels WHERE statut IN ('en_attente', 'en_cours')")
+            return cursor.fetchone()[0]
+
+
+def campaign_status(db) -> Dict[str, int]:
+    with db._get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT statut, COUNT(*) FROM rappels GROUP BY statut")
+        return {status: count for status, count in cursor.fetchall()}
+
+
+class MemoryCallbackStore:
+    """File en mémoire (simulation) : même interface que MySQLCallbackStore, délais réduits d'un facteur `time_scale`."""
+
+    def __init__(self, numbers: Sequence[str], time_scale: float = 1.0):
+        self.time_scale = time_scale
+        self.jobs = {i: CallbackJob(i, number) for i, number in enumerate(numbers, start=1)}
+        self.available_at = {i: 0.0 for i in self.jobs}
+        self.status = {i: "en_attente" for i in self.jobs}
+        self.outcomes: List[AttemptOutcome] = []
+        self.writes = 0
+
+    def claim(self, limit: int) -> List[CallbackJob]:
+        now = time.monotonic()
+        ready = sorted((t, i) for i, t in self.available_at.items() if self.status[i] == "en_attente" and t <= now)
+        claimed = []
+        for _, i in ready[:limit]:
+            self.status[i] = "en_cours"
+            self.jobs[i].tentatives += 1
+            claimed.append(CallbackJob(i, self.jobs[i].telephone, tentatives=self.jobs[i].tentatives))
+        return claimed
+
+    def save(self, outcomes: List[AttemptOutcome]) -> int:
+        self.writes += 1
+        now = time.monotonic()
+        for o in outcomes:
+            self.outcomes.append(o)
+            self.status[o.id_rappel] = o.statut
+            self.available_at[o.id_rappel] = now + o.delai_secondes * self.time_scale
+        return len(outcomes)
+
+    def release(self, job: CallbackJob, delay_seconds: int):
+        self.jobs[job.id_rappel].tentatives -= 1
+        self.status[job.id_rappel] = "en_attente"
+        self.available_at[job.id_rappel] = time.monotonic() + delay_seconds * self.time_scale
+
+    def pending(self) -> int:
+        return sum(1 for status in self.status.values() if status in ("en_attente", "en_cours"))
+
+
+# --- Composeur ---
+
+@dataclass
+class CampaignStats:
+    attempts: int = 0
+    outcomes: Dict[str, int] = field(default_factory=dict)
+    retries_scheduled: int = 0
+    rate_limited: int = 0
+    written: int = 0
+    started_at: float = field(default_factory=time.monotonic)
+
+    def log_progress(self, limiter: AsyncRateLimiter, in_flight: int):
+        elapsed = max(time.monotonic() - self.started_at, 1e-6)
+        outcomes = ", ".join(f"{issue} {count}" for issue, count in sorted(self.outcomes.items())) or "aucune"
+        logger.info(
+            f"Campagne : {self.attempts} tentatives ({outcomes}) - {self.attempts / elapsed:.2f} appels/s - "
+            f"{in_flight} en cours - {self.retries_scheduled} nouvelles tentatives programmées - "
+            f"{self.rate_limited} refus de quota - {self.written} issues écrites - "
+            f"limite actuelle {limiter.current_requests_per_minute / 60:.2f} appels/s"
+        )
+
+
+class _OutcomeWriter:
+    """Accumule les issues et les écrit par lots, dans un thread (l'écriture est synchrone)."""
+
+    def __init__(self, save: Callable[[List[AttemptOutcome]], int], batch_size: int, stats: CampaignStats):
+        self.save = save
+        self.batch_size = batch_size
+        self.stats = stats
+        self._pending: List[AttemptOutcome] = []
+        self._lock = asyncio.Lock()
+        self._flushed_at = time.monotonic()
+
+    async def add(self, outcome: AttemptOutcome):
+        self._pending.append(outcome)
+        if len(self._pending) >= self.batch_size or time.monotonic() - self._flushed_at >= FLUSH_SECONDS:
+            await self.flush()
+
+    async def flush(self):
+        async with self._lock:
+            batch, self._pending = self._pending, []
+            self._flushed_at = time.monotonic()
+            if batch:
+                self.stats.written += await asyncio.to_thread(self.save, batch)
+
+
+async def run_campaign(store, sip_client, concurrency: int = DEFAULT_CONCURRENCY,
+                       calls_per_second: float = DEFAULT_CALLS_PER_SECOND,
+                       window: Optional[CallingWindow] = None, policy: Optional[RetryPolicy] = None,
+                       write_batch_size: int = DEFAULT_WRITE_BATCH_SIZE, follow: bool = False,
+                       drain: bool = False, poll_seconds: float = POLL_SECONDS,
+                       room_prefix: str = "rappel-") -> CampaignStats:
+    """
+    Compose les rappels de `store` avec `concurrency` tentatives simultanées et `calls_per_second` compositions
+    par seconde au plus. S'arrête quand plus rien n'est disponible, sauf avec `follow` (service) ou `drain`
+    (attendre aussi les nouvelles tentatives programmées, pour la simulation). Les accès à `store` sont synchrones
+    et exécutés dans des threads.
+    """
+    window = window or CallingWindow.from_env()
+    policy = policy or RetryPolicy()
+    # Sans rafale : compositions espacées de 1/calls_per_second, le plafond vaut aussi sur toute fenêtre d'une seconde.
+    limiter = AsyncRateLimiter(calls_per_second * 60, burst_seconds=0)
+    stats = CampaignStats()
+    writer = _OutcomeWriter(store.save, write_batch_size, stats)
+    in_flight: set = set()
+    progress_every = 30.0
+    last_progress = time.monotonic()
+
+    async def attempt(job: CallbackJob):
+        try:
+            await limiter.acquire()
+            if not window.is_open():
+                # La plage a fermé pendant l'attente : le rappel est rendu pour la prochaine ouverture.
+                await asyncio.to_thread(store.release, job, int(window.seconds_until_open()))
+                return
+            room_name = f"{room_prefix}{job.id_rappel}-{job.tentatives}"
+            started, started_at = time.perf_counter(), datetime.now()
+            try:
+                issue, code, detail = await sip_client.dial(job, room_name)
+            except RateLimitedError as e:
+                limiter.on_rate_limited(None)
+                stats.rate_limited += 1
+                logger.debug(f"Rappel {job.id_rappel} : quota SIP atteint ({e}), tentative rendue.")
+                await asyncio.to_thread(store.release, job, 1)
+                return
+            except Exception as e:
+                issue, code, detail = ERREUR, None, str(e)
+            else:
+                limiter.on_success()
+            elapsed = time.perf_counter() - started
+            DIAL_LATENCY.observe(elapsed)
+            DIAL_ATTEMPTS.labels(issue).inc()
+            status, delay = policy.decide(issue, job.tentatives)
+            if status == "en_attente":
+                # Nouvelle tentative après le délai, décalée à la prochaine plage horaire si besoin.
+                retry_at = datetime.now(ZoneInfo(window.timezone)) + timedelta(seconds=delay)
+                delay = int(delay + window.seconds_until_open(retry_at))
+                stats.retries_scheduled += 1
+            stats.attempts += 1
+            stats.outcomes[issue] = stats.outcomes.get(issue, 0) + 1
+            await writer.add(AttemptOutcome(
+                job.id_rappel, job.tentatives, started_at, int(elapsed * 1000), issue, code, detail,
+                room_name if issue == REPONDU else None, status, delay,
+            ))
+        except Exception as e:
+            logger.error(f"Rappel {job.id_rappel} : tentative en échec : {e}", exc_info=True)
+
+    try:
+        while True:
+            if time.monotonic() - last_progress >= progress_every:
+                stats.log_progress(limiter, len(in_flight))
+                last_progress = time.monotonic()
+
+            if not window.is_open():
+                wait = window.seconds_until_open()
+                if not (follow or drain):
+                    logger.info(f"Hors plage horaire d'appel : prochaine ouverture dans {wait / 60:.0f} min.")
+                    break
+                await writer.flush()
+                await asyncio.sleep(min(wait, poll_seconds))
+                continue
+
+            # Réservation seulement quand une place est libre : pas de rappel bloqué dans une file locale.
+            free = concurrency - len(in_flight)
+            if free <= 0:
+                await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                continue
+            jobs = await asyncio.to_thread(store.claim, free)
+            for job in jobs:
+                task = asyncio.create_task(attempt(job))
+                in_flight.add(task)
+                task.add_done_callback(in_flight.discard)
+
+            if not jobs:
+                await writer.flush()
+                if in_flight:
+                    await asyncio.wait(in_flight, timeout=poll_seconds, return_when=asyncio.FIRST_COMPLETED)
+                    continue
+                if follow:
+                    await asyncio.sleep(poll_seconds)
+                    continue
+                if drain and await asyncio.to_thread(store.pending):
+                    await asyncio.sleep(min(poll_seconds, 0.05))
+                    continue
+                break
+    finally:
+        if in_flight:
+            await asyncio.gather(*in_flight, return_exceptions=True)
+        await writer.flush()
+    stats.log_progress(limiter, 0)
+    return stats
+
+
+def run_simulation(count: int, args) -> Tuple[CampaignStats, FakeSipClient, MemoryCallbackStore]:
+    store = MemoryCallbackStore([f"+3360000{i:04d}" for i in range(count)], time_scale=args.retry_scale)
+    client = FakeSipClient(latency=args.fake_latency, max_calls_per_second=args.fake_cps_quota)
+    window = CallingWindow.always() if args.ignore_window else CallingWindow.from_env()
+    stats = asyncio.run(run_campaign(
+        store, client, concurrency=args.concurrency, calls_per_second=args.cps, window=window,
+        write_batch_size=args.batch_size, drain=True, poll_seconds=0.5,
+    ))
+    return stats, client, store
+
+
+if __name__ == "__main__":
+    import argparse
+    from dotenv import load_dotenv
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Campagnes d'appels sortants (rappels).")
+    subparsers = parser.add_subparsers(dest="commande", required=True)
+
+    run_parser = subparsers.add_parser("run", help="Composer les rappels disponibles.")
+    run_parser.add_argument("--follow", action="store_true", help="Continuer à attendre de nouveaux rappels.")
+    run_parser.add_argument("--campagne", default=None, help="Limiter à une campagne.")
+    run_parser.add_argument("--trunk", default=os.getenv("SIP_OUTBOUND_TRUNK_ID"), help="Trunk SIP sortant (SIP_OUTBOUND_TRUNK_ID).")
+
+    simulate_parser = subparsers.add_parser("simulate", help="Campagne contre une doublure locale de l'API SIP.")
+    simulate_parser.add_argument("count", type=int)
+    simulate_parser.add_argument("--fake-latency", type=float, default=0.5, help="Durée moyenne de sonnerie simulée (s).")
+    simulate_parser.add_argument("--fake-cps-quota", type=float, default=0, help="Quota d'appels/s de la doublure (0 = aucun).")
+    simulate_parser.add_argument("--retry-scale", type=float, default=0.001, help="Facteur appliqué aux délais de nouvelle tentative.")
+    simulate_parser.add_argument("--ignore-window", action="store_true", help="Ignorer les plages horaires.")
+
+    for sub in (run_parser, simulate_parser):
+        sub.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY, help="Tentatives simultanées au plus.")
+        sub.add_argument("--cps", type=float, default=DEFAULT_CALLS_PER_SECOND, help="Compositions par seconde au plus.")
+        sub.add_argument("--batch-size", type=int, default=DEFAULT_WRITE_BATCH_SIZE, help="Issues par écriture en base.")
+
+    enqueue_parser = subparsers.add_parser("enqueue", help="Ajouter un numéro à rappeler.")
+    enqueue_parser.add_argument("--telephone", required=True)
+    enqueue_parser.add_argument("--motif", default=None)
+    enqueue_parser.add_argument("--campagne", default="rappels_conseiller")
+
+    subparsers.add_parser("status", help="État de la file des rappels.")
+    args = parser.parse_args()
+
+    if args.commande == "simulate":
+        stats, client, store = run_simulation(args.count, args)
+        elapsed = time.monotonic() - stats.started_at
+        logger.info(
+            f"Simulation : {client.calls} compositions en {elapsed:.1f}s, au plus {client.max_in_flight} simultanées "
+            f"(limite {args.concurrency}) et {client.max_calls_in_one_second} sur une seconde (limite {args.cps:g}) ; "
+            f"{client.rejected} refus de quota ; {len(store.outcomes)} issues écrites en {store.writes} lots ; "
+            f"{store.pending()} rappels restants."
+        )
+    else:
+        from db_driver import ExtranetDatabaseDriver
+        driver = ExtranetDatabaseDriver(pool_size=2)
+        if args.commande == "enqueue":
+            with driver._get_connection() as conn:
+                cursor = conn.cursor()
+                id_rappel = enqueue_callback(cursor, args.telephone, args.motif, campagne=args.campagne)
+                conn.commit()
+            logger.info(f"Rappel {id_rappel} ajouté à la file.")
+        elif args.commande == "run":
+            if not args.trunk:
+                parser.error("--trunk (ou SIP_OUTBOUND_TRUNK_ID) est requis.")
+            from livekit import api
+
+            async def main():
+                async with api.LiveKitAPI(os.getenv("LIVEKIT_URL"), os.getenv("LIVEKIT_API_KEY"), os.getenv("LIVEKIT_API_SECRET")) as lk_api:
+                    await run_campaign(
+                        MySQLCallbackStore(driver, campagne=args.campagne), LiveKitSipClient(lk_api, args.trunk, os.getenv("AGENT_NAME", "")),
+                        concurrency=args.concurrency, calls_per_second=args.cps,
+                        write_batch_size=args.batch_size, follow=args.follow,
+                    )
+            asyncio.run(main())
+        for status, count in sorted(campaign_status(driver).items()):
+            logger.info(f"{status:<12} {count}")
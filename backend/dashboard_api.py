@@ -1,27 +1,70 @@
-from flask import Blueprint, jsonify, request, current_app
+from flask import Blueprint, jsonify, request, current_app, g, Response
 import mysql.connector # For type hinting and error handling
 from typing import Optional
 import json # For handling JSON in parameters if needed, and for response
 import datetime
+import os
+import threading
+import time
+import base64
+import csv
+import io
+import gzip
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+try:
+    import brotli # Optionnel : 'br' n'est proposé que si le paquet est installé
+except ImportError:
+    brotli = None
 
 # Assuming ExtranetDatabaseDriver is accessible.
 # If db_driver.py is in the same directory (backend), this should work.
 from db_driver import ExtranetDatabaseDriver
 from error_logger import log_system_error # Assuming error_logger.py is in the same directory
+from kpi_rollups import fetch_kpi_totals
 
 dashboard_bp = Blueprint('dashboard_api', __name__, url_prefix='/api/dashboard')
 
-# Helper to get DB driver instance.
-# In a real Flask app, db connections are often managed via app context (g object)
-# or specific Flask extensions like Flask-SQLAlchemy.
-# For simplicity here, we'll instantiate it or assume it can be accessed if set globally.
+# Un seul pilote (avec pool de connexions) par processus, attaché à l'application Flask.
+# Chaque requête HTTP emprunte au plus une connexion du pool, rendue à la fin de la requête.
+DB_DRIVER_EXTENSION_KEY = 'dashboard_db_driver'
+_driver_init_lock = threading.Lock()
+
+def init_dashboard_db(app, pool_size: Optional[int] = None):
+    """
+    Crée le pilote BD partagé du tableau de bord et l'attache à l'application.
+    Peut être appelé explicitement au démarrage ; sinon il est créé à la première requête.
+    """
+    with _driver_init_lock:
+        driver = app.extensions.get(DB_DRIVER_EXTENSION_KEY)
+        if driver is None:
+            driver = ExtranetDatabaseDriver(
+                pool_size=pool_size or int(os.getenv("DASHBOARD_DB_POOL_SIZE", "8")),
+                pool_name="dashboard_api",
+                pool_timeout=float(os.getenv("DASHBOARD_DB_POOL_TIMEOUT", "10"))
+            )
+            app.extensions[DB_DRIVER_EXTENSION_KEY] = driver
+        return driver
+
 def get_db_driver():
-    # This is a simplified approach. If ExtranetDatabaseDriver is already instantiated
-    # globally in agent.py (as db_driver), we might want to use that instance.
-    # However, for API requests that are separate from agent worker lifecycle,
-    # a new instance or a request-scoped instance might be better.
-    # For now, creating a new instance:
-    return ExtranetDatabaseDriver()
+    driver = current_app.extensions.get(DB_DRIVER_EXTENSION_KEY)
+    if driver is None:
+        driver = init_dashboard_db(current_app._get_current_object())
+    return driver
+
+def get_db_connection():
+    """Connexion du pool réservée à la requête HTTP en cours (empruntée au premier appel)."""
+    if 'dashboard_db_conn' not in g:
+        g.dashboard_db_conn = get_db_driver().acquire_connection()
+    return g.dashboard_db_conn
+
+@dashboard_bp.teardown_request
+def release_db_connection(exc):
+    conn = g.pop('dashboard_db_conn', None)
+    if conn is not None:
+        get_db_driver().release_connection(conn)
 
 def format_datetime_for_json(data):
     """
@@ -35,59 +78,211 @@ def format_datetime_for_json(data):
         return data.isoformat()
     return data
 
+# --- Compression des réponses ---
+# Les réponses JSON (transcriptions notamment) sont compressées selon l'en-tête Accept-Encoding :
+# br si le client l'accepte et que brotli est installé, sinon gzip. Les réponses en flux (export)
+# gèrent leur propre compression et ne sont pas concernées.
+COMPRESSION_MIN_BYTES = int(os.getenv("DASHBOARD_COMPRESSION_MIN_BYTES", "1024"))
+COMPRESSIBLE_MIMETYPES = {'application/json', 'text/csv', 'text/plain', 'application/x-ndjson'}
+
+def _negotiate_encoding() -> Optional[str]:
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br'] > 0 and accepted['br'] >= accepted['gzip']:
+        return 'br'
+    if accepted['gzip'] > 0:
+        return 'gzip'
+    return None
+
+@dashboard_bp.after_request
+def compress_response(response):
+    if (response.is_streamed or response.direct_passthrough or response.status_code != 200
+            or 'Content-Encoding' in response.headers or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+    response.vary.add('Accept-Encoding')
+    data = response.get_data()
+    if len(data) < COMPRESSION_MIN_BYTES:
+        return response
+    encoding = _negotiate_encoding()
+    if encoding == 'br':
+        response.set_data(brotli.compress(data, quality=5))
+    elif encoding == 'gzip':
+        response.set_data(gzip.compress(data, compresslevel=6))
+    else:
+        return response
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+# --- Pagination par curseur (keyset) ---
+# Les listes sont triées par (timestamp DESC, id DESC). Un curseur opaque encode la position
+# (timestamp, id) de la dernière (ou première) ligne d'une page : la page suivante est lue via
+# l'index composite (timestamp, id) sans OFFSET, quel que soit le nombre de pages déjà parcourues.
+MAX_PER_PAGE = 200
+COUNT_CACHE_TTL_SECONDS = 60
+_count_cache = {}
+_count_cache_lock = threading.Lock()
+
+class InvalidCursorError(ValueError):
+    pass
+
+def encode_cursor(timestamp_value, id_value) -> str:
+    ts = timestamp_value.isoformat() if isinstance(timestamp_value, datetime.datetime) else str(timestamp_value)
+    raw = json.dumps([ts, id_value], separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_cursor(token: str):
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        ts, id_value = json.loads(raw)
+        return datetime.datetime.fromisoformat(ts), int(id_value)
+    except (ValueError, TypeError) as e:
+        raise InvalidCursorError(f"Curseur de pagination invalide: {e}")
+
+def _count_items(cursor, table: str, from_where_sql: str, params: list, has_filters: bool):
+    """
+    Total (optionnel) d'une liste paginée.
+    - Sans filtre : estimation issue des statistiques InnoDB (aucun parcours de table).
+    - Avec filtres : COUNT(*) exact, mis en cache COUNT_CACHE_TTL_SECONDS secondes.
+    Retourne (total, exact).
+    """
+    if not has_filters:
+        cursor.execute(
+            "SELECT TABLE_ROWS AS total_items FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s",
+            (table,)
+        )
+        row = cursor.fetchone()
+        return (int(row['total_items'] or 0) if row else 0), False
+
+    key = (from_where_sql, tuple(params))
+    now = time.monotonic()
+    with _count_cache_lock:
+        cached = _count_cache.get(key)
+        if cached and cached[1] > now:
+            return cached[0], True
+    cursor.execute(f"SELECT COUNT(*) AS total_items {from_where_sql}", tuple(params))
+    row = cursor.fetchone()
+    total = row['total_items'] if row else 0
+    with _count_cache_lock:
+        if len(_count_cache) > 1000:
+            _count_cache.clear()
+        _count_cache[key] = (total, now + COUNT_CACHE_TTL_SECONDS)
+    return total, True
+
+def paginate_keyset(conn, select_sql: str, from_sql: str, filters_sql: list, params_sql: list,
+                    ts_col: str, id_col: str, ts_key: str, id_key: str, table: str, default_per_page: int):
+    """
+    Exécute une requête de liste paginée et retourne (lignes, bloc 'pagination').
+    Paramètres de requête reconnus :
+    - cursor / direction ('next' = plus anciens, 'prev' = plus récents) : pagination par curseur (par défaut) ;
+    - page : ancien mode par OFFSET, conservé pour compatibilité ;
+    - per_page, include_total (0/1).
+    """
+    per_page = max(1, min(request.args.get('per_page', default_per_page, type=int), MAX_PER_PAGE))
+    include_total = request.args.get('include_total', '0').lower() in ('1', 'true', 'oui')
+    page = request.args.get('page', type=int)
+    cursor = conn.cursor(dictionary=True)
+
+    base_where = "WHERE " + " AND ".join(filters_sql) if filters_sql else ""
+    from_where_sql = f"{from_sql} {base_where}"
+
+    if page is not None:
+        page = max(page, 1)
+        cursor.execute(
+            f"{select_sql} {from_where_sql} ORDER BY {ts_col} DESC, {id_col} DESC LIMIT %s OFFSET %s",
+            tuple(params_sql + [per_page, (page - 1) * per_page])
+        )
+        rows = cursor.fetchall()
+        total_items, exact = _count_items(cursor, table, from_where_sql, params_sql, bool(filters_sql))
+        return rows, {
+            "page": page,
+            "per_page": per_page,
+            "total_items": total_items,
+            "total_exact": exact,
+            "total_pages": (total_items + per_page - 1) // per_page
+        }
+
+    direction = request.args.get('direction', 'next')
+    token = request.args.get('cursor')
+    keyset_filters = list(filters_sql)
+    keyset_params = list(params_sql)
+    if token:
+        cursor_ts, cursor_id = decode_cursor(token)
+        op = '<' if direction != 'prev' else '>'
+        keyset_filters.append(f"({ts_col} {op} %s OR ({ts_col} = %s AND {id_col} {op} %s))")
+        keyset_params += [cursor_ts, cursor_ts, cursor_id]
+    order = "DESC" if direction != 'prev' else "ASC"
+    where = "WHERE " + " AND ".join(keyset_filters) if keyset_filters else ""
+
+    # Une ligne de plus que demandé pour savoir s'il existe une page au-delà.
+    cursor.execute(
+        f"{select_sql} {from_sql} {where} ORDER BY {ts_col} {order}, {id_col} {order} LIMIT %s",
+        tuple(keyset_params + [per_page + 1])
+    )
+    rows = cursor.fetchall()
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    if direction == 'prev':
+        rows.reverse()
+
+    pagination = {
+        "per_page": per_page,
+        "next_cursor": None,
+        "prev_cursor": None,
+    }
+    if rows:
+        older_exists = has_more if direction != 'prev' else bool(token)
+        newer_exists = bool(token) if direction != 'prev' else has_more
+        if older_exists:
+            pagination["next_cursor"] = encode_cursor(rows[-1][ts_key], rows[-1][id_key])
+        if newer_exists:
+            pagination["prev_cursor"] = encode_cursor(rows[0][ts_key], rows[0][id_key])
+    if include_total:
+        pagination["total_items"], pagination["total_exact"] = _count_items(
+            cursor, table, from_where_sql, params_sql, bool(filters_sql)
+        )
+    return rows, pagination
+
+
 @dashboard_bp.route('/kpis', methods=['GET'])
 def get_kpis():
     """
     Endpoint pour récupérer les Indicateurs Clés de Performance (KPIs) agrégés.
     """
-    db = get_db_driver()
     kpis_data = {}
     try:
-        with db._get_connection() as conn:
-            cursor = conn.cursor(dictionary=True) # Use dictionary=True for easier access
-
-            # Nombre total d'appels
-            cursor.execute("SELECT COUNT(*) as total_appels FROM journal_appels")
-            result = cursor.fetchone()
-            kpis_data['nombre_total_appels'] = result['total_appels'] if result else 0
-
-            # Durée moyenne des appels (en secondes)
-            cursor.execute("SELECT AVG(TIMESTAMPDIFF(SECOND, timestamp_debut, timestamp_fin)) as avg_duration FROM journal_appels WHERE timestamp_fin IS NOT NULL AND timestamp_debut IS NOT NULL")
-            result = cursor.fetchone()
-            kpis_data['duree_moyenne_appels_secondes'] = float(result['avg_duration']) if result and result['avg_duration'] is not None else 0
-
-            # Nombre d'erreurs critiques
-            cursor.execute("SELECT COUNT(*) as total_errors FROM erreurs_systeme") # Peut être filtré par sévérité si ajoutée
-            result = cursor.fetchone()
-            kpis_data['nombre_erreurs_critiques'] = result['total_errors'] if result else 0
-
-            # Utilisation des outils (Top 5)
-            cursor.execute("""
-                SELECT nom_outil, COUNT(*) as count
-                FROM actions_agent
-                WHERE type_action = 'TOOL_CALL' AND nom_outil IS NOT NULL
-                GROUP BY nom_outil
-                ORDER BY count DESC
-                LIMIT 5
-            """)
-            kpis_data['utilisation_outils_top5'] = cursor.fetchall()
-
-            # Taux de confirmation d'identité réussie
-            cursor.execute("""
-                SELECT
-                    (SELECT COUNT(*) FROM journal_appels WHERE id_adherent_contexte IS NOT NULL) as confirmed_calls,
-                    (SELECT COUNT(*) FROM journal_appels) as total_calls_for_rate
-            """)
-            rate_counts = cursor.fetchone()
-            if rate_counts and rate_counts['total_calls_for_rate'] > 0:
-                kpis_data['taux_confirmation_identite'] = \
-                    (rate_counts['confirmed_calls'] / rate_counts['total_calls_for_rate']) * 100
-            else:
-                kpis_data['taux_confirmation_identite'] = 0
-
-            cursor.execute("SELECT COUNT(*) as count FROM journal_appels WHERE id_adherent_contexte IS NULL")
-            result = cursor.fetchone()
-            kpis_data['appels_sans_confirmation_identite'] = result['count'] if result else 0
+        conn = get_db_connection()
+        cursor = conn.cursor(dictionary=True) # Use dictionary=True for easier access
+
+        # Lecture des agrégats maintenus par kpi_rollups : coût indépendant du volume de journal_appels.
+        totals = fetch_kpi_totals(cursor)
+        kpis_data['nombre_total_appels'] = int(totals['nb_appels'])
+
+        # Durée moyenne des appels terminés (en secondes)
+        kpis_data['duree_moyenne_appels_secondes'] = \
+            totals['duree_totale_secondes'] / totals['nb_appels_termines'] if totals['nb_appels_termines'] else 0
+
+        # Nombre d'erreurs critiques
+        kpis_data['nombre_erreurs_critiques'] = int(totals['nb_erreurs'])
+
+        # Utilisation des outils (Top 5)
+        cursor.execute("""
+            SELECT nom_outil, SUM(nb_appels_outil) as count
+            FROM kpi_rollup_outils_jour
+            GROUP BY nom_outil
+            ORDER BY count DESC
+            LIMIT 5
+        """)
+        kpis_data['utilisation_outils_top5'] = [
+            {'nom_outil': row['nom_outil'], 'count': int(row['count'])} for row in cursor.fetchall()
+        ]
+
+        # Taux de confirmation d'identité réussie (identification connue à la clôture de l'appel)
+        if totals['nb_appels_termines'] > 0:
+            kpis_data['taux_confirmation_identite'] = \
+                (totals['nb_appels_identifies'] / totals['nb_appels_termines']) * 100
+        else:
+            kpis_data['taux_confirmation_identite'] = 0
+
+        kpis_data['appels_sans_confirmation_identite'] = int(totals['nb_appels'] - totals['nb_appels_identifies'])
 
         return jsonify({"succes": True, "donnees": format_datetime_for_json(kpis_data)}), 200
     except mysql.connector.Error as db_err:
@@ -100,82 +295,74 @@ def get_kpis():
         return jsonify({"succes": False, "erreur": "Erreur interne du serveur lors de la récupération des KPIs."}), 500
 
 
-@dashboard_bp.route('/calls', methods=['GET'])
-def get_calls():
+@dashboard_bp.route('/pool', methods=['GET'])
+def get_pool_metrics():
     """
-    Endpoint pour récupérer une liste paginée des appels, avec filtres optionnels.
+    Endpoint exposant les métriques du pool de connexions BD de ce processus.
     """
-    db = get_db_driver()
-    try:
-        page = request.args.get('page', 1, type=int)
-        per_page = request.args.get('per_page', 10, type=int)
-        offset = (page - 1) * per_page
+    return jsonify({"succes": True, "donnees": get_db_driver().get_pool_stats()}), 200
 
-        filters_sql = []
-        params_sql = []
 
-        date_debut_str = request.args.get('date_debut')
-        if date_debut_str:
-            filters_sql.append("ja.timestamp_debut >= %s")
-            params_sql.append(date_debut_str)
+def _call_filters_from_request():
+    """Filtres communs à la liste et à l'export des appels (date_debut, date_fin, id_adherent, numero_appelant)."""
+    filters_sql = []
+    params_sql = []
 
-        date_fin_str = request.args.get('date_fin')
-        if date_fin_str: # Pour inclure toute la journée, on pourrait faire <= date_fin_str + 1 jour
-            filters_sql.append("ja.timestamp_debut <= DATE_ADD(%s, INTERVAL 1 DAY)")
-            params_sql.append(date_fin_str)
+    date_debut_str = request.args.get('date_debut')
+    if date_debut_str:
+        filters_sql.append("ja.timestamp_debut >= %s")
+        params_sql.append(date_debut_str)
 
-        id_adherent = request.args.get('id_adherent', type=int)
-        if id_adherent:
-            filters_sql.append("ja.id_adherent_contexte = %s")
-            params_sql.append(id_adherent)
+    date_fin_str = request.args.get('date_fin')
+    if date_fin_str: # Pour inclure toute la journée, on pourrait faire <= date_fin_str + 1 jour
+        filters_sql.append("ja.timestamp_debut <= DATE_ADD(%s, INTERVAL 1 DAY)")
+        params_sql.append(date_fin_str)
 
-        numero_appelant = request.args.get('numero_appelant')
-        if numero_appelant:
-            filters_sql.append("ja.numero_appelant LIKE %s")
-            params_sql.append(f"%{numero_appelant}%")
+    id_adherent = request.args.get('id_adherent', type=int)
+    if id_adherent:
+        filters_sql.append("ja.id_adherent_contexte = %s")
+        params_sql.append(id_adherent)
 
+    numero_appelant = request.args.get('numero_appelant')
+    if numero_appelant:
+        filters_sql.append("ja.numero_appelant LIKE %s")
+        params_sql.append(f"%{numero_appelant}%")
 
-        where_clause = "WHERE " + " AND ".join(filters_sql) if filters_sql else ""
+    return filters_sql, params_sql
 
-        base_query = f"""
-            FROM journal_appels ja
-            LEFT JOIN adherents ad ON ja.id_adherent_contexte = ad.id_adherent
-            {where_clause}
-        """
 
-        count_query = f"SELECT COUNT(*) as total_items {base_query}"
+@dashboard_bp.route('/calls', methods=['GET'])
+def get_calls():
+    """
+    Endpoint pour récupérer une liste paginée des appels, avec filtres optionnels.
+    """
+    try:
+        filters_sql, params_sql = _call_filters_from_request()
 
-        data_query = f"""
+        select_sql = """
             SELECT ja.id_appel, ja.id_livekit_room, ja.timestamp_debut, ja.timestamp_fin,
                    ja.numero_appelant, ja.id_adherent_contexte, ad.nom, ad.prenom,
                    TIMESTAMPDIFF(SECOND, ja.timestamp_debut, ja.timestamp_fin) as duree_secondes,
                    ja.evaluation_performance_prompt, ja.evaluation_resolution_appel
-            {base_query}
-            ORDER BY ja.timestamp_debut DESC
-            LIMIT %s OFFSET %s
+        """
+        from_sql = """
+            FROM journal_appels ja
+            LEFT JOIN adherents ad ON ja.id_adherent_contexte = ad.id_adherent
         """
 
-        with db._get_connection() as conn:
-            cursor = conn.cursor(dictionary=True)
-
-            cursor.execute(count_query, tuple(params_sql))
-            total_items_result = cursor.fetchone()
-            total_items = total_items_result['total_items'] if total_items_result else 0
-
-            params_sql_with_pagination = params_sql + [per_page, offset]
-            cursor.execute(data_query, tuple(params_sql_with_pagination))
-            calls = cursor.fetchall()
+        calls, pagination = paginate_keyset(
+            get_db_connection(), select_sql, from_sql, filters_sql, params_sql,
+            ts_col="ja.timestamp_debut", id_col="ja.id_appel", ts_key="timestamp_debut", id_key="id_appel",
+            table="journal_appels", default_per_page=10
+        )
 
         return jsonify({
             "succes": True,
             "donnees": format_datetime_for_json(calls),
-            "pagination": {
-                "page": page,
-                "per_page": per_page,
-                "total_items": total_items,
-                "total_pages": (total_items + per_page - 1) // per_page if per_page > 0 else 0
-            }
+            "pagination": pagination
         }), 200
+    except InvalidCursorError as e:
+        return jsonify({"succes": False, "erreur": str(e)}), 400
     except mysql.connector.Error as db_err:
         current_app.logger.error(f"Erreur BD dashboard_api.get_calls: {db_err}")
         log_system_error("dashboard_api.get_calls", f"Erreur BD: {db_err}", db_err)
@@ -186,40 +373,236 @@ def get_calls():
         return jsonify({"succes": False, "erreur": "Erreur interne du serveur lors de la récupération des appels."}), 500
 
 
+# --- Export en flux des appels ---
+# L'export lit avec un curseur non bufferisé sur une connexion dédiée (hors pool, pour ne pas
+# priver les autres endpoints d'une connexion pendant un long export) et écrit les lignes par lots
+# au fur et à mesure : la mémoire reste constante quel que soit le nombre de lignes exportées.
+EXPORT_FETCH_SIZE = int(os.getenv("DASHBOARD_EXPORT_FETCH_SIZE", "2000"))
+EXPORT_MAX_CONCURRENT = int(os.getenv("DASHBOARD_EXPORT_MAX_CONCURRENT", "2"))
+_export_slots = threading.BoundedSemaphore(EXPORT_MAX_CONCURRENT)
+
+EXPORT_SELECT_SQL = """
+    SELECT ja.id_appel, ja.id_livekit_room, ja.timestamp_debut, ja.timestamp_fin,
+           ja.numero_appelant, ja.id_adherent_contexte, ad.nom, ad.prenom,
+           TIMESTAMPDIFF(SECOND, ja.timestamp_debut, ja.timestamp_fin) as duree_secondes,
+           ja.statut_appel, ja.resume_appel, ja.evaluation_resolution_appel{extra_columns}
+    FROM journal_appels ja
+    LEFT JOIN adherents ad ON ja.id_adherent_contexte = ad.id_adherent
+"""
+
+def _export_value(value):
+    """Conversion d'une valeur de colonne pour l'export (JSON et CSV)."""
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (bytes, bytearray)):
+        return value.decode('utf-8', errors='replace')
+    return value
+
+def _encode_ndjson(columns, rows) -> str:
+    return "".join(
+        json.dumps({col: _export_value(val) for col, val in zip(columns, row)}, ensure_ascii=False) + "\n"
+        for row in rows
+    )
+
+def _encode_csv(rows, header=None) -> str:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(header)
+    writer.writerows([_export_value(val) for val in row] for row in rows)
+    return buffer.getvalue()
+
+def _close_export_connection(conn):
+    try:
+        conn.close()
+    except mysql.connector.Error:
+        pass # Résultat non lu après une interruption du client : la socket est fermée de toute façon.
+
+class _ExportCleanup:
+    """
+    Ferme la connexion de l'export et rend sa place, une seule fois : appelé en fin de générateur
+    et par call_on_close (le pont WSGI de Starlette n'appelle pas close() sur la réponse).
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self._lock = threading.Lock()
+        self._done = False
+
+    def __call__(self):
+        with self._lock:
+            if self._done:
+                return
+            self._done = True
+        try:
+            _close_export_connection(self.conn)
+        finally:
+            _export_slots.release()
+
+def _stream_export(cursor, columns, export_format: str, compress: bool, app_logger, cleanup: _ExportCleanup):
+    """Générateur des morceaux de la réponse : un lot de EXPORT_FETCH_SIZE lignes à la fois."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None # wbits=31 : format gzip
+    total = 0
+    try:
+        pending = _encode_csv([], header=columns) if export_format == 'csv' else ""
+        while True:
+            rows = cursor.fetchmany(EXPORT_FETCH_SIZE)
+            if rows:
+                total += len(rows)
+                pending += _encode_csv(rows) if export_format == 'csv' else _encode_ndjson(columns, rows)
+            if pending:
+                data = pending.encode('utf-8')
+                data = compressor.compress(data) if compressor else data
+                pending = ""
+                if data:
+                    yield data
+            if not rows:
+                break
+        if compressor:
+            yield compressor.flush()
+        app_logger.info(f"Export des appels terminé : {total} ligne(s) ({export_format}{', gzip' if compress else ''}).")
+    except mysql.connector.Error as db_err:
+        # Les en-têtes sont déjà envoyés : la réponse est interrompue (transfert incomplet côté client).
+        app_logger.error(f"Erreur BD pendant l'export des appels après {total} ligne(s): {db_err}")
+        log_system_error("dashboard_api.export_calls", f"Erreur BD pendant l'export: {db_err}", db_err)
+        raise
+    finally:
+        cleanup()
+
+
+@dashboard_bp.route('/calls/export', methods=['GET'])
+def export_calls():
+    """
+    Export en flux des appels (mêmes filtres que /calls), trié par date de début croissante.
+    Paramètres : format=ndjson|csv (défaut ndjson), gzip=0|1, include_transcription=0|1.
+    """
+    export_format = request.args.get('format', 'ndjson').lower()
+    if export_format not in ('ndjson', 'csv'):
+        return jsonify({"succes": False, "erreur": "Format d'export invalide (ndjson ou csv)."}), 400
+    compress = request.args.get('gzip', '0').lower() in ('1', 'true', 'oui')
+    include_transcription = request.args.get('include_transcription', '0').lower() in ('1', 'true', 'oui')
+
+    if not _export_slots.acquire(blocking=False):
+        return jsonify({"succes": False, "erreur": "Trop d'exports en cours, réessayez plus tard."}), 429
+
+    conn = None
+    try:
+        filters_sql, params_sql = _call_filters_from_request()
+        where = "WHERE " + " AND ".join(filters_sql) if filters_sql else ""
+        query = EXPORT_SELECT_SQL.format(extra_columns=", ja.transcription_complete" if include_transcription else "")
+        query += f" {where} ORDER BY ja.timestamp_debut ASC, ja.id_appel ASC"
+
+        conn = mysql.connector.connect(**get_db_driver().connection_params)
+        cursor = conn.cursor(buffered=False)
+        # Un client lent ralentit la lecture du résultat : on laisse au serveur le temps d'attendre.
+        cursor.execute("SET SESSION net_write_timeout = 3600")
+        cursor.execute(query, tuple(params_sql))
+        columns = [desc[0] for desc in cursor.description]
+    except mysql.connector.Error as db_err:
+        if conn is not None:
+            _close_export_connection(conn)
+        _export_slots.release()
+        current_app.logger.error(f"Erreur BD dashboard_api.export_calls: {db_err}")
+        log_system_error("dashboard_api.export_calls", f"Erreur BD: {db_err}", db_err)
+        return jsonify({"succes": False, "erreur": "Erreur interne du serveur lors de l'export des appels."}), 500
+    except Exception:
+        if conn is not None:
+            _close_export_connection(conn)
+        _export_slots.release()
+        raise
+
+    filename = f"appels_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.{export_format}"
+    mimetype = 'text/csv' if export_format == 'csv' else 'application/x-ndjson'
+    if compress:
+        filename += ".gz"
+        mimetype = 'application/gzip'
+
+    cleanup = _ExportCleanup(conn)
+    response = Response(
+        _stream_export(cursor, columns, export_format, compress, current_app.logger, cleanup),
+        mimetype=mimetype,
+        headers={
+            "Content-Disposition": f"attachment; filename={filename}",
+            "Cache-Control": "no-store",
+            "X-Accel-Buffering": "no", # Pas de mise en tampon par un proxy nginx
+        }
+    )
+    # Filet de sécurité si le générateur n'a jamais démarré (serveur WSGI qui appelle close()).
+    response.call_on_close(cleanup)
+    return response
+
+
+# --- Détail d'un appel ---
+# Les sections sont lues en parallèle sur des connexions du pool (une par section) : la latence
+# est celle de la requête la plus lente et non la somme des quatre.
+# L'exécuteur est partagé par toutes les requêtes : quel que soit leur nombre, les sections n'occupent
+# jamais plus de DETAIL_MAX_WORKERS connexions (3 sur les 8 du pool par défaut), le reste du pool
+# restant disponible pour les requêtes principales et les autres endpoints. Au-delà, les sections attendent
+# dans l'exécuteur (sans connexion) plutôt que d'épuiser le pool.
+DETAIL_MAX_WORKERS = int(os.getenv("DASHBOARD_DETAIL_WORKERS", "3"))
+_detail_executor = ThreadPoolExecutor(max_workers=DETAIL_MAX_WORKERS, thread_name_prefix="dashboard_detail")
+
+CALL_DETAIL_SECTIONS = {
+    'actions_agent': "SELECT * FROM actions_agent WHERE id_appel_fk = %s ORDER BY timestamp_action ASC",
+    'interactions_bd': "SELECT * FROM interactions_bd WHERE id_appel_fk = %s ORDER BY timestamp_interaction ASC",
+    'erreurs_appel': "SELECT * FROM erreurs_systeme WHERE id_appel_fk = %s ORDER BY timestamp_erreur ASC",
+}
+# Sans 'transcription', transcription_complete (champ souvent volumineux) est retiré des informations de l'appel.
+CALL_DETAIL_FIELDS = set(CALL_DETAIL_SECTIONS) | {'informations_appel', 'transcription'}
+
+def _run_detail_query(driver, query: str, params: tuple, fetch_one: bool = False):
+    """Exécute une requête sur une connexion empruntée au pool le temps de la requête."""
+    conn = driver.acquire_connection()
+    try:
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute(query, params)
+        return cursor.fetchone() if fetch_one else cursor.fetchall()
+    finally:
+        driver.release_connection(conn)
+
 @dashboard_bp.route('/calls/<int:call_id>', methods=['GET'])
 def get_call_details(call_id):
     """
     Endpoint pour récupérer les détails d'un appel spécifique.
+    Paramètre optionnel fields (liste séparée par des virgules) parmi informations_appel, transcription,
+    actions_agent, interactions_bd, erreurs_appel. Sans ce paramètre, tout est renvoyé.
+    Les informations de l'appel sont toujours renvoyées ; la transcription seulement si demandée.
     """
-    db = get_db_driver()
+    fields_param = request.args.get('fields')
+    if fields_param:
+        fields = {f.strip() for f in fields_param.split(',') if f.strip()}
+        unknown = fields - CALL_DETAIL_FIELDS
+        if unknown:
+            return jsonify({"succes": False, "erreur": f"Champ(s) inconnu(s) : {', '.join(sorted(unknown))}."}), 400
+    else:
+        fields = set(CALL_DETAIL_FIELDS)
+
     call_details_response = {}
     try:
-        with db._get_connection() as conn:
-            cursor = conn.cursor(dictionary=True)
-
-            # Informations de l'appel
-            cursor.execute("""
-                SELECT ja.*, ad.nom, ad.prenom
-                FROM journal_appels ja
-                LEFT JOIN adherents ad ON ja.id_adherent_contexte = ad.id_adherent
-                WHERE ja.id_appel = %s
-            """, (call_id,))
-            call_info = cursor.fetchone()
-            if not call_info:
-                return jsonify({"succes": False, "erreur": "Appel non trouvé."}), 404
-            call_details_response['informations_appel'] = call_info
-
-            # Actions de l'agent
-            cursor.execute("SELECT * FROM actions_agent WHERE id_appel_fk = %s ORDER BY timestamp_action ASC", (call_id,))
-            call_details_response['actions_agent'] = cursor.fetchall()
-
-            # Interactions BD
-            cursor.execute("SELECT * FROM interactions_bd WHERE id_appel_fk = %s ORDER BY timestamp_interaction ASC", (call_id,))
-            call_details_response['interactions_bd'] = cursor.fetchall()
-
-            # Erreurs pour cet appel
-            cursor.execute("SELECT * FROM erreurs_systeme WHERE id_appel_fk = %s ORDER BY timestamp_erreur ASC", (call_id,))
-            call_details_response['erreurs_appel'] = cursor.fetchall()
+        driver = get_db_driver()
+        info_query = """
+            SELECT ja.*, ad.nom, ad.prenom
+            FROM journal_appels ja
+            LEFT JOIN adherents ad ON ja.id_adherent_contexte = ad.id_adherent
+            WHERE ja.id_appel = %s
+        """
+        futures = {
+            section: _detail_executor.submit(_run_detail_query, driver, query, (call_id,))
+            for section, query in CALL_DETAIL_SECTIONS.items() if section in fields
+        }
+        # La requête principale s'exécute dans le thread de la requête HTTP, en même temps que les autres.
+        call_info = _run_detail_query(driver, info_query, (call_id,), fetch_one=True)
+        if not call_info:
+            for future in futures.values():
+                future.cancel()
+            return jsonify({"succes": False, "erreur": "Appel non trouvé."}), 404
+        if 'transcription' not in fields:
+            call_info.pop('transcription_complete', None)
+        call_details_response['informations_appel'] = call_info
+        for section, future in futures.items():
+            call_details_response[section] = future.result()
 
         return jsonify({"succes": True, "donnees": format_datetime_for_json(call_details_response)}), 200
     except mysql.connector.Error as db_err:
@@ -237,12 +620,7 @@ def get_db_log():
     """
     Endpoint pour récupérer les logs d'interactions avec la base de données, paginés.
     """
-    db = get_db_driver()
     try:
-        page = request.args.get('page', 1, type=int)
-        per_page = request.args.get('per_page', 20, type=int)
-        offset = (page - 1) * per_page
-
         # TODO: Ajouter des filtres (date_debut, date_fin, type_requete, table_affectee)
         filters_sql = []
         params_sql = []
@@ -252,30 +630,19 @@ def get_db_log():
         #     filters_sql.append("type_requete = %s")
         #     params_sql.append(type_req)
 
-        where_clause = "WHERE " + " AND ".join(filters_sql) if filters_sql else ""
-
-        count_query = f"SELECT COUNT(*) as total_items FROM interactions_bd {where_clause}"
-        data_query = f"SELECT * FROM interactions_bd {where_clause} ORDER BY timestamp_interaction DESC LIMIT %s OFFSET %s"
-
-        with db._get_connection() as conn:
-            cursor = conn.cursor(dictionary=True)
-            cursor.execute(count_query, tuple(params_sql))
-            total_items = cursor.fetchone()['total_items']
-
-            params_sql_with_pagination = params_sql + [per_page, offset]
-            cursor.execute(data_query, tuple(params_sql_with_pagination))
-            logs = cursor.fetchall()
+        rows, pagination = paginate_keyset(
+            get_db_connection(), "SELECT *", "FROM interactions_bd", filters_sql, params_sql,
+            ts_col="timestamp_interaction", id_col="id_interaction", ts_key="timestamp_interaction", id_key="id_interaction",
+            table="interactions_bd", default_per_page=20
+        )
 
         return jsonify({
             "succes": True,
-            "donnees": format_datetime_for_json(logs),
-            "pagination": {
-                "page": page,
-                "per_page": per_page,
-                "total_items": total_items,
-                "total_pages": (total_items + per_page - 1) // per_page if per_page > 0 else 0
-            }
+            "donnees": format_datetime_for_json(rows),
+            "pagination": pagination
         }), 200
+    except InvalidCursorError as e:
+        return jsonify({"succes": False, "erreur": str(e)}), 400
     except mysql.connector.Error as db_err:
         current_app.logger.error(f"Erreur BD dashboard_api.get_db_log: {db_err}")
         log_system_error("dashboard_api.get_db_log", f"Erreur BD: {db_err}", db_err)
@@ -291,12 +658,7 @@ def get_error_log():
     """
     Endpoint pour récupérer les logs d'erreurs système, paginés.
     """
-    db = get_db_driver()
     try:
-        page = request.args.get('page', 1, type=int)
-        per_page = request.args.get('per_page', 20, type=int)
-        offset = (page - 1) * per_page
-
         # TODO: Ajouter des filtres (date_debut, date_fin, source_erreur)
         filters_sql = []
         params_sql = []
@@ -306,30 +668,19 @@ def get_error_log():
         #     filters_sql.append("source_erreur = %s")
         #     params_sql.append(source_err)
 
-        where_clause = "WHERE " + " AND ".join(filters_sql) if filters_sql else ""
-
-        count_query = f"SELECT COUNT(*) as total_items FROM erreurs_systeme {where_clause}"
-        data_query = f"SELECT * FROM erreurs_systeme {where_clause} ORDER BY timestamp_erreur DESC LIMIT %s OFFSET %s"
-
-        with db._get_connection() as conn:
-            cursor = conn.cursor(dictionary=True)
-            cursor.execute(count_query, tuple(params_sql))
-            total_items = cursor.fetchone()['total_items']
-
-            params_sql_with_pagination = params_sql + [per_page, offset]
-            cursor.execute(data_query, tuple(params_sql_with_pagination))
-            errors = cursor.fetchall()
+        rows, pagination = paginate_keyset(
+            get_db_connection(), "SELECT *", "FROM erreurs_systeme", filters_sql, params_sql,
+            ts_col="timestamp_erreur", id_col="id_erreur", ts_key="timestamp_erreur", id_key="id_erreur",
+            table="erreurs_systeme", default_per_page=20
+        )
 
         return jsonify({
             "succes": True,
-            "donnees": format_datetime_for_json(errors),
-            "pagination": {
-                "page": page,
-                "per_page": per_page,
-                "total_items": total_items,
-                "total_pages": (total_items + per_page - 1) // per_page if per_page > 0 else 0
-            }
+            "donnees": format_datetime_for_json(rows),
+            "pagination": pagination
         }), 200
+    except InvalidCursorError as e:
+        return jsonify({"succes": False, "erreur": str(e)}), 400
     except mysql.connector.Error as db_err:
         current_app.logger.error(f"Erreur BD dashboard_api.get_error_log: {db_err}")
         log_system_error("dashboard_api.get_error_log", f"Erreur BD: {db_err}", db_err)
@@ -1,7 +1,10 @@
 # db_driver.py
 
 import mysql.connector
+import mysql.connector.pooling
 import os
+import threading
+import time
 from dotenv import load_dotenv
 from typing import Optional, List, Dict, Any
 from dataclasses import dataclass, fields
@@ -10,6 +13,7 @@ from datetime import date
 from decimal import Decimal
 import logging
 from error_logger import log_system_error # Assumer que error_logger.py existe
+import metrics
 import json
 
 # Configurer le logging
@@ -86,9 +90,11 @@ class ExtranetDatabaseDriver:
     Gère toutes les connexions et opérations de base de données pour le système extranet.
     Cette classe agit comme une couche d'accès aux données centralisée, encapsulant toutes les requêtes SQL.
     """
-    def __init__(self):
+    def __init__(self, pool_size: Optional[int] = None, pool_name: Optional[str] = None, pool_timeout: float = 10.0):
         """
         Initialise le pilote en chargeant les identifiants depuis les variables d'environnement.
+        Si pool_size est fourni, les connexions sont empruntées à un pool partagé au lieu d'être
+        ouvertes à chaque requête (à utiliser pour les processus de longue durée, ex: l'API du dashboard).
         """
         db_host = os.getenv("DB_HOST")
         db_user = os.getenv("DB_USER")
@@ -104,21 +110,109 @@ class ExtranetDatabaseDriver:
             'password': db_password,
             'database': db_name
         }
-        logger.info("Pilote de base de données initialisé avec les paramètres de connexion.")
+
+        self.pool = None
+        self.pool_size = pool_size
+        self.pool_timeout = pool_timeout
+        if pool_size:
+            self.pool = mysql.connector.pooling.MySQLConnectionPool(
+                pool_name=pool_name or f"artex_pool_{id(self)}",
+                pool_size=pool_size,
+                pool_reset_session=True,
+                **self.connection_params
+            )
+            # Le pool mysql-connector lève une erreur immédiate s'il est vide :
+            # le sémaphore fait attendre l'appelant (jusqu'à pool_timeout) qu'une connexion se libère.
+            self._pool_slots = threading.BoundedSemaphore(pool_size)
+        self._stats_lock = threading.Lock()
+        self._pool_stats = {
+            "connexions_empruntees": 0,
+            "connexions_en_cours": 0,
+            "attente_totale_secondes": 0.0,
+            "attente_max_secondes": 0.0,
+            "delais_depasses": 0,
+        }
+        logger.info("Pilote de base de données initialisé avec les paramètres de connexion"
+                    + (f" (pool de {pool_size} connexions)." if pool_size else "."))
+
+    def acquire_connection(self):
+        """
+        Emprunte une connexion (au pool si configuré, sinon nouvelle connexion).
+        Chaque appel doit être suivi d'un release_connection().
+        """
+        if not self.pool:
+            conn = mysql.connector.connect(**self.connection_params)
+            with self._stats_lock:
+                self._pool_stats["connexions_empruntees"] += 1
+                self._pool_stats["connexions_en_cours"] += 1
+            metrics.DB_CONNECTIONS_IN_USE.inc()
+            return conn
+
+        wait_start = time.perf_counter()
+        if not self._pool_slots.acquire(timeout=self.pool_timeout):
+            with self._stats_lock:
+                self._pool_stats["delais_depasses"] += 1
+            metrics.DB_POOL_TIMEOUTS.inc()
+            raise mysql.connector.errors.PoolError(f"Aucune connexion libre dans le pool après {self.pool_timeout}s.")
+        waited = time.perf_counter() - wait_start
+        try:
+            conn = self.pool.get_connection()
+        except Exception:
+            self._pool_slots.release()
+            raise
+        with self._stats_lock:
+            stats = self._pool_stats
+            stats["connexions_empruntees"] += 1
+            stats["connexions_en_cours"] += 1
+            stats["attente_totale_secondes"] += waited
+            stats["attente_max_secondes"] = max(stats["attente_max_secondes"], waited)
+        metrics.DB_POOL_WAIT.observe(waited)
+        metrics.DB_CONNECTIONS_IN_USE.inc()
+        return conn
+
+    def release_connection(self, conn):
+        """Rend une connexion empruntée via acquire_connection() (retour au pool ou fermeture)."""
+        try:
+            if self.pool:
+                conn.close() # Une connexion de pool retourne au pool à la fermeture
+            elif conn.is_connected():
+                conn.close()
+        except mysql.connector.Error as err:
+            logger.warning(f"Erreur lors de la restitution d'une connexion : {err}")
+        finally:
+            with self._stats_lock:
+                self._pool_stats["connexions_en_cours"] -= 1
+            metrics.DB_CONNECTIONS_IN_USE.dec()
+            if self.pool:
+                self._pool_slots.release()
+
+    def get_pool_stats(self) -> Dict[str, Any]:
+        """Retourne les métriques d'utilisation des connexions de ce pilote."""
+        with self._stats_lock:
+            stats = dict(self._pool_stats)
+        stats["taille_pool"] = self.pool_size or 0
+        stats["attente_moyenne_secondes"] = (
+            stats["attente_totale_secondes"] / stats["connexions_empruntees"] if stats["connexions_empruntees"] else 0.0
+        )
+        return stats
 
     @contextmanager
     def _get_connection(self):
         """Fournit une connexion gérée à la base de données MySQL."""
         conn = None
+        acquired_at = None
         try:
-            conn = mysql.connector.connect(**self.connection_params)
+            conn = self.acquire_connection()
+            acquired_at = time.perf_counter()
             yield conn
         except mysql.connector.Error as err:
+            metrics.DB_ERRORS.inc()
             logger.error(f"Erreur de connexion à la base de données : {err}")
             raise # Relancer l'exception après l'avoir journalisée
         finally:
-            if conn and conn.is_connected():
-                conn.close()
+            if conn:
+                metrics.DB_CONNECTION_HOLD.observe(time.perf_counter() - acquired_at)
+                self.release_connection(conn)
 
     def _map_row(self, row: tuple, cursor, dataclass_type):
         """Utilitaire pour mapper une seule ligne de base de données à une instance de dataclass."""
@@ -227,15 +321,15 @@ class ExtranetDatabaseDriver:
                 cursor.execute(query, tuple(values))
                 conn.commit()
                 if cursor.rowcount > 0:
-                    self._log_db_interaction("UPDATE_SUCCESS", "adherents", f"MAJ contact réussie pour adhérent ID: {adherent_id}. {cursor.rowcount} ligne(s) affectée(s).", id_appel_fk_param, adherent_id)
+                    self._log_db_interaction("UPDATE_SUCCESS", "adherents", f"MAJ contact réussie pour adhérent ID: {adherent_id}. {cursor.rowcount} ligne(s) affectée(s).", id_appel_fk_param, adherent_id, conn=conn)
                     return True
                 else:
-                    self._log_db_interaction("UPDATE_NOCHANGE", "adherents", f"MAJ contact pour adhérent ID: {adherent_id} n'a affecté aucune ligne.", id_appel_fk_param, adherent_id)
+                    self._log_db_interaction("UPDATE_NOCHANGE", "adherents", f"MAJ contact pour adhérent ID: {adherent_id} n'a affecté aucune ligne.", id_appel_fk_param, adherent_id, conn=conn)
                     return False
             except mysql.connector.Error as err:
                 logger.error(f"Échec de la mise à jour des informations de contact pour l'adhérent {adherent_id} : {err}")
-                self._log_db_interaction("UPDATE_FAIL", "adherents", f"ÉCHEC MAJ contact pour adhérent ID: {adherent_id}. Erreur: {err}", id_appel_fk_param, adherent_id)
                 conn.rollback()
+                self._log_db_interaction("UPDATE_FAIL", "adherents", f"ÉCHEC MAJ contact pour adhérent ID: {adherent_id}. Erreur: {err}", id_appel_fk_param, adherent_id, conn=conn)
                 return False
 
     # --- Méthodes Contrat & Formule ---
@@ -331,13 +425,14 @@ class ExtranetDatabaseDriver:
             try:
                 # Log de la tentative de création
                 desc_tentative = f"Tentative création sinistre: type '{type_sinistre}', contrat ID {id_contrat}, adhérent ID {id_adherent}"
-                self._log_db_interaction("INSERT_ATTEMPT", "sinistres_artex", desc_tentative, id_appel_fk_param, id_adherent)
+                self._log_db_interaction("INSERT_ATTEMPT", "sinistres_artex", desc_tentative, id_appel_fk_param, id_adherent, conn=conn)
 
                 cursor.execute("SELECT id_adherent_principal FROM contrats WHERE id_contrat = %s", (id_contrat,))
                 result = cursor.fetchone()
                 if not result or result[0] != id_adherent:
                     logger.warning(f"Tentative de création de sinistre pour le contrat {id_contrat} par l'adhérent non principal {id_adherent}.")
-                    self._log_db_interaction("INSERT_FAIL", "sinistres_artex", f"Échec création sinistre: contrat {id_contrat} n'appartient pas à l'adhérent {id_adherent}.", id_appel_fk_param, id_adherent)
+                    conn.rollback() # Termine la transaction de lecture avant la journalisation
+                    self._log_db_interaction("INSERT_FAIL", "sinistres_artex", f"Échec création sinistre: contrat {id_contrat} n'appartient pas à l'adhérent {id_adherent}.", id_appel_fk_param, id_adherent, conn=conn)
                     return None
 
                 query = """
@@ -353,14 +448,15 @@ class ExtranetDatabaseDriver:
                 new_id = cursor.lastrowid
                 conn.commit()
                 logger.info(f"Sinistre créé avec succès avec l'ID : {new_id}")
-                self._log_db_interaction("INSERT_SUCCESS", "sinistres_artex", f"Sinistre créé avec succès. ID: {new_id}", id_appel_fk_param, id_adherent)
-                return self.get_sinistre_by_id(new_id, id_appel_fk_param=id_appel_fk_param) # Passer call_id pour la consultation
+                self._log_db_interaction("INSERT_SUCCESS", "sinistres_artex", f"Sinistre créé avec succès. ID: {new_id}", id_appel_fk_param, id_adherent, conn=conn)
 
             except mysql.connector.Error as err:
                 logger.error(f"Erreur de base de données lors de la création du sinistre : {err}")
-                self._log_db_interaction("INSERT_FAIL", "sinistres_artex", f"Échec création sinistre (DB Error): {err}", id_appel_fk_param, id_adherent)
                 conn.rollback()
+                self._log_db_interaction("INSERT_FAIL", "sinistres_artex", f"Échec création sinistre (DB Error): {err}", id_appel_fk_param, id_adherent, conn=conn)
                 return None
+        # Relecture après restitution de la connexion (get_sinistre_by_id en emprunte une).
+        return self.get_sinistre_by_id(new_id, id_appel_fk_param=id_appel_fk_param) # Passer call_id pour la consultation
 
     def update_sinistre_status(self, sinistre_id: int, new_status: str, notes: Optional[str] = None, id_appel_fk_param: Optional[int] = None) -> bool:
         """Met à jour le statut d'un sinistre et ajoute éventuellement des notes."""
@@ -386,15 +482,15 @@ class ExtranetDatabaseDriver:
                 
                 conn.commit()
                 if cursor.rowcount > 0:
-                    self._log_db_interaction("UPDATE_SUCCESS", "sinistres_artex", f"MAJ statut sinistre ID: {sinistre_id} réussie. {cursor.rowcount} ligne(s) affectée(s).", id_appel_fk_param)
+                    self._log_db_interaction("UPDATE_SUCCESS", "sinistres_artex", f"MAJ statut sinistre ID: {sinistre_id} réussie. {cursor.rowcount} ligne(s) affectée(s).", id_appel_fk_param, conn=conn)
                     return True
                 else:
-                    self._log_db_interaction("UPDATE_NOCHANGE", "sinistres_artex", f"MAJ statut sinistre ID: {sinistre_id} n'a affecté aucune ligne.", id_appel_fk_param)
+                    self._log_db_interaction("UPDATE_NOCHANGE", "sinistres_artex", f"MAJ statut sinistre ID: {sinistre_id} n'a affecté aucune ligne.", id_appel_fk_param, conn=conn)
                     return False
             except mysql.connector.Error as err:
                 logger.error(f"Échec de la mise à jour du statut pour le sinistre {sinistre_id} : {err}")
-                self._log_db_interaction("UPDATE_FAIL", "sinistres_artex", f"ÉCHEC MAJ statut sinistre ID: {sinistre_id}. Erreur: {err}", id_appel_fk_param)
                 conn.rollback()
+                self._log_db_interaction("UPDATE_FAIL", "sinistres_artex", f"ÉCHEC MAJ statut sinistre ID: {sinistre_id}. Erreur: {err}", id_appel_fk_param, conn=conn)
                 return False
 
     # --- Journalisation des Appels pour Tableau de Bord ---
@@ -408,12 +504,15 @@ class ExtranetDatabaseDriver:
             INSERT INTO journal_appels (id_livekit_room, timestamp_debut, numero_appelant)
             VALUES (%s, NOW(), %s)
         """
+        import kpi_rollups
         try:
             with self._get_connection() as conn:
                 cursor = conn.cursor()
                 cursor.execute(query, (id_livekit_room, numero_appelant))
+                id_appel = cursor.lastrowid # ID de la nouvelle ligne insérée
+                kpi_rollups.record_call_started(cursor, id_appel)
                 conn.commit()
-                return cursor.lastrowid # Retourne l'ID de la nouvelle ligne insérée
+                return id_appel
         except mysql.connector.Error as err:
             logger.error(f"Erreur lors de l'enregistrement du début d'appel pour {id_livekit_room}: {err}")
             # Ici, nous devrions aussi appeler log_system_error si disponible
@@ -437,13 +536,20 @@ class ExtranetDatabaseDriver:
                 chemin_enregistrement_audio = %s
             WHERE id_appel = %s AND timestamp_fin IS NULL
         """
+        import evaluation_queue
+        import kpi_rollups
         try:
             with self._get_connection() as conn:
                 cursor = conn.cursor()
                 # On ajoute chemin_enregistrement_audio aux valeurs
                 cursor.execute(query, (resume_appel, transcription, statut, chemin_enregistrement_audio, id_appel))
+                updated = cursor.rowcount > 0
+                if updated:
+                    # Uniquement à la première clôture (timestamp_fin IS NULL) : pas de double comptage.
+                    kpi_rollups.record_call_ended(cursor, id_appel)
+                    evaluation_queue.enqueue_call(cursor, id_appel)
                 conn.commit()
-                return cursor.rowcount > 0
+                return updated
         except mysql.connector.Error as err:
             logger.error(f"Erreur lors de l'enregistrement de la fin d'appel pour l'ID {id_appel}: {err}")
             return False
@@ -465,6 +571,30 @@ class ExtranetDatabaseDriver:
             # log_system_error("db_driver.enregistrer_contexte_adherent_appel", f"MySQL Error: {err}", err, id_appel_fk=id_appel)
             return False
 
+    def planifier_rappel(self, motif: str, id_appel: Optional[int] = None, id_adherent: Optional[int] = None,
+                         telephone: Optional[str] = None) -> Optional[int]:
+        """
+        Ajoute un rappel à la file des campagnes sortantes (campaign_dialer.py), composable après
+        CAMPAIGN_CALLBACK_DELAY_SECONDS (l'appelant est encore en ligne quand l'agent le planifie).
+        Sans téléphone, le numéro de l'appelant de l'appel `id_appel` est utilisé.
+        Retourne l'ID du rappel, ou None si aucun numéro n'est connu ou en cas d'échec.
+        """
+        # Import local : le composeur (et ses métriques) n'est chargé que par les processus qui planifient des rappels.
+        import campaign_dialer
+        try:
+            with self._get_connection() as conn:
+                cursor = conn.cursor()
+                id_rappel = campaign_dialer.enqueue_callback(
+                    cursor, telephone, motif, id_appel, id_adherent,
+                    delay_seconds=campaign_dialer.CALLBACK_DELAY_SECONDS,
+                )
+                conn.commit()
+                return id_rappel
+        except mysql.connector.Error as err:
+            logger.error(f"Erreur lors de la planification d'un rappel pour l'appel ID {id_appel}: {err}")
+            log_system_error("db_driver.planifier_rappel", f"MySQL Error: {err}", err, contexte_supplementaire={"id_appel": id_appel})
+            return None
+
     def enregistrer_action_agent(self, id_appel_fk: int, type_action: str,
                                  nom_outil: Optional[str] = None, parametres_outil: Optional[dict] = None,
                                  resultat_outil: Optional[str] = None, message_dit: Optional[str] = None,
@@ -511,10 +641,13 @@ class ExtranetDatabaseDriver:
 
     # --- Journalisation des Interactions BD ---
     def _log_db_interaction(self, type_requete: str, table_affectee: str, description_action: str,
-                            id_appel_fk: Optional[int] = None, id_adherent_concerne: Optional[int] = None):
+                            id_appel_fk: Optional[int] = None, id_adherent_concerne: Optional[int] = None,
+                            conn=None):
         """
         Journalise une interaction avec la BD dans la table 'interactions_bd'.
-        Utilise sa propre connexion pour s'assurer que la journalisation a lieu même si la transaction principale est annulée.
+        Avec `conn`, la connexion déjà empruntée par l'appelant est réutilisée : elle doit être hors transaction
+        (après commit ou rollback), la journalisation ne dépend donc pas de la transaction principale.
+        Sinon, une connexion est empruntée au pool le temps de l'écriture.
         """
         if table_affectee == 'interactions_bd': # Évite la journalisation récursive
             return
@@ -524,20 +657,22 @@ class ExtranetDatabaseDriver:
             (id_appel_fk, timestamp_interaction, type_requete, table_affectee, description_action, id_adherent_concerne)
             VALUES (%s, NOW(), %s, %s, %s, %s)
         """
-        # Utiliser une connexion séparée pour la journalisation pour garantir l'écriture.
+        # Pas de seconde connexion quand l'appelant en détient déjà une : deux emprunts par requête
+        # journalisée épuisaient le pool sous charge.
         # Note: la gestion des erreurs ici est simplifiée. Une application de production pourrait avoir un mécanisme de file d'attente ou de fallback plus robuste.
         conn_log = None
         try:
-            conn_log = mysql.connector.connect(**self.connection_params) # Ouvre une nouvelle connexion
-            cursor = conn_log.cursor()
+            if conn is None:
+                conn_log = self.acquire_connection()
+            cursor = (conn or conn_log).cursor()
             cursor.execute(log_query, (id_appel_fk, type_requete, table_affectee, description_action, id_adherent_concerne))
-            conn_log.commit()
+            (conn or conn_log).commit()
         except mysql.connector.Error as e:
             logger.error(f"CRITIQUE: Échec de la journalisation de l'interaction BD dans la table interactions_bd: {e} - Action: {description_action}")
             # Idéalement, log_system_error serait appelé ici aussi, mais attention aux dépendances circulaires si error_logger utilise db_driver.
         finally:
-            if conn_log and conn_log.is_connected():
-                conn_log.close()
+            if conn_log:
+                self.release_connection(conn_log)
     
     # --- MÉTHODE CORRIGÉE POUR LA BASE DE CONNAISSANCES ---
     # --- MÉTHODE CORRIGÉE POUR LA BASE DE CONNAISSANCES ---
@@ -610,12 +745,15 @@ class ExtranetDatabaseDriver:
             INSERT INTO feedback_appel (id_appel_fk, note_satisfaction, commentaire)
             VALUES (%s, %s, %s)
         """
+        import kpi_rollups
         try:
             with self._get_connection() as conn:
                 cursor = conn.cursor()
                 cursor.execute(query, (id_appel_fk, note, commentaire))
+                feedback_id = cursor.lastrowid
+                kpi_rollups.record_feedback(cursor, note)
                 conn.commit()
-                return cursor.lastrowid is not None
+                return feedback_id is not None
         except mysql.connector.Error as err:
             logger.error(f"Erreur lors de l'enregistrement du feedback pour l'appel ID {id_appel_fk}: {err}")
             log_system_error("db_driver.enregistrer_feedback", f"MySQL Error: {err}", err, id_appel_fk=id_appel_fk)
@@ -645,4 +783,39 @@ class ExtranetDatabaseDriver:
         except mysql.connector.Error as err:
             logger.error(f"Erreur lors de l'enregistrement de l'évaluation pour l'appel ID {id_appel}: {err}")
             log_system_error("db_driver.enregistrer_evaluation_appel", f"MySQL Error: {err}", err, id_appel_fk=id_appel)
-            return False
\ No newline at end of file
+            return False
+
+    def enregistrer_evaluations_appels(self, evaluations: List[tuple], version_prompt: Optional[str] = None,
+                                       modele: Optional[str] = None) -> int:
+        """
+        Version par lots de enregistrer_evaluation_appel : une seule connexion et une seule transaction
+        pour plusieurs évaluations. `evaluations` contient des tuples (id_appel, resume, conformite, resolution).
+        La version du prompt et le modèle qui ont produit le lot sont enregistrés avec chaque évaluation.
+        Retourne le nombre de lignes mises à jour (0 en cas d'erreur).
+        """
+        if not evaluations:
+            return 0
+        query = """
+            UPDATE journal_appels
+            SET 
+                resume_appel = %s,
+                evaluation_conformite = %s,
+                evaluation_resolution_appel = %s,
+                evaluation_version_prompt = %s,
+                evaluation_modele = %s,
+                evaluation_le = NOW()
+            WHERE id_appel = %s
+        """
+        params = [(resume, conformite, resolution, version_prompt, modele, id_appel)
+                  for id_appel, resume, conformite, resolution in evaluations]
+        try:
+            with self._get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.executemany(query, params)
+                conn.commit()
+                logger.info(f"{len(evaluations)} évaluation(s) enregistrée(s) en lot.")
+                return cursor.rowcount
+        except mysql.connector.Error as err:
+            logger.error(f"Erreur lors de l'enregistrement d'un lot de {len(evaluations)} évaluation(s): {err}")
+            log_system_error("db_driver.enregistrer_evaluations_appels", f"MySQL Error: {err}", err)
+            return 0
\ No newline at end of file
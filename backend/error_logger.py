@@ -1,7 +1,17 @@
+import atexit
+import datetime
+import hashlib
 import logging
+import os
+import queue
+import threading
+import time
 import traceback
 import json
-from typing import Optional, Dict, Any
+from dataclasses import dataclass, field
+from typing import Optional, Dict, Any, List, Tuple
+import kpi_rollups
+import metrics
 import mysql.connector # Needed for type hinting if db_driver is passed, or for direct connection
 # To avoid circular dependency if ExtranetDatabaseDriver also uses log_system_error,
 # this module should ideally take connection parameters or a pre-configured db connection factory.
@@ -14,6 +24,42 @@ logger = logging.getLogger(__name__)
 # preventing circular imports if ExtranetDatabaseDriver also wants to use this logger.
 DB_CONNECTION_PARAMS = None
 
+# --- Journalisation asynchrone ---
+# log_system_error ne fait que déposer l'erreur dans une file : un thread d'arrière-plan (un par
+# processus) regroupe les erreurs identiques (même empreinte) sur une fenêtre de temps, les insère
+# par lots sur une connexion réutilisée, et les écrit dans un fichier local si la BD est injoignable.
+# Le fichier est rejoué dès que la BD redevient disponible.
+ERROR_LOG_WINDOW_SECONDS = float(os.getenv("ERROR_LOG_WINDOW_SECONDS", "5"))
+ERROR_LOG_QUEUE_SIZE = int(os.getenv("ERROR_LOG_QUEUE_SIZE", "10000"))
+ERROR_LOG_MAX_BATCH = int(os.getenv("ERROR_LOG_MAX_BATCH", "500"))
+ERROR_LOG_RETRY_SECONDS = float(os.getenv("ERROR_LOG_RETRY_SECONDS", "30"))
+ERROR_LOG_FALLBACK_FILE = os.getenv(
+    "ERROR_LOG_FALLBACK_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "erreurs_systeme_fallback.jsonl")
+)
+
+INSERT_ERRORS_QUERY = """
+    INSERT INTO erreurs_systeme
+    (id_appel_fk, timestamp_erreur, source_erreur, message_erreur, trace_erreur, contexte_supplementaire,
+     nb_occurrences, empreinte_erreur)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+"""
+
+@dataclass
+class _ErrorEvent:
+    source_erreur: str
+    message_erreur: str
+    exception_obj: Optional[BaseException]
+    id_appel_fk: Optional[int]
+    contexte_supplementaire: Optional[Dict[str, Any]]
+    empreinte: str
+    timestamp: datetime.datetime = field(default_factory=datetime.datetime.now)
+
+@dataclass
+class _AggregatedError:
+    """Erreurs de même empreinte (et même appel) survenues pendant la fenêtre en cours."""
+    first: _ErrorEvent
+    nb_occurrences: int = 1
+
 def set_db_connection_params(params: Dict):
     """
     Sets the database connection parameters for the error logger.
@@ -37,6 +83,235 @@ def _get_db_connection_for_error_logging():
         logger.error(f"CRITIQUE: Impossible de se connecter à la BD pour la journalisation des erreurs: {e}")
         return None
 
+def error_fingerprint(source_erreur: str, exception_obj: Optional[BaseException], message_erreur: str) -> str:
+    """
+    Empreinte d'une erreur : source + type d'exception + dernière frame de la trace (fichier:ligne:fonction).
+    Sans exception, le message remplace le type et la frame.
+    """
+    if exception_obj is not None:
+        tb = exception_obj.__traceback__
+        while tb is not None and tb.tb_next is not None:
+            tb = tb.tb_next
+        frame = f"{tb.tb_frame.f_code.co_filename}:{tb.tb_lineno}:{tb.tb_frame.f_code.co_name}" if tb else ""
+        key = f"{source_erreur}|{type(exception_obj).__module__}.{type(exception_obj).__qualname__}|{frame}"
+    else:
+        key = f"{source_erreur}|{message_erreur}"
+    return hashlib.sha1(key.encode("utf-8", errors="replace")).hexdigest()
+
+def _format_trace(exception_obj: Optional[BaseException]) -> Optional[str]:
+    if exception_obj is None or exception_obj.__traceback__ is None:
+        return None
+    return "".join(traceback.format_exception(type(exception_obj), exception_obj, exception_obj.__traceback__))
+
+def _serialize_context(contexte: Optional[Dict[str, Any]]) -> Optional[str]:
+    if not contexte:
+        return None
+    try:
+        return json.dumps(contexte)
+    except TypeError as json_err: # Erreur de sérialisation JSON
+        return json.dumps({"json_serialization_error": str(json_err)})
+
+
+class _ErrorSink:
+    """File d'erreurs et thread d'écriture en arrière-plan (un par processus)."""
+
+    def __init__(self):
+        self._queue: "queue.Queue[Optional[_ErrorEvent]]" = queue.Queue(maxsize=ERROR_LOG_QUEUE_SIZE)
+        self._pending: Dict[Tuple[str, Optional[int]], _AggregatedError] = {}
+        self._window_start = time.monotonic()
+        self._conn = None
+        self._db_retry_at = 0.0
+        self._flush_requested = threading.Event()
+        self._flush_done = threading.Condition()
+        self._flush_generation = 0
+        self._dropped = 0
+        self._dropped_lock = threading.Lock()
+        self._pid = os.getpid()
+        self._thread = threading.Thread(target=self._run, name="error_logger", daemon=True)
+        self._thread.start()
+
+    def submit(self, event: _ErrorEvent):
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            with self._dropped_lock:
+                self._dropped += 1
+                dropped = self._dropped
+            if dropped == 1 or dropped % 1000 == 0:
+                logger.critical(f"File de journalisation des erreurs pleine : {dropped} erreur(s) non journalisée(s) en BD.")
+
+    def flush(self, timeout: float = 10.0) -> bool:
+        """Force l'écriture des erreurs en attente ; retourne False si le délai est dépassé."""
+        with self._flush_done:
+            target = self._flush_generation + 1
+            self._flush_requested.set()
+            try:
+                self._queue.put_nowait(None) # Réveille le thread
+            except queue.Full:
+                pass
+            return self._flush_done.wait_for(lambda: self._flush_generation >= target, timeout=timeout)
+
+    # --- Thread d'arrière-plan ---
+
+    def _run(self):
+        while True:
+            timeout = max(0.0, self._window_start + ERROR_LOG_WINDOW_SECONDS - time.monotonic())
+            try:
+                event = self._queue.get(timeout=timeout)
+                if event is not None:
+                    self._add(event)
+                    # Vider ce qui est déjà en file sans attendre
+                    while len(self._pending) < ERROR_LOG_MAX_BATCH:
+                        event = self._queue.get_nowait()
+                        if event is not None:
+                            self._add(event)
+            except queue.Empty:
+                pass
+
+            window_elapsed = time.monotonic() - self._window_start >= ERROR_LOG_WINDOW_SECONDS
+            if window_elapsed or self._flush_requested.is_set() or len(self._pending) >= ERROR_LOG_MAX_BATCH:
+                flush_requested = self._flush_requested.is_set()
+                self._flush_requested.clear()
+                try:
+                    self._write_pending()
+                except Exception as e: # Le thread ne doit jamais s'arrêter
+                    logger.critical(f"ÉCHEC CRITIQUE DE JOURNALISATION D'ERREUR: {e}", exc_info=True)
+                self._window_start = time.monotonic()
+                if flush_requested:
+                    with self._flush_done:
+                        self._flush_generation += 1
+                        self._flush_done.notify_all()
+
+    def _add(self, event: _ErrorEvent):
+        key = (event.empreinte, event.id_appel_fk)
+        aggregated = self._pending.get(key)
+        if aggregated is None:
+            self._pending[key] = _AggregatedError(first=event)
+        else:
+            aggregated.nb_occurrences += 1
+
+    def _rows_from_pending(self) -> List[tuple]:
+        rows = []
+        for aggregated in self._pending.values():
+            event = aggregated.first
+            trace_str = _format_trace(event.exception_obj)
+            if trace_str:
+                logger.error(f"Trace de l'erreur {event.source_erreur} ({aggregated.nb_occurrences} occurrence(s)) :\n{trace_str}")
+            rows.append((
+                event.id_appel_fk,
+                event.timestamp.isoformat(sep=' ', timespec='seconds'),
+                event.source_erreur,
+                event.message_erreur,
+                trace_str,
+                _serialize_context(event.contexte_supplementaire),
+                aggregated.nb_occurrences,
+                event.empreinte,
+            ))
+        self._pending.clear()
+        return rows
+
+    def _write_pending(self):
+        rows = self._rows_from_pending()
+        if not rows and not os.path.exists(ERROR_LOG_FALLBACK_FILE):
+            return
+        if not DB_CONNECTION_PARAMS:
+            return # Pas de BD configurée : les erreurs ont déjà été écrites dans le log standard.
+        if time.monotonic() < self._db_retry_at or not self._insert(rows):
+            self._write_fallback(rows)
+            return
+        self._replay_fallback()
+
+    def _connection(self):
+        if self._conn is not None:
+            try:
+                self._conn.ping(reconnect=True, attempts=1, delay=0)
+                return self._conn
+            except mysql.connector.Error:
+                self._close()
+        self._conn = _get_db_connection_for_error_logging()
+        return self._conn
+
+    def _close(self):
+        try:
+            if self._conn is not None:
+                self._conn.close()
+        except mysql.connector.Error:
+            pass
+        self._conn = None
+
+    def _insert(self, rows: List[tuple]) -> bool:
+        if not rows:
+            return True
+        conn = self._connection()
+        if conn is None:
+            self._db_retry_at = time.monotonic() + ERROR_LOG_RETRY_SECONDS
+            return False
+        try:
+            cursor = conn.cursor()
+            cursor.executemany(INSERT_ERRORS_QUERY, rows)
+            kpi_rollups.record_errors(cursor, sum(row[6] for row in rows))
+            conn.commit()
+            return True
+        except mysql.connector.Error as db_log_err:
+            # Si la journalisation dans la BD échoue, on ne peut que le logger dans le log standard.
+            logger.critical(f"ÉCHEC CRITIQUE DE JOURNALISATION D'ERREUR: Impossible d'écrire {len(rows)} erreur(s) dans erreurs_systeme. Erreur de journalisation BD: {db_log_err}")
+            self._close()
+            self._db_retry_at = time.monotonic() + ERROR_LOG_RETRY_SECONDS
+            return False
+
+    def _write_fallback(self, rows: List[tuple]):
+        if not rows:
+            return
+        try:
+            with open(ERROR_LOG_FALLBACK_FILE, "a", encoding="utf-8") as f:
+                for row in rows:
+                    f.write(json.dumps(row, ensure_ascii=False) + "\n")
+            logger.warning(f"BD indisponible : {len(rows)} erreur(s) écrite(s) dans {ERROR_LOG_FALLBACK_FILE}.")
+        except OSError as file_err:
+            logger.critical(f"ÉCHEC CRITIQUE DE JOURNALISATION D'ERREUR: fichier de secours inaccessible: {file_err}")
+
+    def _replay_fallback(self):
+        """Réinsère en BD les erreurs du fichier de secours, puis le supprime."""
+        if not os.path.exists(ERROR_LOG_FALLBACK_FILE):
+            return
+        replay_path = f"{ERROR_LOG_FALLBACK_FILE}.{os.getpid()}.rejeu"
+        try:
+            os.replace(ERROR_LOG_FALLBACK_FILE, replay_path) # Un autre processus peut continuer à écrire dans un nouveau fichier
+            with open(replay_path, "r", encoding="utf-8") as f:
+                rows = [tuple(json.loads(line)) for line in f if line.strip()]
+        except (OSError, ValueError) as e:
+            logger.error(f"Rejeu du fichier de secours des erreurs impossible : {e}")
+            return
+        for start in range(0, len(rows), ERROR_LOG_MAX_BATCH):
+            if not self._insert(rows[start:start + ERROR_LOG_MAX_BATCH]):
+                self._write_fallback(rows[start:])
+                break
+        else:
+            logger.info(f"{len(rows)} erreur(s) du fichier de secours réinsérée(s) en BD.")
+        os.remove(replay_path)
+
+
+_sink: Optional[_ErrorSink] = None
+_sink_lock = threading.Lock()
+metrics.QUEUE_DEPTH.labels("error_logger").set_function(lambda: _sink._queue.qsize() if _sink is not None else 0)
+
+def _get_sink() -> _ErrorSink:
+    global _sink
+    # Après un fork, le thread du processus parent n'existe pas dans l'enfant : on en recrée un.
+    if _sink is None or _sink._pid != os.getpid():
+        with _sink_lock:
+            if _sink is None or _sink._pid != os.getpid():
+                _sink = _ErrorSink()
+    return _sink
+
+def flush_error_log(timeout: float = 10.0) -> bool:
+    """Écrit immédiatement les erreurs en attente (à appeler avant l'arrêt d'un processus)."""
+    if _sink is None or _sink._pid != os.getpid():
+        return True
+    return _sink.flush(timeout)
+
+atexit.register(flush_error_log, 5.0)
+
 def log_system_error(
     source_erreur: str,
     message_erreur: str,
@@ -45,61 +320,30 @@ def log_system_error(
     contexte_supplementaire: Optional[Dict[str, Any]] = None
 ):
     """
-    Journalise une erreur dans la table 'erreurs_systeme' et dans le logger Python standard.
+    Journalise une erreur dans le logger Python standard et la transmet à la table 'erreurs_systeme'
+    de façon asynchrone (regroupement des répétitions, insertion par lots).
+    Ne bloque jamais sur la BD : peut être appelée depuis une coroutine.
     """
-    trace_str = None
-    if exception_obj:
-        trace_str = traceback.format_exc()
-        if not message_erreur: # Si aucun message spécifique, utiliser le message de l'exception
-            message_erreur = str(exception_obj)
+    if exception_obj and not message_erreur: # Si aucun message spécifique, utiliser le message de l'exception
+        message_erreur = str(exception_obj)
 
     # Journaliser dans le logger Python standard en premier
     log_message_std = f"ERREUR SYSTÈME: Source: {source_erreur}, Message: {message_erreur}"
     if id_appel_fk is not None: # Vérifier explicitement None car 0 est un ID valide
         log_message_std += f", ID Appel FK: {id_appel_fk}"
     if contexte_supplementaire:
-        log_message_std += f", Contexte: {json.dumps(contexte_supplementaire)}" # S'assurer que le contexte est sérialisable pour le log std
-
-    # Ne pas inclure la trace complète dans le log INFO/ERROR initial, seulement dans le log de la DB ou un log DEBUG.
-    # logger.error(log_message_std) # Journalisation simple
-    # Pour une journalisation plus détaillée avec la trace si disponible :
-    if trace_str:
-        logger.error(f"{log_message_std}\nTrace:\n{trace_str}")
-    else:
-        logger.error(log_message_std)
-
-
-    # Journaliser dans la base de données
-    conn = _get_db_connection_for_error_logging()
-    if not conn:
-        logger.error("CRITIQUE: Connexion BD non disponible pour error_logger, l'erreur système ne sera pas journalisée dans la BD.")
-        return
+        log_message_std += f", Contexte: {contexte_supplementaire}"
+    # La trace complète n'est formatée qu'une fois par empreinte et par fenêtre, dans le thread d'écriture.
+    logger.error(log_message_std)
 
-    query = """
-        INSERT INTO erreurs_systeme
-        (id_appel_fk, timestamp_erreur, source_erreur, message_erreur, trace_erreur, contexte_supplementaire)
-        VALUES (%s, NOW(), %s, %s, %s, %s)
-    """
-    try:
-        cursor = conn.cursor()
-        contexte_json_str = json.dumps(contexte_supplementaire) if contexte_supplementaire else None
-        cursor.execute(query, (id_appel_fk, source_erreur, message_erreur, trace_str, contexte_json_str))
-        conn.commit()
-    except mysql.connector.Error as db_log_err:
-        # Si la journalisation dans la BD échoue, on ne peut que le logger dans le log standard.
-        logger.critical(f"ÉCHEC CRITIQUE DE JOURNALISATION D'ERREUR: Impossible d'écrire dans erreurs_systeme. Erreur originale: '{message_erreur}'. Erreur de journalisation BD: {db_log_err}")
-    except TypeError as json_err: # Erreur de sérialisation JSON
-        logger.critical(f"ÉCHEC CRITIQUE DE JOURNALISATION D'ERREUR: Erreur de sérialisation JSON pour contexte_supplementaire. Erreur originale: '{message_erreur}'. Erreur JSON: {json_err}")
-        # Tentative de journalisation sans le contexte JSON problématique
-        try:
-            cursor = conn.cursor()
-            cursor.execute(query, (id_appel_fk, source_erreur, message_erreur, trace_str, json.dumps({"json_serialization_error": str(json_err)})))
-            conn.commit()
-        except Exception as fallback_err:
-            logger.critical(f"ÉCHEC CRITIQUE DE JOURNALISATION D'ERREUR: Tentative de secours échouée. Erreur: {fallback_err}")
-    finally:
-        if conn and conn.is_connected():
-            conn.close()
+    _get_sink().submit(_ErrorEvent(
+        source_erreur=source_erreur,
+        message_erreur=message_erreur,
+        exception_obj=exception_obj,
+        id_appel_fk=id_appel_fk,
+        contexte_supplementaire=contexte_supplementaire,
+        empreinte=error_fingerprint(source_erreur, exception_obj, message_erreur),
+    ))
 
 # Exemple d'utilisation (ne pas exécuter directement ici)
 # if __name__ == '__main__':
@@ -122,3 +366,4 @@ def log_system_error(
 #         log_system_error("test_script.main_logic", "Une division par zéro s'est produite.", e, id_appel_fk=123, contexte_supplementaire={"valeur_x": 1, "operation": "division"})
 #
 #     log_system_error("test_script.custom_error", "Ceci est une erreur personnalisée sans exception.", id_appel_fk=456)
+#     flush_error_log()
@@ -0,0 +1,79 @@
+# evaluation_cache.py
+#
+# Cache local des évaluations LLM, indexé par (empreinte de la transcription envoyée, version du prompt,
+# modèle). Réévaluer un appel dont la transcription, le prompt et le modèle n'ont pas changé
+# ne coûte alors aucun appel au LLM. Stockage SQLite (EVALUATION_CACHE_FILE).
+# Les réponses non parsables ne sont pas mises en cache.
+
+import hashlib
+import logging
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+from typing import Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "evaluation_cache.sqlite3")
+
+EvaluationResult = Tuple[str, str, str] # (resume, conformite, resolution)
+
+
+def cache_key(transcription: str, prompt_version: str, model: str) -> str:
+    digest = hashlib.sha256(transcription.encode("utf-8")).hexdigest()
+    return f"{digest}:{prompt_version}:{model}"
+
+
+class EvaluationCache:
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS evaluations (
+            cle TEXT PRIMARY KEY,
+            id_appel INTEGER,
+            resume TEXT NOT NULL,
+            conformite TEXT NOT NULL,
+            resolution TEXT NOT NULL,
+            cree_le REAL NOT NULL
+        )
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or os.getenv("EVALUATION_CACHE_FILE", DEFAULT_CACHE_FILE)
+        self.hits = 0
+        self.misses = 0
+        with self._connection() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(self.SCHEMA)
+
+    @contextmanager
+    def _connection(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def get(self, key: str) -> Optional[EvaluationResult]:
+        with self._connection() as conn:
+            row = conn.execute("SELECT resume, conformite, resolution FROM evaluations WHERE cle = ?", (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return row
+
+    def put(self, key: str, id_appel: int, result: EvaluationResult):
+        try:
+            with self._connection() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO evaluations (cle, id_appel, resume, conformite, resolution, cree_le) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (key, id_appel, *result, time.time()),
+                )
+        except sqlite3.Error as e:
+            # Le cache n'est qu'une optimisation : l'évaluation est écrite en base quoi qu'il arrive.
+            logger.warning(f"Mise en cache de l'évaluation de l'appel {id_appel} impossible : {e}")
+
+    def size(self) -> int:
+        with self._connection() as conn:
+            return conn.execute("SELECT COUNT(*) FROM evaluations").fetchone()[0]
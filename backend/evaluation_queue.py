@@ -0,0 +1,210 @@
+# evaluation_queue.py
+#
+# File de travail des évaluations post-appel, stockée dans la table evaluation_jobs (migration 004).
+# - enqueue_call : appelé par db_driver dans la transaction qui clôture l'appel ;
+# - claim_jobs : réservation d'un lot de jobs (SELECT ... FOR UPDATE SKIP LOCKED) avec un bail ;
+#   claim_call : réservation du job d'un appel précis (post_call.py, juste après la fin de l'appel) ;
+# - complete_jobs / fail_job : fin du job, ou nouvelle tentative avec backoff exponentiel.
+# Comme kpi_rollups, ce module n'importe pas db_driver : les fonctions reçoivent un curseur
+# ou le driver (tout objet exposant _get_connection()).
+#
+# État de la file : python evaluation_queue.py status
+
+import logging
+import os
+import socket
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+LEASE_SECONDS = int(os.getenv("EVALUATION_JOB_LEASE_SECONDS", "600"))
+MAX_ATTEMPTS = int(os.getenv("EVALUATION_JOB_MAX_ATTEMPTS", "5"))
+BACKOFF_BASE_SECONDS = 60
+BACKOFF_MAX_SECONDS = 6 * 3600
+
+
+def default_worker_id() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+def backoff_seconds(attempts: int) -> int:
+    """Délai avant la tentative suivante : 1 min, 2 min, 4 min... plafonné à 6 h."""
+    return min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** max(0, attempts - 1))
+
+
+def enqueue_call(cursor, id_appel: int):
+    """
+    Ajoute l'évaluation de l'appel à la file (si sa transcription est exploitable).
+    Un échec (table absente avant migration...) ne doit pas faire échouer la clôture de l'appel.
+    """
+    try:
+        cursor.execute("""
+            INSERT IGNORE INTO evaluation_jobs (id_appel_fk)
+            SELECT id_appel FROM journal_appels
+            WHERE id_appel = %s AND transcription_complete IS NOT NULL AND transcription_complete != '[]'
+        """, (id_appel,))
+    except Exception as e:
+        logger.warning(f"Mise en file de l'évaluation de l'appel {id_appel} ignorée : {e}")
+
+
+def claim_jobs(db, worker_id: str, limit: int, lease_seconds: int = LEASE_SECONDS) -> List[int]:
+    """
+    Réserve jusqu'à `limit` jobs disponibles pour `worker_id` et retourne les id_appel correspondants.
+    Les lignes verrouillées par un autre évaluateur sont sautées (SKIP LOCKED, MySQL 8+) ;
+    un job en_cours dont le bail a expiré est repris.
+    """
+    with db._get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT id_job, id_appel_fk FROM evaluation_jobs
+            WHERE statut IN ('en_attente', 'en_cours') AND disponible_a <= NOW()
+            ORDER BY disponible_a
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        """, (limit,))
+        rows = cursor.fetchall()
+        if not rows:
+            conn.rollback()
+            return []
+        placeholders = ", ".join(["%s"] * len(rows))
+        cursor.execute(f"""
+            UPDATE evaluation_jobs
+            SET statut = 'en_cours', nb_tentatives = nb_tentatives + 1, evaluateur = %s,
+                disponible_a = NOW() + INTERVAL %s SECOND
+            WHERE id_job IN ({placeholders})
+        """, (worker_id, lease_seconds, *[row[0] for row in rows]))
+        conn.commit()
+        return [row[1] for row in rows]
+
+
+def claim_call(db, worker_id: str, id_appel: int, lease_seconds: int = LEASE_SECONDS) -> bool:
+    """
+    Réserve le job d'un appel précis (traitement post-appel immédiat), qu'il soit en attente ou en backoff.
+    Retourne False si le job est absent, déjà réservé par un autre évaluateur, terminé ou abandonné.
+    """
+    with db._get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            UPDATE evaluation_jobs
+            SET statut = 'en_cours', nb_tentatives = nb_tentatives + 1, evaluateur = %s,
+                disponible_a = NOW() + INTERVAL %s SECOND
+            WHERE id_appel_fk = %s AND statut = 'en_attente'
+        """, (worker_id, lease_seconds, id_appel))
+        conn.commit()
+        return cursor.rowcount > 0
+
+
+def complete_jobs(db, worker_id: str, call_ids: List[int]) -> int:
+    """Marque les jobs terminés (seulement s'ils sont encore réservés par `worker_id`)."""
+    if not call_ids:
+        return 0
+    placeholders = ", ".join(["%s"] * len(call_ids))
+    with db._get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"""
+            UPDATE evaluation_jobs SET statut = 'termine', derniere_erreur = NULL
+            WHERE evaluateur = %s AND statut = 'en_cours' AND id_appel_fk IN ({placeholders})
+        """, (worker_id, *call_ids))
+        conn.commit()
+        return cursor.rowcount
+
+
+def fail_job(db, worker_id: str, id_appel: int, error: str, retry: bool = True,
+             max_attempts: int = MAX_ATTEMPTS) -> Optional[str]:
+    """
+    Échec d'une tentative : le job repasse en_attente après un backoff, ou passe en echec
+    si `retry` est faux ou que `max_attempts` tentatives ont été faites. Retourne le nouveau statut.
+    """
+    with db._get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT nb_tentatives FROM evaluation_jobs
+            WHERE id_appel_fk = %s AND evaluateur = %s AND statut = 'en_cours'
+            FOR UPDATE
+        """, (id_appel, worker_id))
+        row = cursor.fetchone()
+        if row is None:
+            conn.rollback()
+            return None # Bail expiré et job repris par un autre évaluateur
+        attempts = row[0]
+        if retry and attempts < max_attempts:
+            status, delay = 'en_attente', backoff_seconds(attempts)
+        else:
+            status, delay = 'echec', 0
+        cursor.execute("""
+            UPDATE evaluation_jobs
+            SET statut = %s, disponible_a = NOW() + INTERVAL %s SECOND, derniere_erreur = %s
+            WHERE id_appel_fk = %s
+        """, (status, delay, error[:2000], id_appel))
+        conn.commit()
+    if status == 'echec':
+        logger.warning(f"Évaluation de l'appel {id_appel} abandonnée après {attempts} tentative(s) : {error}")
+    return status
+
+
+def enqueue_backlog(db) -> int:
+    """(Re)met en file les appels sans résumé exploitable qui n'ont pas de job actif."""
+    with db._get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            INSERT INTO evaluation_jobs (id_appel_fk)
+            SELECT id_appel FROM journal_appels
+            WHERE (resume_appel IS NULL OR resume_appel LIKE '%Erreur%' OR resume_appel LIKE '%Non généré%')
+              AND (transcription_complete IS NOT NULL AND transcription_complete != '[]')
+            ON DUPLICATE KEY UPDATE
+                -- Affectations évaluées de gauche à droite : les suivantes voient le nouveau statut.
+                statut = IF(statut IN ('termine', 'echec'), 'en_attente', statut),
+                nb_tentatives = IF(statut = 'en_attente', 0, nb_tentatives),
+                disponible_a = IF(statut = 'en_attente', NOW(), disponible_a)
+        """)
+        conn.commit()
+        return cursor.rowcount
+
+
+def enqueue_stale(db, prompt_version: str, model: str) -> int:
+    """
+    (Re)met en file les appels évalués avec une autre version du prompt ou un autre modèle
+    (ou avant l'enregistrement de la version). Les appels déjà à jour ne sont pas touchés.
+    """
+    with db._get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            INSERT INTO evaluation_jobs (id_appel_fk)
+            SELECT id_appel FROM journal_appels
+            WHERE resume_appel IS NOT NULL
+              AND (evaluation_version_prompt IS NULL OR evaluation_version_prompt != %s
+                   OR evaluation_modele IS NULL OR evaluation_modele != %s)
+              AND (transcription_complete IS NOT NULL AND transcription_complete != '[]')
+            ON DUPLICATE KEY UPDATE
+                -- Affectations évaluées de gauche à droite : les suivantes voient le nouveau statut.
+                statut = IF(statut IN ('termine', 'echec'), 'en_attente', statut),
+                nb_tentatives = IF(statut = 'en_attente', 0, nb_tentatives),
+                disponible_a = IF(statut = 'en_attente', NOW(), disponible_a)
+        """, (prompt_version, model))
+        conn.commit()
+        return cursor.rowcount
+
+
+def queue_status(db) -> Dict[str, int]:
+    with db._get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT statut, COUNT(*) FROM evaluation_jobs GROUP BY statut")
+        return {status: count for status, count in cursor.fetchall()}
+
+
+if __name__ == "__main__":
+    import argparse
+    from dotenv import load_dotenv
+    from db_driver import ExtranetDatabaseDriver
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="File des évaluations post-appel.")
+    parser.add_argument("commande", choices=["status", "enqueue-backlog"])
+    args = parser.parse_args()
+
+    driver = ExtranetDatabaseDriver()
+    if args.commande == "enqueue-backlog":
+        logger.info(f"Backlog remis en file ({enqueue_backlog(driver)} ligne(s) affectée(s)).")
+    for status, count in sorted(queue_status(driver).items()):
+        logger.info(f"{status:<12} {count}")
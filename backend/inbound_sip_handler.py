@@ -1,12 +1,22 @@
 # inbound_sip_handler.py
 
+import asyncio
 import os
 import logging
+import time
+from typing import Optional
 from dotenv import load_dotenv
 from fastapi import FastAPI, Request, HTTPException
+from fastapi.responses import PlainTextResponse
 from livekit import api
 import uvicorn
 
+import admission
+import caller_identification
+import metrics
+from db_driver import ExtranetDatabaseDriver
+from room_pool import CREATE_ROOM_LATENCY, WarmRoomPool
+
 # --- Load Environment Variables ---
 # Make sure you have a .env file with your LiveKit credentials
 load_dotenv()
@@ -15,6 +25,31 @@ LIVEKIT_URL = os.environ.get("LIVEKIT_URL")
 LIVEKIT_API_KEY = os.environ.get("LIVEKIT_API_KEY")
 LIVEKIT_API_SECRET = os.environ.get("LIVEKIT_API_SECRET")
 
+# --- Agent dispatch ---
+# AGENT_NAME set (same value as the agent workers): explicit dispatch, the webhook dispatches the agent
+# into each call's room, so the SIP dispatch rule must not dispatch it too. Empty: automatic dispatch.
+AGENT_NAME = os.environ.get("AGENT_NAME", "")
+
+# --- Warm room pool (see room_pool.py) ---
+# SIP_WARM_ROOMS > 0 keeps that many rooms pre-created so the webhook can answer without
+# a CreateRoom round-trip. Requires explicit agent dispatch (AGENT_NAME): otherwise every
+# pre-created room would start an idle agent job.
+WARM_ROOM_POOL_SIZE = int(os.environ.get("SIP_WARM_ROOMS", "0"))
+WARM_ROOM_EMPTY_TIMEOUT = int(os.environ.get("SIP_WARM_ROOM_EMPTY_TIMEOUT", "300"))
+ROOM_EMPTY_TIMEOUT = 60 # Rooms created on demand by the webhook
+
+# --- Caller pre-identification (see caller_identification.py) ---
+# The phone lookup runs while the room is being prepared; SIP_CALLER_LOOKUP=0 disables it.
+CALLER_LOOKUP_ENABLED = os.environ.get("SIP_CALLER_LOOKUP", "1").lower() not in ("0", "false", "non")
+CALLER_LOOKUP_POOL_SIZE = int(os.environ.get("SIP_CALLER_LOOKUP_POOL_SIZE", "4"))
+
+# --- Admission control (see admission.py) ---
+# Calls beyond the capacity reported by the agent workers wait for a free slot, then overflow.
+ADMISSION_ENABLED = os.environ.get("SIP_ADMISSION", "1").lower() not in ("0", "false", "non")
+OVERFLOW_ACTION = os.environ.get("SIP_OVERFLOW_ACTION", "refus")
+OVERFLOW_TRANSFER_TO = os.environ.get("SIP_OVERFLOW_TRANSFER_TO") # e.g. "tel:+33100000000" for 'transfert'
+OVERFLOW_RETRY_AFTER_SECONDS = 30
+
 # --- Basic Logging Configuration ---
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger("sip_inbound_handler")
@@ -25,16 +60,77 @@ app = FastAPI()
 # --- LiveKit API Client ---
 # It's good practice to create the client once and reuse it.
 lk_api = api.LiveKitAPI(LIVEKIT_URL, LIVEKIT_API_KEY, LIVEKIT_API_SECRET)
+warm_rooms: Optional[WarmRoomPool] = None
+caller_db: Optional[ExtranetDatabaseDriver] = None
+admission_controller: Optional[admission.AdmissionController] = None
+
+WEBHOOK_LATENCY = metrics.REGISTRY.histogram(
+    "artex_sip_webhook_seconds", "Inbound SIP webhook handling time, by room source.", ["salle"]
+)
+_direct_create_latency = CREATE_ROOM_LATENCY.labels("webhook")
+
+
+async def create_room(name: str, empty_timeout: int):
+    await lk_api.room.create_room(api.CreateRoomRequest(name=name, empty_timeout=empty_timeout))
+
+async def dispatch_agent(room_name: str):
+    await lk_api.agent_dispatch.create_dispatch(api.CreateAgentDispatchRequest(agent_name=AGENT_NAME, room=room_name))
 
 @app.on_event("startup")
 async def startup_event():
-    """Check for credentials on startup."""
+    """Check for credentials on startup, then start the room pool, the caller lookup and admission control."""
+    global caller_db, admission_controller
+    if CALLER_LOOKUP_ENABLED:
+        try:
+            caller_db = ExtranetDatabaseDriver(
+                pool_size=CALLER_LOOKUP_POOL_SIZE,
+                pool_name="sip_caller_lookup",
+                pool_timeout=caller_identification.LOOKUP_TIMEOUT_SECONDS,
+            )
+        except Exception as e:
+            logger.warning(f"Caller pre-identification disabled: {e}")
+    if ADMISSION_ENABLED:
+        overflow_action = OVERFLOW_ACTION
+        if overflow_action == "transfert" and not OVERFLOW_TRANSFER_TO:
+            logger.error("SIP_OVERFLOW_ACTION=transfert requires SIP_OVERFLOW_TRANSFER_TO: rejecting overflow calls instead.")
+            overflow_action = "refus"
+        if overflow_action not in admission.OVERFLOW_ACTIONS:
+            logger.error(f"Unknown SIP_OVERFLOW_ACTION '{overflow_action}' (expected: {', '.join(admission.OVERFLOW_ACTIONS)}): "
+                         "rejecting overflow calls instead.")
+            overflow_action = "refus"
+        try:
+            admission_controller = admission.AdmissionController(
+                ExtranetDatabaseDriver(pool_size=1, pool_name="sip_admission"),
+                overflow_action=overflow_action,
+                max_queue=int(os.environ.get("SIP_ADMISSION_QUEUE_MAX", "20")),
+                queue_timeout=float(os.environ.get("SIP_ADMISSION_QUEUE_TIMEOUT", "5")),
+            )
+            admission_controller.start()
+        except Exception as e:
+            logger.warning(f"Admission control disabled: {e}")
     if not all([LIVEKIT_URL, LIVEKIT_API_KEY, LIVEKIT_API_SECRET]):
         logger.critical("FATAL: Missing LiveKit credentials. Please check your .env file.")
-        
+        return
+    global warm_rooms
+    if WARM_ROOM_POOL_SIZE > 0 and not AGENT_NAME:
+        logger.error("SIP_WARM_ROOMS requires explicit agent dispatch (AGENT_NAME): room pool not started.")
+    elif WARM_ROOM_POOL_SIZE > 0:
+        warm_rooms = WarmRoomPool(
+            lambda name: create_room(name, WARM_ROOM_EMPTY_TIMEOUT),
+            size=WARM_ROOM_POOL_SIZE,
+            # Keep a margin so a room is never handed out just before LiveKit closes it.
+            max_age=max(10, WARM_ROOM_EMPTY_TIMEOUT - 60),
+            prefix="sip-inbound-",
+        )
+        warm_rooms.start()
+
 @app.on_event("shutdown")
 async def shutdown_event():
-    """Close the LiveKit API client gracefully on shutdown."""
+    """Stop the room pool and admission control, then close the LiveKit API client gracefully on shutdown."""
+    if admission_controller is not None:
+        await admission_controller.stop()
+    if warm_rooms is not None:
+        await warm_rooms.stop()
     await lk_api.aclose()
     logger.info("LiveKit API client closed.")
 
@@ -42,9 +138,12 @@ async def shutdown_event():
 async def handle_inbound_sip(request: Request):
     """
     This endpoint receives webhook events from LiveKit for inbound SIP calls.
-    It creates a room and returns instructions for LiveKit to route the call.
+    It takes a pre-created room from the pool (or creates one) and returns
+    instructions for LiveKit to route the call.
     """
     logger.info("Received inbound SIP call webhook.")
+    started = time.perf_counter()
+    room_source = "erreur"
 
     try:
         # 1. Parse the incoming request from LiveKit
@@ -60,18 +159,55 @@ async def handle_inbound_sip(request: Request):
 
         logger.info(f"Processing call from '{caller_number}' to '{callee_number}' (Call ID: {call_id})")
 
-        # 2. Create a unique room name for this call.
-        room_name = f"sip-inbound-{call_id}"
-        
-        # 3. Create the room on the LiveKit server.
-        await lk_api.room.create_room(name=room_name, empty_timeout=60)
-        logger.info(f"Created LiveKit room: '{room_name}'")
+        # 1b. Admission control: wait for a free agent slot, or apply the overflow action.
+        overflow = None
+        if admission_controller is not None:
+            decision = await admission_controller.admit()
+            if not decision.admitted:
+                overflow = decision.overflow_action
+                room_source = "debordement"
+                logger.warning(f"All agents busy for call {call_id} (waited {decision.waited:.1f}s): overflow action '{overflow}'.")
+                if overflow == "refus":
+                    raise HTTPException(status_code=503, detail="All agents are busy.",
+                                        headers={"Retry-After": str(OVERFLOW_RETRY_AFTER_SECONDS)})
+                if overflow == "transfert":
+                    return {"transfer_to": OVERFLOW_TRANSFER_TO}
+
+        # 1c. Start the caller lookup now: it runs while the room is being prepared.
+        lookup = None
+        if caller_db is not None and overflow is None:
+            lookup_deadline = time.monotonic() + caller_identification.LOOKUP_TIMEOUT_SECONDS
+            lookup = caller_identification.start_lookup(caller_db, caller_number)
+
+        # 2. Take a warm room if one is ready: no LiveKit round-trip before routing.
+        # An overflow 'message' call also gets a room: a worker plays the busy message from its
+        # reserved headroom (AGENT_OVERFLOW_HEADROOM, see admission.py), then hangs up.
+        room_name = warm_rooms.claim() if warm_rooms is not None else None
+        if room_name is not None:
+            room_source = room_source if overflow else "pool"
+            logger.info(f"Using pre-created LiveKit room '{room_name}' for call {call_id}.")
+        else:
+            # 3. Otherwise create a unique room for this call on the LiveKit server.
+            room_name = f"sip-inbound-{call_id}"
+            with _direct_create_latency.time():
+                await create_room(room_name, ROOM_EMPTY_TIMEOUT)
+            room_source = room_source if overflow else "creation"
+            logger.info(f"Created LiveKit room: '{room_name}'")
+
+        # 3b. Explicit dispatch: the agent job starts while the caller lookup completes.
+        dispatch = asyncio.ensure_future(dispatch_agent(room_name)) if AGENT_NAME else None
 
         # 4. Define the participant's details.
         participant_identity = f"sip-user-{caller_number}"
         participant_name = f"Caller ({caller_number})"
-        # This metadata will be available to your agent in the room.
-        participant_metadata = f'{{"caller_number": "{caller_number}"}}'
+        # This metadata will be available to your agent in the room (see caller_identification.py).
+        identification = None
+        if lookup is not None:
+            identification = await caller_identification.await_lookup(lookup, lookup_deadline)
+            logger.info(f"Caller pre-identification for call {call_id}: {identification['statut']}.")
+        participant_metadata = caller_identification.build_participant_metadata(caller_number, identification, overflow)
+        if dispatch is not None:
+            await dispatch
 
         # 5. Return the response to LiveKit.
         # MAJOR CHANGE: We no longer generate a token. We provide the details,
@@ -86,9 +222,20 @@ async def handle_inbound_sip(request: Request):
         logger.info(f"Sending instructions to LiveKit for participant '{participant_identity}'.")
         return response_data
 
+    except HTTPException:
+        raise
     except Exception as e:
+        room_source = "erreur"
         logger.error(f"An error occurred while processing inbound SIP call: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail="Internal Server Error")
+    finally:
+        WEBHOOK_LATENCY.labels(room_source).observe(time.perf_counter() - started)
+
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Prometheus text exposition (webhook latency, room pool, CreateRoom latency)."""
+    return PlainTextResponse(metrics.REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
 
 # --- To run this server ---
 # 1. Make sure you have fastapi and uvicorn installed:
@@ -0,0 +1,217 @@
+# kb_index.py
+
+import asyncio
+import json
+import logging
+import os
+import pickle
+import shutil
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Optional, Dict, Any
+
+logger = logging.getLogger(__name__)
+
+# Arborescence publiée par build_knowledge_base.py :
+#   knowledge_index/
+#     CURRENT                  -> nom de la version active (remplacé atomiquement)
+#     versions/<version>/      -> répertoire immuable (vector_store.pkl + manifest.json)
+DEFAULT_INDEX_ROOT = os.path.join(os.path.dirname(__file__), 'knowledge_index')
+LEGACY_VECTOR_STORE_PATH = os.path.join(os.path.dirname(__file__), 'vector_store.pkl')
+CURRENT_POINTER_FILE = 'CURRENT'
+VERSIONS_DIR = 'versions'
+VECTOR_STORE_FILE = 'vector_store.pkl'
+MANIFEST_FILE = 'manifest.json'
+
+
+# --- Publication (côté construction de la base) ---
+
+def publish_index(vector_store, manifest: Dict[str, Any], root: str = DEFAULT_INDEX_ROOT) -> str:
+    """
+    Publie un index vectoriel sous forme de répertoire versionné immuable,
+    puis fait pointer CURRENT vers cette version.
+    Le répertoire est d'abord écrit sous un nom temporaire puis renommé, et le pointeur
+    est remplacé via os.replace : un worker ne voit jamais de version à moitié écrite.
+    Retourne le nom de la version publiée.
+    """
+    versions_path = os.path.join(root, VERSIONS_DIR)
+    os.makedirs(versions_path, exist_ok=True)
+
+    version = datetime.now().strftime("%Y%m%d-%H%M%S")
+    suffix = 1
+    while os.path.exists(os.path.join(versions_path, version)):
+        suffix += 1
+        version = f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{suffix}"
+
+    tmp_path = os.path.join(versions_path, f".tmp-{version}")
+    os.makedirs(tmp_path)
+    try:
+        with open(os.path.join(tmp_path, VECTOR_STORE_FILE), "wb") as f:
+            pickle.dump(vector_store, f)
+        manifest = dict(manifest, version=version, publie_le=datetime.now().isoformat())
+        with open(os.path.join(tmp_path, MANIFEST_FILE), "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        os.rename(tmp_path, os.path.join(versions_path, version))
+    except Exception:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+
+    pointer_tmp = os.path.join(root, f"{CURRENT_POINTER_FILE}.tmp")
+    with open(pointer_tmp, "w", encoding="utf-8") as f:
+        f.write(version)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(pointer_tmp, os.path.join(root, CURRENT_POINTER_FILE))
+    logger.info(f"Version '{version}' de la base de connaissances publiée dans {root}.")
+    return version
+
+
+def read_current_version(root: str = DEFAULT_INDEX_ROOT) -> Optional[str]:
+    """Lit le nom de la version active, ou None si aucun index n'a été publié."""
+    try:
+        with open(os.path.join(root, CURRENT_POINTER_FILE), "r", encoding="utf-8") as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+# --- Chargement et permutation à chaud (côté workers de l'agent) ---
+
+class _IndexVersion:
+    """Une version chargée en mémoire, avec le nombre de requêtes qui l'utilisent."""
+    def __init__(self, name: str, store):
+        self.name = name
+        self.store = store
+        self.leases = 0
+        self.retired = False
+
+
+class KnowledgeIndexManager:
+    """
+    Maintient l'index vectoriel de la base de connaissances dans un worker et le remplace
+    à chaud lorsqu'une nouvelle version est publiée.
+    - La nouvelle version est chargée en arrière-plan (thread), sans bloquer la boucle asyncio.
+    - La permutation est une simple affectation sous verrou : une requête en cours conserve
+      la version qu'elle a obtenue via acquire(), la suivante voit la nouvelle.
+    - Au plus deux versions sont en mémoire : l'active et l'ancienne en cours de vidage.
+      L'ancienne est libérée dès que plus aucune requête ne la détient.
+    """
+    def __init__(self, root: str = DEFAULT_INDEX_ROOT, poll_interval: float = 30.0):
+        self.root = root
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._current: Optional[_IndexVersion] = None
+        self._draining: Optional[_IndexVersion] = None
+        self._load_lock = threading.Lock()
+        self._watch_task: Optional[asyncio.Task] = None
+
+    @property
+    def current_version(self) -> Optional[str]:
+        with self._lock:
+            return self._current.name if self._current else None
+
+    @contextmanager
+    def acquire(self):
+        """
+        Fournit l'index actif pour la durée d'une requête (None si aucun index n'est chargé).
+        La version fournie ne sera pas libérée tant que le bloc n'est pas terminé.
+        """
+        with self._lock:
+            version = self._current
+            if version:
+                version.leases += 1
+        try:
+            yield version.store if version else None
+        finally:
+            if version:
+                with self._lock:
+                    version.leases -= 1
+                    self._release_if_unused(version)
+
+    def _release_if_unused(self, version: _IndexVersion):
+        """Libère une version retirée dès que sa dernière requête est terminée (verrou tenu)."""
+        if version.retired and version.leases == 0 and version is self._draining:
+            logger.info(f"Version '{version.name}' de la base de connaissances libérée.")
+            version.store = None
+            self._draining = None
+
+    def _load_store(self, version: str):
+        if version == "legacy":
+            path = LEGACY_VECTOR_STORE_PATH
+        else:
+            path = os.path.join(self.root, VERSIONS_DIR, version, VECTOR_STORE_FILE)
+        with open(path, "rb") as f:
+            return pickle.load(f)
+
+    def _swap(self, version: _IndexVersion):
+        with self._lock:
+            previous = self._current
+            self._current = version
+            if previous:
+                previous.retired = True
+                self._draining = previous
+                self._release_if_unused(previous)
+        logger.info(f"Base de connaissances active : version '{version.name}'"
+                    + (f" (remplace '{previous.name}')." if previous else "."))
+
+    def load_current_blocking(self) -> bool:
+        """
+        Charge la version pointée par CURRENT si elle diffère de la version active.
+        Appel bloquant, à utiliser au démarrage (prewarm) ou depuis un thread.
+        Retourne True si une nouvelle version a été activée.
+        """
+        target = read_current_version(self.root)
+        if target is None and os.path.exists(LEGACY_VECTOR_STORE_PATH):
+            target = "legacy"
+        if target is None:
+            return False
+
+        with self._load_lock:
+            with self._lock:
+                if self._current and self._current.name == target:
+                    return False
+                if self._draining is not None:
+                    # Déjà deux versions en mémoire : on attend la libération de l'ancienne.
+                    logger.info(f"Version '{target}' en attente : '{self._draining.name}' est encore utilisée.")
+                    return False
+            try:
+                store = self._load_store(target)
+            except Exception as e:
+                logger.error(f"Impossible de charger la version '{target}' de la base de connaissances : {e}", exc_info=True)
+                return False
+            self._swap(_IndexVersion(target, store))
+            return True
+
+    async def refresh(self) -> bool:
+        """Vérifie le pointeur CURRENT et charge la nouvelle version en arrière-plan si besoin."""
+        if read_current_version(self.root) == self.current_version:
+            return False
+        return await asyncio.to_thread(self.load_current_blocking)
+
+    async def _watch(self):
+        while True:
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.error(f"Erreur lors de la surveillance de la base de connaissances : {e}", exc_info=True)
+            await asyncio.sleep(self.poll_interval)
+
+    def start_watching(self):
+        """Démarre (une seule fois par boucle) la surveillance périodique du pointeur CURRENT."""
+        if self._watch_task is None or self._watch_task.done():
+            self._watch_task = asyncio.get_running_loop().create_task(self._watch())
+
+
+_knowledge_index: Optional[KnowledgeIndexManager] = None
+
+
+def get_knowledge_index() -> KnowledgeIndexManager:
+    """Retourne le gestionnaire d'index partagé par le processus."""
+    global _knowledge_index
+    if _knowledge_index is None:
+        _knowledge_index = KnowledgeIndexManager(
+            root=os.getenv("KB_INDEX_ROOT", DEFAULT_INDEX_ROOT),
+            poll_interval=float(os.getenv("KB_INDEX_POLL_SECONDS", "30")),
+        )
+    return _knowledge_index
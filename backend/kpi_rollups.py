@@ -0,0 +1,195 @@
+# kpi_rollups.py
+#
+# Maintenance des tables d'agrégats des KPIs (kpi_rollup_jour, kpi_rollup_heure, kpi_rollup_outils_jour).
+# Les fonctions record_* sont appelées avec le curseur de la transaction qui écrit l'événement source,
+# afin que l'agrégat et la ligne source soient validés ensemble.
+# Ce module n'importe pas db_driver : il est aussi utilisé par error_logger.
+#
+# Reconstruction complète (ou depuis une date) :
+#   python kpi_rollups.py rebuild [--depuis AAAA-MM-JJ]
+
+import logging
+from datetime import date
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# (table, colonne de période, expression de regroupement appliquée à un timestamp)
+ROLLUP_GRANULARITIES = (
+    ("kpi_rollup_jour", "jour", "DATE({ts})"),
+    ("kpi_rollup_heure", "heure", "TIMESTAMP(DATE({ts}), MAKETIME(HOUR({ts}), 0, 0))"),
+)
+
+
+def _upsert(cursor, table: str, period_col: str, columns: Dict[str, str], from_sql: str, params: tuple = ()):
+    """
+    INSERT ... SELECT ... ON DUPLICATE KEY UPDATE qui ajoute les valeurs sélectionnées aux compteurs existants.
+    `columns` associe chaque colonne d'agrégat à son expression SQL (la clé 'periode' donne la période).
+    """
+    names = [period_col] + [c for c in columns if c != 'periode']
+    exprs = [columns['periode']] + [columns[c] for c in names[1:]]
+    updates = ", ".join(f"{c} = {c} + VALUES({c})" for c in names[1:])
+    cursor.execute(
+        f"INSERT INTO {table} ({', '.join(names)}) SELECT {', '.join(exprs)} {from_sql} "
+        f"ON DUPLICATE KEY UPDATE {updates}",
+        params
+    )
+
+
+def _safe(fn):
+    """Un échec de mise à jour des agrégats ne doit jamais faire échouer l'écriture principale."""
+    def wrapper(*args, **kwargs):
+        try:
+            fn(*args, **kwargs)
+        except Exception as e:
+            logger.warning(f"Mise à jour des agrégats KPI ignorée ({fn.__name__}) : {e}")
+    wrapper.__name__ = fn.__name__
+    wrapper.__doc__ = fn.__doc__
+    return wrapper
+
+
+@_safe
+def record_call_started(cursor, id_appel: int):
+    """Compte un nouvel appel dans la période de son timestamp_debut."""
+    for table, period_col, bucket in ROLLUP_GRANULARITIES:
+        _upsert(cursor, table, period_col,
+                {'periode': bucket.format(ts='timestamp_debut'), 'nb_appels': '1'},
+                "FROM journal_appels WHERE id_appel = %s", (id_appel,))
+
+
+@_safe
+def record_call_ended(cursor, id_appel: int):
+    """Ajoute la durée, l'identification et les outils utilisés d'un appel qui vient de se terminer."""
+    for table, period_col, bucket in ROLLUP_GRANULARITIES:
+        _upsert(cursor, table, period_col, {
+            'periode': bucket.format(ts='timestamp_debut'),
+            'nb_appels_termines': '1',
+            'duree_totale_secondes': "COALESCE(duree_appel_secondes, TIMESTAMPDIFF(SECOND, timestamp_debut, timestamp_fin), 0)",
+            'nb_appels_identifies': "(id_adherent_contexte IS NOT NULL)",
+        }, "FROM journal_appels WHERE id_appel = %s", (id_appel,))
+        _upsert(cursor, table, period_col, {
+            'periode': bucket.format(ts='timestamp_action'),
+            'nb_appels_outils': 'COUNT(*)',
+        }, "FROM actions_agent WHERE id_appel_fk = %s AND type_action = 'TOOL_CALL' "
+           f"GROUP BY {bucket.format(ts='timestamp_action')}", (id_appel,))
+    _upsert(cursor, "kpi_rollup_outils_jour", "jour", {
+        'periode': 'DATE(timestamp_action)',
+        'nom_outil': 'nom_outil',
+        'nb_appels_outil': 'COUNT(*)',
+    }, "FROM actions_agent WHERE id_appel_fk = %s AND type_action = 'TOOL_CALL' AND nom_outil IS NOT NULL "
+       "GROUP BY DATE(timestamp_action), nom_outil", (id_appel,))
+
+
+@_safe
+def record_errors(cursor, count: int = 1):
+    """Ajoute `count` erreurs système à la période courante."""
+    for table, period_col, bucket in ROLLUP_GRANULARITIES:
+        _upsert(cursor, table, period_col,
+                {'periode': bucket.format(ts='NOW()'), 'nb_erreurs': '%s'},
+                "FROM DUAL", (count,))
+
+
+@_safe
+def record_feedback(cursor, note: Optional[int]):
+    """Ajoute un feedback (et sa note) à la période courante."""
+    if note is None:
+        return
+    for table, period_col, bucket in ROLLUP_GRANULARITIES:
+        _upsert(cursor, table, period_col,
+                {'periode': bucket.format(ts='NOW()'), 'nb_feedbacks': '1', 'somme_notes_satisfaction': '%s'},
+                "FROM DUAL", (note,))
+
+
+def rebuild_rollups(conn, since: Optional[date] = None):
+    """
+    Reconstruit les agrégats à partir des tables sources (tout l'historique, ou à partir de `since`).
+    À lancer après la migration 002, ou pour corriger des agrégats après une intervention manuelle.
+    """
+    cursor = conn.cursor()
+    since_filter = "AND {ts} >= %s" if since else ""
+    params = (since,) if since else ()
+
+    for table, period_col, bucket in ROLLUP_GRANULARITIES:
+        cursor.execute(f"DELETE FROM {table}" + (f" WHERE {period_col} >= %s" if since else ""), params)
+
+        ts = 'timestamp_debut'
+        _upsert(cursor, table, period_col, {
+            'periode': bucket.format(ts=ts),
+            'nb_appels': 'COUNT(*)',
+            'nb_appels_termines': 'COUNT(timestamp_fin)',
+            'duree_totale_secondes': "COALESCE(SUM(CASE WHEN timestamp_fin IS NOT NULL THEN "
+                                     "COALESCE(duree_appel_secondes, TIMESTAMPDIFF(SECOND, timestamp_debut, timestamp_fin)) END), 0)",
+            # Comme record_call_ended : seuls les appels terminés sont comptés (taux rapporté à nb_appels_termines).
+            'nb_appels_identifies': 'COUNT(CASE WHEN timestamp_fin IS NOT NULL THEN id_adherent_contexte END)',
+        }, f"FROM journal_appels WHERE 1=1 {since_filter.format(ts=ts)} GROUP BY {bucket.format(ts=ts)}", params)
+
+        ts = 'timestamp_erreur'
+        _upsert(cursor, table, period_col, {
+            'periode': bucket.format(ts=ts),
+            'nb_erreurs': 'SUM(nb_occurrences)',
+        }, f"FROM erreurs_systeme WHERE 1=1 {since_filter.format(ts=ts)} GROUP BY {bucket.format(ts=ts)}", params)
+
+        ts = 'timestamp_feedback'
+        _upsert(cursor, table, period_col, {
+            'periode': bucket.format(ts=ts),
+            'nb_feedbacks': 'COUNT(*)',
+            'somme_notes_satisfaction': 'SUM(note_satisfaction)',
+        }, f"FROM feedback_appel WHERE note_satisfaction IS NOT NULL {since_filter.format(ts=ts)} "
+           f"GROUP BY {bucket.format(ts=ts)}", params)
+
+        ts = 'timestamp_action'
+        _upsert(cursor, table, period_col, {
+            'periode': bucket.format(ts=ts),
+            'nb_appels_outils': 'COUNT(*)',
+        }, f"FROM actions_agent WHERE type_action = 'TOOL_CALL' {since_filter.format(ts=ts)} "
+           f"GROUP BY {bucket.format(ts=ts)}", params)
+
+    cursor.execute("DELETE FROM kpi_rollup_outils_jour" + (" WHERE jour >= %s" if since else ""), params)
+    _upsert(cursor, "kpi_rollup_outils_jour", "jour", {
+        'periode': 'DATE(timestamp_action)',
+        'nom_outil': 'nom_outil',
+        'nb_appels_outil': 'COUNT(*)',
+    }, f"FROM actions_agent WHERE type_action = 'TOOL_CALL' AND nom_outil IS NOT NULL "
+       f"{since_filter.format(ts='timestamp_action')} GROUP BY DATE(timestamp_action), nom_outil", params)
+
+    conn.commit()
+    logger.info("Agrégats KPI reconstruits" + (f" depuis le {since}." if since else " sur tout l'historique."))
+
+
+# --- Lecture (API du tableau de bord) ---
+
+def fetch_kpi_totals(cursor) -> Dict[str, float]:
+    """Totaux globaux lus dans kpi_rollup_jour (une ligne par jour, indépendamment du volume d'appels)."""
+    cursor.execute("""
+        SELECT COALESCE(SUM(nb_appels), 0) AS nb_appels,
+               COALESCE(SUM(nb_appels_termines), 0) AS nb_appels_termines,
+               COALESCE(SUM(duree_totale_secondes), 0) AS duree_totale_secondes,
+               COALESCE(SUM(nb_appels_identifies), 0) AS nb_appels_identifies,
+               COALESCE(SUM(nb_erreurs), 0) AS nb_erreurs,
+               COALESCE(SUM(nb_feedbacks), 0) AS nb_feedbacks,
+               COALESCE(SUM(somme_notes_satisfaction), 0) AS somme_notes_satisfaction,
+               COALESCE(SUM(nb_appels_outils), 0) AS nb_appels_outils
+        FROM kpi_rollup_jour
+    """)
+    row = cursor.fetchone()
+    if isinstance(row, dict):
+        return {k: float(v) for k, v in row.items()}
+    names = [d[0] for d in cursor.description]
+    return {k: float(v) for k, v in zip(names, row)}
+
+
+if __name__ == '__main__':
+    import argparse
+    from dotenv import load_dotenv
+    from db_driver import ExtranetDatabaseDriver
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Maintenance des agrégats KPI.")
+    parser.add_argument("commande", choices=["rebuild"])
+    parser.add_argument("--depuis", type=date.fromisoformat, default=None, help="Reconstruire à partir de cette date (AAAA-MM-JJ).")
+    args = parser.parse_args()
+
+    db = ExtranetDatabaseDriver()
+    with db._get_connection() as conn:
+        rebuild_rollups(conn, since=args.depuis)
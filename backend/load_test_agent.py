@@ -0,0 +1,802 @@
+# load_test_agent.py
+#
+# Test de charge de l'agent vocal : combien d'appels simultanés un worker agent.py peut-il tenir ?
+# Le harnais exécute le vrai `entrypoint`, une vraie AgentSession de livekit-agents et les vrais outils
+# d'ArtexAgent (tools.py). Seuls sont remplacés :
+# - la salle LiveKit et le job, par des doublures (FakeJobContext) : la session n'a pas de salle, l'audio
+#   de l'appelant (50 trames/s, voix ou silence) et son haut-parleur (lecture en temps réel) sont branchés
+#   directement sur session.input.audio / session.output.audio ;
+# - les plugins STT/LLM/TTS, par des classes qui implémentent les interfaces stt.STT, llm.LLM et tts.TTS
+#   de livekit-agents avec une latence simulée (aucun appel réseau). Le LLM est scripté : l'appelant
+#   enchaîne des tours prédéfinis (identification par nom, confirmation, contrats, fiche, note de
+#   satisfaction), chacun donnant un appel d'outil puis une réponse ;
+# - la base MySQL, au choix, par une doublure en mémoire à latence simulée et nombre de connexions
+#   limité (--db doublure) ou par une base MySQL locale de test (--db mysql, variables DB_*).
+# Sans VAD silero ni détecteur de fin de tour (modèles locaux), la fin de tour est décidée par le STT
+# (turn_detection "stt", comme l'endpointing de Deepgram) : le délai d'endpointing de la session est inclus.
+#
+# Les appels sont répartis comme par le worker selon AGENT_JOB_EXECUTOR (--executor) :
+# - thread : un thread et une boucle asyncio par appel dans un même processus (GIL et mémoire partagés) ;
+# - process : un processus par appel (forké après le chargement des modules, comme le forkserver de
+#   livekit-agents) ; CPU et mémoire (PSS) sont la somme des processus d'appels (Linux).
+# Par défaut, les deux modes sont mesurés l'un après l'autre.
+# La charge monte par paliers jusqu'à --max-calls appels simultanés. Pour chaque palier :
+# latence par tour (fin de la parole de l'appelant -> premier son de la réponse) p50/p95/p99,
+# CPU consommé, mémoire par appel et connexions BD au pic.
+# Exemples :
+#   python load_test_agent.py --max-calls 40 --step 10 --hold 60
+#   python load_test_agent.py --executor thread --db-latency-ms 15 --db-max-connections 20 --llm-ms 800
+#   python load_test_agent.py --db mysql --max-calls 20   # base de test : les appels y sont journalisés
+
+import argparse
+import asyncio
+import itertools
+import json
+import multiprocessing
+import os
+import queue
+import random
+import resource
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from datetime import date, timedelta
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional, Tuple
+
+from livekit import rtc
+from livekit.agents import DEFAULT_API_CONNECT_OPTIONS, NOT_GIVEN, AgentSession, llm, stt, tts
+from livekit.agents.voice import io as agent_io
+
+_work_dir = tempfile.mkdtemp(prefix="artex_charge_agent_")
+# Journaux et file post-appel du harnais hors des fichiers du worker réel.
+os.environ.setdefault("POST_CALL_QUEUE_FILE", os.path.join(_work_dir, "post_appel.db"))
+
+# Processus d'appels forkés après le chargement des modules (forkserver préchargé de livekit-agents).
+_mp = multiprocessing.get_context("fork")
+
+SAMPLE_RATE = 16000
+FRAME_SECONDS = 0.02 # Trames audio de 20 ms, comme le flux SIP
+REPLY_TIMEOUT_SECONDS = 30.0
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def rss_bytes() -> int:
+    """Mémoire résidente actuelle du processus (pic depuis le démarrage hors Linux)."""
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def process_pss_bytes(pid: int) -> int:
+    """Mémoire proportionnelle (PSS) d'un processus : les pages partagées après le fork sont réparties."""
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as rollup:
+            for line in rollup:
+                if line.startswith("Pss:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+
+def process_cpu_seconds(pid: int) -> float:
+    """Temps CPU (utilisateur + système) consommé par un processus depuis son démarrage."""
+    try:
+        with open(f"/proc/{pid}/stat") as stat:
+            fields = stat.read().rsplit(")", 1)[1].split()
+    except OSError:
+        return 0.0
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def _jitter(mean_seconds: float) -> float:
+    return max(0.0, random.gauss(mean_seconds, mean_seconds * 0.25))
+
+
+# --- Connexions BD ---
+
+class ConnectionTracker:
+    """
+    Connexions BD empruntées par les appels (en cours et pic depuis la dernière remise à zéro).
+    Compteurs en mémoire partagée : les appels peuvent tourner dans des processus forkés.
+    """
+
+    def __init__(self):
+        self._lock = _mp.Lock()
+        self._in_use = _mp.RawValue("i", 0)
+        self._peak = _mp.RawValue("i", 0)
+        self._borrowed = _mp.RawValue("i", 0)
+
+    @property
+    def peak(self) -> int:
+        return self._peak.value
+
+    @property
+    def borrowed(self) -> int:
+        return self._borrowed.value
+
+    def acquired(self):
+        with self._lock:
+            self._in_use.value += 1
+            self._borrowed.value += 1
+            self._peak.value = max(self._peak.value, self._in_use.value)
+
+    def released(self):
+        with self._lock:
+            self._in_use.value -= 1
+
+    def reset_peak(self):
+        with self._lock:
+            self._peak.value = self._in_use.value
+            self._borrowed.value = 0
+
+
+class DatabaseStandIn:
+    """
+    Doublure en mémoire d'ExtranetDatabaseDriver pour les méthodes utilisées par l'entrypoint et le script.
+    Chaque méthode occupe une « connexion » (au plus max_connections, comme max_connections de MySQL,
+    limite partagée par les processus d'appels) pendant la latence simulée ; l'attente est synchrone,
+    comme celle de mysql-connector.
+    """
+
+    def __init__(self, tracker: ConnectionTracker, query_latency: float, max_connections: int, adherents: int):
+        import metrics
+        from db_driver import Adherent, Contrat
+
+        self._metrics = metrics
+        self.tracker = tracker
+        self.query_latency = query_latency
+        self._slots = _mp.BoundedSemaphore(max_connections)
+        self._ids = itertools.count(1)
+        self.adherents = {}
+        self.contracts = {}
+        for i in range(1, adherents + 1):
+            self.adherents[i] = Adherent(
+                id_adherent=i, nom=f"Charge{i}", prenom="Test", date_adhesion_mutuelle=date(2020, 1, 1),
+                date_naissance=date(1950, 1, 1) + timedelta(days=97 * i), code_postal=f"{75000 + i % 20:05d}",
+                telephone=f"+3360000{i:04d}",
+            )
+            self.contracts[i] = [
+                Contrat(id_contrat=10 * i + n, id_adherent_principal=i, numero_contrat=f"CT-{i:05d}-{n}",
+                        date_debut_contrat=date(2021, 1, 1), id_formule=n + 1)
+                for n in range(2)
+            ]
+
+    @contextmanager
+    def _connection(self):
+        if not self._slots.acquire(timeout=10):
+            self._metrics.DB_POOL_TIMEOUTS.inc()
+            raise RuntimeError("Doublure BD : aucune connexion libre après 10 s.")
+        self.tracker.acquired()
+        self._metrics.DB_CONNECTIONS_IN_USE.inc()
+        try:
+            time.sleep(_jitter(self.query_latency))
+            yield
+        finally:
+            self._metrics.DB_CONNECTIONS_IN_USE.dec()
+            self.tracker.released()
+            self._slots.release()
+
+    def sample_caller(self) -> Dict[str, Any]:
+        adherent = self.adherents[random.randint(1, len(self.adherents))]
+        return {"nom": adherent.nom, "prenom": adherent.prenom, "date_naissance": adherent.date_naissance.isoformat(),
+                "code_postal": adherent.code_postal, "telephone": adherent.telephone}
+
+    # Méthodes d'ExtranetDatabaseDriver appelées pendant un appel scripté.
+
+    def enregistrer_debut_appel(self, id_livekit_room: str, numero_appelant: Optional[str]) -> Optional[int]:
+        with self._connection():
+            return next(self._ids)
+
+    def enregistrer_fin_appel(self, id_appel: int, resume_appel: Optional[str] = None, transcription: Optional[str] = None,
+                              statut: str = 'Terminé', chemin_enregistrement_audio: Optional[str] = None) -> bool:
+        with self._connection():
+            return True
+
+    def enregistrer_action_agent(self, id_appel_fk: int, type_action: str, **kwargs) -> Optional[int]:
+        with self._connection():
+            return next(self._ids)
+
+    def enregistrer_contexte_adherent_appel(self, id_appel: int, id_adherent: int) -> bool:
+        with self._connection():
+            return True
+
+    def enregistrer_feedback(self, id_appel_fk: int, note: Optional[int], commentaire: Optional[str]) -> bool:
+        with self._connection():
+            return True
+
+    def get_adherents_by_fullname(self, nom: str, prenom: str, id_appel_fk_param: Optional[int] = None):
+        # Comme le driver : une connexion pour la journalisation dans interactions_bd, une pour la requête.
+        with self._connection():
+            pass
+        with self._connection():
+            return [a for a in self.adherents.values() if a.nom == nom and a.prenom == prenom]
+
+    def get_adherents_by_telephone(self, telephone: str, id_appel_fk_param: Optional[int] = None):
+        with self._connection():
+            pass
+        with self._connection():
+            return [a for a in self.adherents.values() if a.telephone == telephone]
+
+    def get_adherent_by_id(self, adherent_id: int, id_appel_fk_param: Optional[int] = None):
+        with self._connection():
+            pass
+        with self._connection():
+            return self.adherents.get(adherent_id)
+
+    def get_contrats_by_adherent_id(self, adherent_id: int, id_appel_fk_param: Optional[int] = None):
+        with self._connection():
+            pass
+        with self._connection():
+            return list(self.contracts.get(adherent_id, []))
+
+
+def _measured_driver_class(tracker: ConnectionTracker):
+    """ExtranetDatabaseDriver réel (--db mysql) dont les emprunts de connexion sont comptés."""
+    from db_driver import ExtranetDatabaseDriver
+
+    class MeasuredDriver(ExtranetDatabaseDriver):
+        def acquire_connection(self):
+            conn = super().acquire_connection()
+            tracker.acquired()
+            return conn
+
+        def release_connection(self, conn):
+            try:
+                super().release_connection(conn)
+            finally:
+                tracker.released()
+
+    return MeasuredDriver
+
+
+def _sample_mysql_callers(limit: int = 500) -> List[Dict[str, Any]]:
+    """Adhérents de la base de test dont la date de naissance et le code postal permettent la confirmation."""
+    from db_driver import ExtranetDatabaseDriver
+
+    with ExtranetDatabaseDriver()._get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT nom, prenom, date_naissance, code_postal, telephone FROM adherents
+            WHERE date_naissance IS NOT NULL AND code_postal IS NOT NULL
+            LIMIT %s
+        """, (limit,))
+        rows = cursor.fetchall()
+    if not rows:
+        raise SystemExit("❌ Aucun adhérent exploitable (date de naissance et code postal) dans la base de test.")
+    return [{"nom": nom, "prenom": prenom, "date_naissance": naissance.isoformat(), "code_postal": code_postal,
+             "telephone": telephone} for nom, prenom, naissance, code_postal, telephone in rows]
+
+
+# --- Doublures LiveKit (plugins, audio, salle, job) ---
+
+@dataclass
+class Latencies:
+    stt: float # Transcription finale après la fin de la parole
+    llm: float # Premier token d'une génération (décision d'outil ou réponse)
+    tts: float # Premier son de la synthèse
+    tts_chars_per_second: float = 15.0 # Débit de parole de la synthèse (durée de lecture des réponses)
+
+
+class FakeSTT(stt.STT):
+    """
+    STT en flux : consomme l'audio de l'appelant comme un STT distant, sans l'analyser.
+    Le script annonce le début (start_utterance) et la fin (end_utterance) de chaque phrase ;
+    la transcription finale et la fin de parole arrivent après la latence simulée.
+    """
+
+    def __init__(self, latency: float):
+        super().__init__(capabilities=stt.STTCapabilities(streaming=True, interim_results=False))
+        self.latency = latency
+        self._streams: List["FakeSpeechStream"] = []
+
+    async def _recognize_impl(self, buffer, *, language=NOT_GIVEN, conn_options=DEFAULT_API_CONNECT_OPTIONS):
+        raise NotImplementedError("Doublure STT : reconnaissance en flux uniquement.")
+
+    def stream(self, *, language=NOT_GIVEN, conn_options=DEFAULT_API_CONNECT_OPTIONS) -> "FakeSpeechStream":
+        speech_stream = FakeSpeechStream(stt=self, conn_options=conn_options)
+        self._streams.append(speech_stream)
+        return speech_stream
+
+    def start_utterance(self):
+        for speech_stream in self._streams:
+            speech_stream.utterances.put_nowait(None)
+
+    def end_utterance(self, text: str):
+        for speech_stream in self._streams:
+            speech_stream.utterances.put_nowait(text)
+
+
+class FakeSpeechStream(stt.RecognizeStream):
+    def __init__(self, *, stt: FakeSTT, conn_options):
+        super().__init__(stt=stt, conn_options=conn_options)
+        self.utterances: asyncio.Queue = asyncio.Queue() # None : début de phrase ; texte : fin de phrase
+
+    async def _recognize(self):
+        while True:
+            text = await self.utterances.get()
+            if text is None:
+                self._event_ch.send_nowait(stt.SpeechEvent(type=stt.SpeechEventType.START_OF_SPEECH))
+                continue
+            await asyncio.sleep(_jitter(self._stt.latency))
+            self._event_ch.send_nowait(stt.SpeechEvent(
+                type=stt.SpeechEventType.FINAL_TRANSCRIPT,
+                alternatives=[stt.SpeechData(language="fr", text=text, confidence=1.0)],
+            ))
+            self._event_ch.send_nowait(stt.SpeechEvent(type=stt.SpeechEventType.END_OF_SPEECH))
+
+    async def _run(self):
+        recognition = asyncio.create_task(self._recognize())
+        try:
+            async for _ in self._input_ch:
+                pass
+        finally:
+            recognition.cancel()
+
+
+class FakeLLM(llm.LLM):
+    """
+    LLM scripté : au message de l'appelant, l'appel d'outil prévu par le script (tool_calls, indexé par
+    la phrase) ; au résultat de l'outil, une réponse qui le reprend.
+    """
+
+    def __init__(self, latency: float):
+        super().__init__()
+        self.latency = latency
+        self.tool_calls: Dict[str, Tuple[str, Dict[str, Any]]] = {}
+
+    def chat(self, *, chat_ctx, tools=None, conn_options=DEFAULT_API_CONNECT_OPTIONS, parallel_tool_calls=NOT_GIVEN,
+             tool_choice=NOT_GIVEN, extra_kwargs=NOT_GIVEN) -> "FakeLLMStream":
+        return FakeLLMStream(self, chat_ctx=chat_ctx, tools=tools or [], conn_options=conn_options)
+
+
+class FakeLLMStream(llm.LLMStream):
+    async def _run(self):
+        await asyncio.sleep(_jitter(self._llm.latency))
+        request_id = uuid.uuid4().hex
+        last = self._chat_ctx.items[-1] if self._chat_ctx.items else None
+        planned = self._llm.tool_calls.get(last.text_content) if last is not None and last.type == "message" else None
+        if planned:
+            name, arguments = planned
+            delta = llm.ChoiceDelta(role="assistant", tool_calls=[
+                llm.FunctionToolCall(name=name, arguments=json.dumps(arguments), call_id=request_id)
+            ])
+        elif last is not None and last.type == "function_call_output":
+            delta = llm.ChoiceDelta(role="assistant", content=last.output)
+        else:
+            delta = llm.ChoiceDelta(role="assistant", content="Pouvez-vous préciser votre demande ?")
+        self._event_ch.send_nowait(llm.ChatChunk(id=request_id, delta=delta))
+
+
+class FakeTTS(tts.TTS):
+    """TTS par requête : premier son après la latence simulée, puis un audio de durée proportionnelle au texte."""
+
+    def __init__(self, latency: float, chars_per_second: float):
+        super().__init__(capabilities=tts.TTSCapabilities(streaming=False), sample_rate=SAMPLE_RATE, num_channels=1)
+        self.latency = latency
+        self.chars_per_second = chars_per_second
+
+    def synthesize(self, text: str, *, conn_options=DEFAULT_API_CONNECT_OPTIONS) -> "FakeChunkedStream":
+        return FakeChunkedStream(tts=self, input_text=text, conn_options=conn_options)
+
+
+class FakeChunkedStream(tts.ChunkedStream):
+    CHUNK_SECONDS = 0.2
+
+    async def _run(self, output_emitter):
+        output_emitter.initialize(request_id=uuid.uuid4().hex, sample_rate=SAMPLE_RATE, num_channels=1,
+                                  mime_type="audio/pcm")
+        await asyncio.sleep(_jitter(self._tts.latency))
+        chunk = bytes(int(SAMPLE_RATE * self.CHUNK_SECONDS) * 2)
+        chunks = max(1, round(len(self.input_text) / self._tts.chars_per_second / self.CHUNK_SECONDS))
+        for _ in range(chunks):
+            # Synthèse plus rapide que le temps réel, reçue par morceaux.
+            output_emitter.push(chunk)
+            await asyncio.sleep(0)
+        output_emitter.flush()
+
+
+def install_fake_plugins(latencies: Latencies):
+    """Remplace les plugins instanciés par ArtexAgent (api.py) : une instance de chaque doublure par appel."""
+    import api
+
+    api.google = SimpleNamespace(
+        LLM=lambda **kwargs: FakeLLM(latencies.llm),
+        TTS=lambda **kwargs: FakeTTS(latencies.tts, latencies.tts_chars_per_second),
+    )
+    api.deepgram = SimpleNamespace(STT=lambda **kwargs: FakeSTT(latencies.stt))
+    api.silero = SimpleNamespace(VAD=SimpleNamespace(load=lambda **kwargs: None))
+    api.ChatGoogleGenerativeAI = lambda **kwargs: None
+
+
+class CallerMicrophone(agent_io.AudioInput):
+    """Audio de l'appelant au rythme d'un flux SIP : silence, ou voix pendant que le script parle."""
+
+    def __init__(self):
+        super().__init__(label="charge")
+        self.speaking = False
+        self._samples = int(SAMPLE_RATE * FRAME_SECONDS)
+        self._silence = bytes(self._samples * 2)
+        self._voice = b"\x00\x08" * self._samples
+        self._next_frame: Optional[float] = None
+
+    async def __anext__(self) -> rtc.AudioFrame:
+        now = time.perf_counter()
+        if self._next_frame is None or now - self._next_frame > 1.0:
+            self._next_frame = now # Premier appel, ou boucle saturée : on ne rattrape pas le retard
+        else:
+            self._next_frame += FRAME_SECONDS
+            if self._next_frame > now:
+                await asyncio.sleep(self._next_frame - now)
+        data = self._voice if self.speaking else self._silence
+        return rtc.AudioFrame(data, SAMPLE_RATE, 1, self._samples)
+
+
+class CallerSpeaker(agent_io.AudioOutput):
+    """
+    Haut-parleur de l'appelant : horodate le premier son de chaque réponse (replied) et simule la
+    lecture en temps réel (idle une fois la réponse entièrement jouée).
+    """
+
+    def __init__(self):
+        super().__init__(label="charge", capabilities=agent_io.AudioOutputCapabilities(pause=True))
+        self.first_audio: Optional[float] = None
+        self.replied = asyncio.Event()
+        self.idle = asyncio.Event()
+        self.idle.set()
+        self._segment_start: Optional[float] = None
+        self._segment_duration = 0.0
+        self._playout: Optional[asyncio.TimerHandle] = None
+
+    def expect_reply(self):
+        self.first_audio = None
+        self.replied.clear()
+
+    async def capture_frame(self, frame: rtc.AudioFrame) -> None:
+        if self._playout is not None:
+            # Nouveau segment avant la fin de la lecture du précédent : ce dernier est considéré joué.
+            self._playout.cancel()
+            self._end_segment(interrupted=False)
+        await super().capture_frame(frame)
+        if self._segment_start is None:
+            self._segment_start = time.perf_counter()
+            self._segment_duration = 0.0
+            self.idle.clear()
+            if self.first_audio is None:
+                self.first_audio = self._segment_start
+                self.replied.set()
+            self.on_playback_started(created_at=time.time())
+        self._segment_duration += frame.duration
+
+    def flush(self) -> None:
+        super().flush()
+        if self._segment_start is None or self._playout is not None:
+            return
+        remaining = self._segment_start + self._segment_duration - time.perf_counter()
+        self._playout = asyncio.get_running_loop().call_later(max(0.0, remaining), self._end_segment, False)
+
+    def clear_buffer(self) -> None:
+        if self._playout is not None:
+            self._playout.cancel()
+        if self._segment_start is not None:
+            self._end_segment(interrupted=True)
+
+    def _end_segment(self, interrupted: bool):
+        played = min(self._segment_duration, time.perf_counter() - self._segment_start)
+        self._segment_start = None
+        self._playout = None
+        self.on_playback_finished(playback_position=played, interrupted=interrupted)
+        self.idle.set()
+
+
+class HarnessSession(AgentSession):
+    """AgentSession réelle sans salle : l'audio de l'appelant et son haut-parleur sont ceux du harnais."""
+
+    def __init__(self, *args, **kwargs):
+        # Pas de VAD dans le harnais : la fin de tour vient du STT.
+        kwargs.setdefault("turn_handling", {"turn_detection": "stt"})
+        super().__init__(*args, **kwargs)
+        self.microphone = CallerMicrophone()
+        self.speaker = CallerSpeaker()
+        self.input.audio = self.microphone
+        self.output.audio = self.speaker
+
+    async def start(self, agent, *, room=None, **kwargs):
+        result = await super().start(agent, **kwargs)
+        if room is not None:
+            room.session = self
+        return result
+
+
+class FakeRoom:
+    def __init__(self, name: str):
+        self.name = name
+        self.metadata = ""
+        self.session: Optional[HarnessSession] = None
+
+
+class FakeJobContext:
+    def __init__(self, job_id: str, participant_metadata: str):
+        self.job = SimpleNamespace(id=job_id)
+        self.room = FakeRoom(f"charge-{job_id}")
+        self._participant = SimpleNamespace(identity=f"sip-{job_id}", metadata=participant_metadata)
+        self._shutdown_callbacks = []
+        self.shutdown_reason: Optional[str] = None
+
+    def add_shutdown_callback(self, callback):
+        self._shutdown_callbacks.append(callback)
+
+    async def connect(self):
+        await asyncio.sleep(0)
+
+    async def wait_for_participant(self):
+        return self._participant
+
+    def shutdown(self, reason: str = ""):
+        self.shutdown_reason = reason
+
+    async def run_shutdown_callbacks(self):
+        for callback in self._shutdown_callbacks:
+            await callback()
+
+
+# --- Script de l'appelant ---
+
+def caller_script(caller: Dict[str, Any]):
+    """Tours de l'appelant : (phrase, outil appelé par le LLM, arguments)."""
+    return [
+        (f"Bonjour, je suis {caller['prenom']} {caller['nom']}.",
+         "lookup_adherent_by_fullname", {"nom": caller["nom"], "prenom": caller["prenom"]}),
+        (f"Je suis né le {caller['date_naissance']}, code postal {caller['code_postal']}.",
+         "confirm_identity", {"date_of_birth": caller["date_naissance"], "postal_code": caller["code_postal"]}),
+        ("Quels sont mes contrats ?", "list_adherent_contracts", {}),
+        ("Quelle adresse avez-vous pour moi ?", "get_adherent_details", {}),
+        ("Je mets cinq sur cinq, merci.", "enregistrer_feedback_appel", {"note": 5, "commentaire": "Test de charge"}),
+    ]
+
+
+@dataclass
+class LevelStats:
+    calls: int
+    turn_latencies: List[float] = field(default_factory=list)
+    greeting_latencies: List[float] = field(default_factory=list)
+    completed_calls: int = 0
+    errors: int = 0
+
+
+class LoadHarness:
+    """
+    Un appelant simulé enchaîne des appels dans son propre thread ou processus (--executor), avec sa
+    boucle asyncio ; les mesures remontent au processus principal par une file.
+    """
+
+    def __init__(self, args, callers: List[Dict[str, Any]], tracker: ConnectionTracker):
+        import agent
+
+        self.agent_module = agent
+        self.args = args
+        self.callers = callers
+        self.tracker = tracker
+        self._job_ids = itertools.count(1)
+
+    async def run_call(self, stop, samples, record: bool = True):
+        import caller_identification
+
+        caller = random.choice(self.callers)
+        job_id = f"AJ_charge_{os.getpid()}_{threading.get_ident()}_{next(self._job_ids)}"
+        # Appelant inconnu de l'annuaire téléphonique : identification par le nom au premier tour.
+        ctx = FakeJobContext(job_id, caller_identification.build_participant_metadata(
+            f"+3399{random.randint(0, 99999999):08d}", {"statut": "aucun"}))
+        session: Optional[HarnessSession] = None
+        call_started = time.perf_counter()
+        try:
+            await self.agent_module.entrypoint(ctx)
+            session = ctx.room.session
+            if session is None:
+                raise RuntimeError(f"Session non démarrée ({ctx.shutdown_reason or 'erreur dans entrypoint'}).")
+            if record:
+                samples.put(("accueil", session.speaker.first_audio - call_started))
+            script = caller_script(caller)
+            plugins = session.current_agent
+            plugins.llm.tool_calls = {text: (tool_name, kwargs) for text, tool_name, kwargs in script}
+            for text, _, _ in script:
+                await session.speaker.idle.wait() # L'appelant écoute la réponse jusqu'au bout
+                if stop.is_set():
+                    break
+                session.microphone.speaking = True
+                plugins.stt.start_utterance()
+                await asyncio.sleep(_jitter(self.args.caller_speech_s)) # L'appelant parle
+                session.microphone.speaking = False
+                session.speaker.expect_reply()
+                end_of_speech = time.perf_counter()
+                plugins.stt.end_utterance(text)
+                try:
+                    await asyncio.wait_for(session.speaker.replied.wait(), timeout=REPLY_TIMEOUT_SECONDS)
+                except asyncio.TimeoutError:
+                    raise RuntimeError(f"Pas de réponse de l'agent {REPLY_TIMEOUT_SECONDS:.0f} s après « {text} ».")
+                if record:
+                    samples.put(("tour", session.speaker.first_audio - end_of_speech))
+            await session.speaker.idle.wait()
+            if record:
+                samples.put(("termine", None))
+        except Exception as e:
+            samples.put(("erreur", f"{job_id} : {e}"))
+        finally:
+            await ctx.run_shutdown_callbacks()
+            if session is not None:
+                await session.aclose()
+
+    async def caller_loop(self, stop, samples, initial_delay: float):
+        await asyncio.sleep(initial_delay)
+        while not stop.is_set():
+            await self.run_call(stop, samples)
+            await asyncio.sleep(_jitter(self.args.gap_s))
+
+    def _caller_main(self, stop, samples, initial_delay: float, seed: int):
+        random.seed(seed)
+        asyncio.run(self.caller_loop(stop, samples, initial_delay))
+
+    def _start_caller(self, executor: str, stop, samples):
+        args = (stop, samples, random.uniform(0, self.args.ramp_s), random.getrandbits(32))
+        if executor == "process":
+            worker = _mp.Process(target=self._caller_main, args=args, daemon=True)
+        else:
+            worker = threading.Thread(target=self._caller_main, args=args, daemon=True)
+        worker.start()
+        return worker
+
+    def _resources(self, executor: str, workers) -> Tuple[float, int]:
+        """CPU consommé et mémoire des appels : le processus courant (thread) ou la somme des processus d'appels."""
+        if executor == "thread":
+            return time.process_time(), rss_bytes()
+        pids = [worker.pid for worker in workers]
+        return sum(process_cpu_seconds(pid) for pid in pids), sum(process_pss_bytes(pid) for pid in pids)
+
+    @staticmethod
+    def _record(stats: LevelStats, kind: str, value):
+        if kind == "tour":
+            stats.turn_latencies.append(value)
+        elif kind == "accueil":
+            stats.greeting_latencies.append(value)
+        elif kind == "termine":
+            stats.completed_calls += 1
+        else:
+            stats.errors += 1
+            print(f"   ⚠️ {value}")
+
+    def run(self, executor: str) -> List[Dict[str, Any]]:
+        stop = _mp.Event()
+        samples = _mp.Queue()
+        workers = []
+        results = []
+        # Appel d'échauffement hors mesure (imports paresseux, caches, premier accès BD), arrêté après
+        # l'accueil : les processus d'appels forkés ensuite en héritent, comme du préchargement de livekit.
+        warm_up_stop = threading.Event()
+        warm_up_stop.set()
+        asyncio.run(self.run_call(warm_up_stop, samples, record=False))
+        baseline_memory = rss_bytes() if executor == "thread" else 0
+
+        levels = list(range(self.args.step, self.args.max_calls + 1, self.args.step))
+        if not levels or levels[-1] != self.args.max_calls:
+            levels.append(self.args.max_calls)
+        for level in levels:
+            stats = LevelStats(calls=level)
+            while len(workers) < level:
+                workers.append(self._start_caller(executor, stop, samples))
+            self.tracker.reset_peak()
+            cpu_start, _ = self._resources(executor, workers)
+            peak_memory = 0
+            wall_start = time.perf_counter()
+            deadline = wall_start + self.args.hold
+            while time.perf_counter() < deadline:
+                try:
+                    kind, value = samples.get(timeout=0.5)
+                    self._record(stats, kind, value)
+                except queue.Empty:
+                    pass
+                peak_memory = max(peak_memory, self._resources(executor, workers)[1])
+            cpu, wall = self._resources(executor, workers)[0] - cpu_start, time.perf_counter() - wall_start
+            turns, greetings = sorted(stats.turn_latencies), sorted(stats.greeting_latencies)
+            results.append({
+                "executeur": executor,
+                "appels": level,
+                "tours": len(turns),
+                "p50_ms": percentile(turns, 50) * 1000,
+                "p95_ms": percentile(turns, 95) * 1000,
+                "p99_ms": percentile(turns, 99) * 1000,
+                "accueil_p95_s": percentile(greetings, 95),
+                "appels_termines": stats.completed_calls,
+                "erreurs": stats.errors,
+                "cpu_pct": 100 * cpu / wall if wall else 0.0,
+                "memoire_par_appel_mo": max(0, peak_memory - baseline_memory) / level / 1024 ** 2,
+                "memoire_mo": peak_memory / 1024 ** 2,
+                "connexions_bd_pic": self.tracker.peak,
+                "connexions_bd_par_s": self.tracker.borrowed / wall if wall else 0.0,
+            })
+            self.print_level(results[-1])
+
+        stop.set()
+        for worker in workers:
+            worker.join(timeout=REPLY_TIMEOUT_SECONDS)
+            if executor == "process" and worker.is_alive():
+                worker.terminate()
+        return results
+
+    @staticmethod
+    def print_level(r: Dict[str, Any]):
+        print(f"   {r['appels']:>4} appels | tour p50 {r['p50_ms']:.0f} ms, p95 {r['p95_ms']:.0f} ms, "
+              f"p99 {r['p99_ms']:.0f} ms ({r['tours']} tours) | accueil p95 {r['accueil_p95_s']:.1f} s | "
+              f"CPU {r['cpu_pct']:.0f} % | mémoire {r['memoire_mo']:.0f} Mo ({r['memoire_par_appel_mo']:.1f} Mo/appel) | "
+              f"BD pic {r['connexions_bd_pic']} connexions, {r['connexions_bd_par_s']:.0f} emprunts/s | "
+              f"{r['erreurs']} erreur(s)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Test de charge multi-appels de l'entrypoint de l'agent.")
+    parser.add_argument("--max-calls", type=int, default=40, help="Nombre d'appels simultanés au dernier palier.")
+    parser.add_argument("--step", type=int, default=10, help="Appels ajoutés à chaque palier.")
+    parser.add_argument("--hold", type=float, default=60.0, help="Durée de mesure de chaque palier (secondes).")
+    parser.add_argument("--ramp-s", type=float, default=5.0, help="Étalement du démarrage des nouveaux appels d'un palier.")
+    parser.add_argument("--executor", choices=("tous", "process", "thread"), default="tous",
+                        help="Répartition des appels, comme AGENT_JOB_EXECUTOR (tous : les deux, l'un après l'autre).")
+    parser.add_argument("--caller-speech-s", type=float, default=3.0, help="Durée moyenne d'une phrase de l'appelant.")
+    parser.add_argument("--gap-s", type=float, default=1.0, help="Pause entre deux appels d'un même appelant simulé.")
+    parser.add_argument("--stt-ms", type=float, default=250.0)
+    parser.add_argument("--llm-ms", type=float, default=450.0)
+    parser.add_argument("--tts-ms", type=float, default=200.0)
+    parser.add_argument("--tts-chars-per-s", type=float, default=15.0, help="Débit de parole de l'agent (durée de lecture).")
+    parser.add_argument("--db", choices=("doublure", "mysql"), default="doublure")
+    parser.add_argument("--db-latency-ms", type=float, default=5.0, help="Latence d'une requête de la doublure BD.")
+    parser.add_argument("--db-max-connections", type=int, default=151, help="Connexions simultanées de la doublure BD.")
+    parser.add_argument("--adherents", type=int, default=1000, help="Adhérents synthétiques de la doublure BD.")
+    parser.add_argument("--log-level", default="WARNING", help="Niveau des journaux de l'agent (INFO : coût réel des journaux).")
+    args = parser.parse_args()
+
+    from log_config import configure_logging
+    # Avant l'import d'agent.py : sa propre configuration devient sans effet.
+    configure_logging(log_file=os.path.join(_work_dir, "agent.log"), level=args.log_level.upper())
+    import agent
+
+    tracker = ConnectionTracker()
+    install_fake_plugins(Latencies(args.stt_ms / 1000, args.llm_ms / 1000, args.tts_ms / 1000, args.tts_chars_per_s))
+    agent.AgentSession = HarnessSession
+    if args.db == "doublure":
+        stand_in = DatabaseStandIn(tracker, args.db_latency_ms / 1000, args.db_max_connections, args.adherents)
+        agent.ExtranetDatabaseDriver = lambda *a, **kw: stand_in
+        callers = [stand_in.sample_caller() for _ in range(min(args.adherents, 500))]
+    else:
+        agent.ExtranetDatabaseDriver = _measured_driver_class(tracker)
+        callers = _sample_mysql_callers()
+
+    executors = ("process", "thread") if args.executor == "tous" else (args.executor,)
+    harness = LoadHarness(args, callers, tracker)
+    print(f"🚀 Agent : montée jusqu'à {args.max_calls} appels simultanés par paliers de {args.step} "
+          f"({args.hold:.0f}s par palier, BD : {args.db}, journaux : {_work_dir}).")
+    print("   Pipeline mesuré : AgentSession réelle (audio entrant, STT en flux, fin de tour par le STT, LLM et "
+          "outils, TTS, sortie audio) ; plugins et réseau simulés, sans VAD silero ni détecteur de fin de tour.")
+    for executor in executors:
+        print(f"   Exécuteur {executor} :")
+        results = harness.run(executor)
+        worst = max(results, key=lambda r: r["p95_ms"])
+        print(f"   Pire palier ({executor}) : {worst['appels']} appels, tour p95 {worst['p95_ms']:.0f} ms "
+              f"(latence simulée des plugins : {args.stt_ms + 2 * args.llm_ms + args.tts_ms:.0f} ms, "
+              f"hors délai d'endpointing de la session).")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+# load_test_dashboard.py
+#
+# Test de charge des endpoints du tableau de bord.
+# Exemple (serveur lancé sur le port 5001) :
+#   python load_test_dashboard.py --base-url http://localhost:5001 --concurrency 32 --duration 20
+
+import argparse
+import json
+import threading
+import time
+import urllib.request
+import urllib.error
+
+DEFAULT_ENDPOINTS = ["/api/dashboard/calls", "/api/dashboard/kpis"]
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def run_load(url: str, concurrency: int, duration: float):
+    """Envoie des requêtes GET en boucle depuis `concurrency` threads pendant `duration` secondes."""
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def worker():
+        local_latencies, local_errors = [], 0
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                with urllib.request.urlopen(url, timeout=30) as response:
+                    response.read()
+                    if response.status != 200:
+                        local_errors += 1
+            except (urllib.error.URLError, OSError):
+                local_errors += 1
+            local_latencies.append(time.perf_counter() - start)
+        with lock:
+            latencies.extend(local_latencies)
+            errors[0] += local_errors
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "requetes": len(latencies),
+        "erreurs": errors[0],
+        "requetes_par_seconde": len(latencies) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Test de charge de l'API du tableau de bord.")
+    parser.add_argument("--base-url", default="http://localhost:5001")
+    parser.add_argument("--endpoint", action="append", help="Endpoint à tester (répétable).")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=15.0)
+    args = parser.parse_args()
+
+    for endpoint in args.endpoint or DEFAULT_ENDPOINTS:
+        url = args.base_url.rstrip("/") + endpoint
+        print(f"🚀 {url} — {args.concurrency} clients concurrents pendant {args.duration:.0f}s...")
+        result = run_load(url, args.concurrency, args.duration)
+        print(f"   {result['requetes_par_seconde']:.1f} req/s | p50 {result['p50_ms']:.1f} ms | "
+              f"p99 {result['p99_ms']:.1f} ms | {result['erreurs']} erreur(s) sur {result['requetes']} requêtes")
+
+    try:
+        with urllib.request.urlopen(args.base_url.rstrip("/") + "/api/dashboard/pool", timeout=10) as response:
+            print("\n📊 Métriques du pool :")
+            print(json.dumps(json.loads(response.read())["donnees"], indent=2, ensure_ascii=False))
+    except (urllib.error.URLError, OSError, KeyError, ValueError) as e:
+        print(f"\n⚠️ Impossible de lire les métriques du pool : {e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+# load_test_sip_inbound.py
+#
+# Banc d'essai du webhook SIP entrant (inbound_sip_handler.py) contre la doublure locale des API
+# RoomService et AgentDispatchService de LiveKit (voir load_test_token_server.py), en dispatch explicite
+# de l'agent (AGENT_NAME). Les appels arrivent à un débit donné (arrivées de Poisson) ; on compare
+# la latence du webhook avec et sans pool de salles pré-créées.
+# Exemples :
+#   python load_test_sip_inbound.py --rate 20 --duration 15 --livekit-latency-ms 80
+#   python load_test_sip_inbound.py --rate 20 --duration 15 --livekit-latency-ms 80 --warm-rooms 30
+
+import argparse
+import asyncio
+import os
+import random
+import time
+
+import httpx
+
+from load_test_token_server import LiveKitStandIn, percentile
+
+
+async def run_calls(client: httpx.AsyncClient, rate: float, duration: float):
+    """Envoie des webhooks d'appels entrants à `rate` appels/s en moyenne pendant `duration` secondes."""
+    latencies, errors = [], 0
+
+    async def one_call(n: int):
+        nonlocal errors
+        payload = {"call_id": f"charge-{n}", "from": f"+3361234{n:04d}", "to": "+33100000000"}
+        start = time.perf_counter()
+        try:
+            response = await client.post("/inbound-sip-handler", json=payload)
+            if response.status_code != 200 or "room_name" not in response.json():
+                errors += 1
+        except httpx.HTTPError:
+            errors += 1
+        latencies.append(time.perf_counter() - start)
+
+    tasks, n = [], 0
+    started = time.perf_counter()
+    while time.perf_counter() - started < duration:
+        tasks.append(asyncio.create_task(one_call(n)))
+        n += 1
+        await asyncio.sleep(random.expovariate(rate))
+    await asyncio.gather(*tasks)
+    latencies.sort()
+    return {
+        "appels": len(latencies),
+        "erreurs": errors,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+    }
+
+
+async def main_async(args):
+    with LiveKitStandIn(latency_seconds=args.livekit_latency_ms / 1000) as stand_in:
+        os.environ["LIVEKIT_URL"] = stand_in.url
+        os.environ.setdefault("LIVEKIT_API_KEY", "cle-de-test")
+        os.environ.setdefault("LIVEKIT_API_SECRET", "secret-de-test-suffisamment-long-pour-hs256")
+        os.environ["SIP_WARM_ROOMS"] = str(args.warm_rooms)
+        os.environ.setdefault("AGENT_NAME", "artex-agent") # Requis par le pool ; un CreateDispatch par appel
+        import inbound_sip_handler # Importé après la configuration de l'environnement
+        app = inbound_sip_handler.app
+
+        async with app.router.lifespan_context(app):
+            pool = inbound_sip_handler.warm_rooms
+            if pool is not None and not await pool.wait_ready(timeout=30):
+                print(f"   ⚠️ Pool incomplet au démarrage ({pool.available}/{pool.size} salles).")
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://sip-webhook", timeout=30) as client:
+                result = await run_calls(client, args.rate, args.duration)
+                exposition = (await client.get("/metrics")).text
+        claims = {
+            line.split('resultat="')[1].split('"')[0]: line.rsplit(" ", 1)[1]
+            for line in exposition.splitlines() if line.startswith("artex_sip_warm_room_claims_total")
+        }
+        return result, dict(stand_in.requests), claims
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Banc d'essai du webhook SIP entrant.")
+    parser.add_argument("--rate", type=float, default=10.0, help="Appels entrants par seconde (moyenne).")
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--warm-rooms", type=int, default=0, help="Taille du pool de salles pré-créées (0 = création à chaque appel).")
+    parser.add_argument("--livekit-latency-ms", type=float, default=50.0, help="Latence simulée de la doublure LiveKit.")
+    args = parser.parse_args()
+
+    mode = f"pool de {args.warm_rooms} salles" if args.warm_rooms else "création à chaque appel"
+    print(f"🚀 /inbound-sip-handler — {args.rate:.0f} appels/s pendant {args.duration:.0f}s ({mode}, "
+          f"LiveKit {args.livekit_latency_ms:.0f} ms)...")
+    result, livekit_requests, claims = asyncio.run(main_async(args))
+    print(f"   p50 {result['p50_ms']:.1f} ms | p95 {result['p95_ms']:.1f} ms | p99 {result['p99_ms']:.1f} ms | "
+          f"{result['erreurs']} erreur(s) sur {result['appels']} appels")
+    if claims:
+        print(f"   Salles prises dans le pool : {claims.get('pool', '0')}, pool vide : {claims.get('vide', '0')}")
+    print(f"   Appels reçus par la doublure LiveKit : {livekit_requests or 'aucun'}")
+
+
+if __name__ == "__main__":
+    main()
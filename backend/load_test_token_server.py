@@ -0,0 +1,150 @@
+# load_test_token_server.py
+#
+# Test de charge du service de tokens (server.py) contre une doublure locale du serveur LiveKit.
+# L'application ASGI est appelée en mémoire (httpx.ASGITransport) ; la doublure répond aux appels
+# Twirp RoomService (CreateRoom, ListRooms) avec une latence simulée et compte les requêtes reçues.
+# Exemples :
+#   python load_test_token_server.py --concurrency 64 --duration 15
+#   python load_test_token_server.py --precreate-rooms --livekit-latency-ms 20
+#   python load_test_token_server.py --base-url http://localhost:5001   # serveur déjà lancé
+
+import argparse
+import asyncio
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+
+
+class LiveKitStandIn:
+    """Doublure minimale des API RoomService et AgentDispatchService de LiveKit (protobuf sur Twirp)."""
+
+    def __init__(self, latency_seconds: float = 0.0):
+        from livekit.protocol import agent_dispatch as proto_dispatch, models as proto_models, room as proto_room
+
+        self.latency_seconds = latency_seconds
+        self.requests = {}
+        self._lock = threading.Lock()
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                method = self.path.rsplit("/", 1)[-1]
+                with stand_in._lock:
+                    stand_in.requests[method] = stand_in.requests.get(method, 0) + 1
+                if stand_in.latency_seconds:
+                    time.sleep(stand_in.latency_seconds)
+                if method == "CreateRoom":
+                    request = proto_room.CreateRoomRequest.FromString(body)
+                    payload = proto_models.Room(name=request.name, empty_timeout=request.empty_timeout).SerializeToString()
+                elif method == "ListRooms":
+                    payload = proto_room.ListRoomsResponse().SerializeToString()
+                elif method == "CreateDispatch":
+                    request = proto_dispatch.CreateAgentDispatchRequest.FromString(body)
+                    payload = proto_dispatch.AgentDispatch(
+                        id=f"AD_{stand_in.requests[method]}", agent_name=request.agent_name, room=request.room,
+                    ).SerializeToString()
+                else:
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "application/protobuf")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+async def run_load(client: httpx.AsyncClient, concurrency: int, duration: float):
+    """`concurrency` clients demandent des tokens en boucle pendant `duration` secondes."""
+    latencies, errors = [], 0
+    deadline = time.perf_counter() + duration
+
+    async def worker(worker_id: int):
+        nonlocal errors
+        i = 0
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                response = await client.post("/create-token", json={"identity": f"charge-{worker_id}-{i}"})
+                if response.status_code != 200 or "token" not in response.json():
+                    errors += 1
+            except httpx.HTTPError:
+                errors += 1
+            latencies.append(time.perf_counter() - start)
+            i += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(n) for n in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "requetes": len(latencies),
+        "erreurs": errors,
+        "tokens_par_seconde": len(latencies) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+    }
+
+
+async def main_async(args):
+    if args.base_url:
+        async with httpx.AsyncClient(base_url=args.base_url, timeout=30) as client:
+            return await run_load(client, args.concurrency, args.duration), None
+
+    with LiveKitStandIn(latency_seconds=args.livekit_latency_ms / 1000) as stand_in:
+        os.environ["LIVEKIT_URL"] = stand_in.url
+        os.environ.setdefault("LIVEKIT_API_KEY", "cle-de-test")
+        os.environ.setdefault("LIVEKIT_API_SECRET", "secret-de-test-suffisamment-long-pour-hs256")
+        os.environ["LIVEKIT_PRECREATE_ROOMS"] = "1" if args.precreate_rooms else "0"
+        import server # Importé après la configuration de l'environnement
+
+        async with server.app.router.lifespan_context(server.app):
+            transport = httpx.ASGITransport(app=server.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://token-service", timeout=30) as client:
+                result = await run_load(client, args.concurrency, args.duration)
+        return result, dict(stand_in.requests)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Test de charge du service de tokens LiveKit.")
+    parser.add_argument("--base-url", default=None, help="Cibler un serveur déjà lancé au lieu de l'application en mémoire.")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--precreate-rooms", action="store_true", help="Active LIVEKIT_PRECREATE_ROOMS (un CreateRoom par token).")
+    parser.add_argument("--livekit-latency-ms", type=float, default=5.0, help="Latence simulée de la doublure LiveKit.")
+    args = parser.parse_args()
+
+    print(f"🚀 /create-token — {args.concurrency} clients concurrents pendant {args.duration:.0f}s...")
+    result, livekit_requests = asyncio.run(main_async(args))
+    print(f"   {result['tokens_par_seconde']:.1f} tokens/s | p50 {result['p50_ms']:.1f} ms | "
+          f"p99 {result['p99_ms']:.1f} ms | {result['erreurs']} erreur(s) sur {result['requetes']} requêtes")
+    if livekit_requests is not None:
+        print(f"   Appels reçus par la doublure LiveKit : {livekit_requests or 'aucun'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+# log_config.py
+#
+# Journalisation structurée de l'agent : une ligne JSON par enregistrement dans agent.log
+# (champs timestamp, level, name, message, plus job_id / call_id quand ils sont connus),
+# lue par la page de contrôle du tableau de bord.
+# Les threads et coroutines de l'agent ne font que déposer l'enregistrement dans une file
+# (QueueHandler) ; l'écriture disque et la rotation sont faites par un thread dédié (QueueListener).
+
+import atexit
+import contextvars
+import datetime
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import time
+from typing import Optional
+
+import metrics
+
+DEFAULT_LOG_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "agent.log")
+
+# Contexte de l'appel en cours, propagé automatiquement aux tâches asyncio créées par l'entrypoint.
+log_job_id: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("log_job_id", default=None)
+log_call_id: contextvars.ContextVar[Optional[int]] = contextvars.ContextVar("log_call_id", default=None)
+
+# Attributs standards d'un LogRecord : tout le reste provient de `extra=` et est recopié dans la ligne JSON.
+_STANDARD_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "job_id", "call_id"}
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def set_log_context(job_id: Optional[str] = None, call_id: Optional[int] = None):
+    """Renseigne job_id / call_id pour les logs émis ensuite dans ce contexte (tâche asyncio ou thread)."""
+    if job_id is not None:
+        log_job_id.set(job_id)
+    if call_id is not None:
+        log_call_id.set(call_id)
+
+
+class JsonLogFormatter(logging.Formatter):
+    """Une ligne JSON par enregistrement."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "timestamp": datetime.datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "name": record.name,
+            "message": record.getMessage(),
+        }
+        job_id = getattr(record, "job_id", None)
+        if job_id is not None:
+            entry["job_id"] = job_id
+        call_id = getattr(record, "call_id", None)
+        if call_id is not None:
+            entry["call_id"] = call_id
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        for key, value in record.__dict__.items():
+            if key not in _STANDARD_RECORD_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class _ContextQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler qui capture le contexte (job_id, call_id) et fige le message dans le thread appelant,
+    mais laisse le formatage (JSON, trace d'exception) au thread d'écriture.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = record.getMessage()
+        record.args = None
+        # Un job_id / call_id passé explicitement dans `extra=` (thread hors contexte de l'appel) est conservé.
+        if getattr(record, "job_id", None) is None:
+            record.job_id = log_job_id.get()
+        if getattr(record, "call_id", None) is None:
+            record.call_id = log_call_id.get()
+        return record
+
+
+class SizeAndTimeRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """
+    Rotation dès que le fichier dépasse max_bytes OU que rotate_seconds se sont écoulées.
+    La taille est lue sur le disque : plusieurs processus de l'agent peuvent écrire dans le même
+    fichier, et un fichier renommé par un autre processus est rouvert.
+    """
+
+    def __init__(self, filename, max_bytes: int, backup_count: int, rotate_seconds: float, encoding="utf-8"):
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count, encoding=encoding, delay=True)
+        self.rotate_seconds = rotate_seconds
+        self._opened_at = time.time()
+
+    def _reopen_if_moved(self):
+        if self.stream is None:
+            return
+        try:
+            on_disk = os.stat(self.baseFilename)
+            current = os.fstat(self.stream.fileno())
+            moved = (on_disk.st_ino, on_disk.st_dev) != (current.st_ino, current.st_dev)
+        except OSError:
+            moved = True
+        if moved:
+            self.stream.close()
+            self.stream = self._open()
+            self._opened_at = time.time()
+
+    def shouldRollover(self, record) -> bool:
+        self._reopen_if_moved()
+        if self.rotate_seconds and time.time() - self._opened_at >= self.rotate_seconds:
+            try:
+                if os.path.getsize(self.baseFilename) > 0:
+                    return True
+            except OSError:
+                return False
+        if self.maxBytes > 0:
+            try:
+                return os.path.getsize(self.baseFilename) >= self.maxBytes
+            except OSError:
+                return False
+        return False
+
+    def doRollover(self):
+        super().doRollover()
+        self._opened_at = time.time()
+
+
+def configure_logging(log_file: Optional[str] = None, level: int = logging.INFO, root_level: int = logging.WARNING):
+    """
+    Installe la journalisation structurée sur le logger racine (idempotent) :
+    - fichier JSON lines avec rotation (taille et durée), écrit par un thread dédié ;
+    - console en texte lisible.
+    Les handlers acceptent `level` ; le logger racine reste à `root_level` (bibliothèques tierces),
+    les loggers de l'application fixent leur propre niveau.
+    Variables d'environnement : AGENT_LOG_FILE, AGENT_LOG_MAX_BYTES, AGENT_LOG_BACKUP_COUNT, AGENT_LOG_ROTATE_HOURS.
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    file_handler = SizeAndTimeRotatingFileHandler(
+        log_file or os.getenv("AGENT_LOG_FILE", DEFAULT_LOG_FILE),
+        max_bytes=int(os.getenv("AGENT_LOG_MAX_BYTES", str(20 * 1024 * 1024))),
+        backup_count=int(os.getenv("AGENT_LOG_BACKUP_COUNT", "5")),
+        rotate_seconds=float(os.getenv("AGENT_LOG_ROTATE_HOURS", "24")) * 3600,
+    )
+    file_handler.setFormatter(JsonLogFormatter())
+    file_handler.setLevel(level)
+
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    console_handler.setLevel(level)
+
+    log_queue: "queue.Queue[logging.LogRecord]" = queue.Queue(-1)
+    _listener = logging.handlers.QueueListener(log_queue, file_handler, console_handler, respect_handler_level=True)
+    _listener.start()
+    metrics.QUEUE_DEPTH.labels("logs").set_function(log_queue.qsize)
+    atexit.register(shutdown_logging)
+
+    root = logging.getLogger()
+    root.addHandler(_ContextQueueHandler(log_queue))
+    root.setLevel(root_level)
+
+
+def shutdown_logging():
+    """Vide la file et arrête le thread d'écriture (appelée automatiquement à la sortie du processus)."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
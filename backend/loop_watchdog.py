@@ -0,0 +1,148 @@
+# loop_watchdog.py
+#
+# Détection des appels bloquants dans la boucle asyncio de l'agent (requête MySQL synchrone dans un
+# outil, envoi SendGrid, json.dumps d'un long historique...) : ils figent la boucle et hachent l'audio.
+#
+# Une coroutine « battement » se réveille toutes les `interval` secondes et date son passage.
+# Un thread de surveillance vérifie que le battement avance : s'il est en retard de plus de
+# `threshold` secondes, la boucle est bloquée par du code synchrone ; la pile du thread de la boucle
+# est alors capturée (c'est le code fautif) et journalisée avec le job_id des appels servis par la boucle.
+#
+# Activation : AGENT_LOOP_WATCHDOG=1 (seuil AGENT_LOOP_WATCHDOG_THRESHOLD_MS, défaut 100 ms).
+
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from typing import Dict, Optional, Set
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+BLOCKED_LOOP = metrics.REGISTRY.counter("artex_event_loop_blocked", "Blocages de la boucle asyncio au-delà du seuil.")
+BLOCKED_LOOP_DURATION = metrics.REGISTRY.histogram("artex_event_loop_blocked_seconds", "Durée des blocages de la boucle asyncio détectés.")
+
+# Profondeur maximale de pile journalisée (les frames les plus proches du blocage sont gardées).
+STACK_LIMIT = 40
+
+
+def watchdog_enabled() -> bool:
+    return os.getenv("AGENT_LOOP_WATCHDOG", "0").lower() in ("1", "true", "yes", "on")
+
+
+class LoopWatchdog:
+    """
+    Surveille une boucle asyncio. Mesure aussi le retard de la boucle à chaque battement
+    (métrique EVENT_LOOP_LAG), ce qui remplace metrics.sample_event_loop_lag quand il est actif.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, threshold: float = 0.1, interval: float = 0.05):
+        self.loop = loop
+        self.threshold = threshold
+        self.interval = interval
+        self.job_ids: Set[str] = set()
+        self.blocked_count = 0
+        self._loop_thread_id: Optional[int] = None
+        self._last_beat = time.monotonic()
+        self._beat_seq = 0
+        self._reported_seq = -1
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def start(self):
+        """À appeler depuis la boucle surveillée."""
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._task = self.loop.create_task(self._heartbeat())
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+        logger.info(f"Surveillance de la boucle asyncio active (seuil {self.threshold * 1000:.0f} ms).")
+
+    def stop(self):
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+
+    def is_running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def _heartbeat(self):
+        while True:
+            expected = self.loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, self.loop.time() - expected)
+            metrics.EVENT_LOOP_LAG.observe(lag)
+            if self._reported_seq == self._beat_seq:
+                # Fin d'un blocage signalé par le thread de surveillance : durée totale connue maintenant.
+                BLOCKED_LOOP_DURATION.observe(lag)
+                logger.warning(f"Boucle asyncio débloquée après {lag * 1000:.0f} ms.",
+                               extra={"blocked_ms": round(lag * 1000), "job_ids": sorted(self.job_ids)})
+            self._last_beat = time.monotonic()
+            self._beat_seq += 1
+
+    def _watch(self):
+        while not self._stop.wait(self.interval / 2):
+            if self.loop.is_closed():
+                return
+            seq = self._beat_seq
+            overdue = time.monotonic() - self._last_beat - self.interval
+            if overdue > self.threshold and self._reported_seq != seq:
+                self._reported_seq = seq
+                self._report(overdue)
+
+    def _report(self, overdue: float):
+        self.blocked_count += 1
+        BLOCKED_LOOP.inc()
+        frame = sys._current_frames().get(self._loop_thread_id)
+        if frame is not None:
+            stack = "".join(traceback.format_stack(frame, limit=STACK_LIMIT))
+            location = f"{frame.f_code.co_name} ({os.path.basename(frame.f_code.co_filename)}:{frame.f_lineno})"
+        else:
+            stack, location = "(pile indisponible)", "?"
+        job_ids = sorted(self.job_ids)
+        # Le contexte de log du thread de surveillance est vide : le job_id est renseigné explicitement.
+        # La pile complète est dans le champ `stack` de la ligne JSON.
+        logger.warning(
+            f"Boucle asyncio bloquée depuis {overdue * 1000:.0f} ms dans {location} (jobs: {', '.join(job_ids) or 'aucun'}).",
+            extra={"job_id": job_ids[0] if len(job_ids) == 1 else None, "job_ids": job_ids,
+                   "blocked_ms": round(overdue * 1000), "stack": stack},
+        )
+
+
+_watchdogs: Dict[int, LoopWatchdog] = {}
+_watchdogs_lock = threading.Lock()
+
+
+def ensure_watchdog(job_id: Optional[str] = None) -> LoopWatchdog:
+    """
+    Démarre (une fois par boucle) la surveillance de la boucle courante et lui associe `job_id`.
+    Paramètres : AGENT_LOOP_WATCHDOG_THRESHOLD_MS (défaut 100), AGENT_LOOP_WATCHDOG_INTERVAL_MS (défaut 50).
+    """
+    loop = asyncio.get_running_loop()
+    with _watchdogs_lock:
+        watchdog = _watchdogs.get(id(loop))
+        if watchdog is None or watchdog.loop is not loop or not watchdog.is_running():
+            if watchdog is not None:
+                watchdog.stop()
+            watchdog = LoopWatchdog(
+                loop,
+                threshold=float(os.getenv("AGENT_LOOP_WATCHDOG_THRESHOLD_MS", "100")) / 1000,
+                interval=float(os.getenv("AGENT_LOOP_WATCHDOG_INTERVAL_MS", "50")) / 1000,
+            )
+            watchdog.start()
+            _watchdogs[id(loop)] = watchdog
+    if job_id is not None:
+        watchdog.job_ids.add(job_id)
+    return watchdog
+
+
+def release_job(job_id: str):
+    """Retire `job_id` des boucles surveillées (fin de l'appel)."""
+    with _watchdogs_lock:
+        for watchdog in _watchdogs.values():
+            watchdog.job_ids.discard(job_id)
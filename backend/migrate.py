@@ -0,0 +1,71 @@
+# migrate.py
+#
+# Applique, dans l'ordre, les scripts SQL du dossier migrations/ qui ne l'ont pas encore été.
+# Les versions appliquées sont enregistrées dans la table schema_migrations.
+# Usage :
+#   python migrate.py            # applique les migrations en attente
+#   python migrate.py --status   # liste les migrations et leur état
+
+import argparse
+import logging
+import os
+import re
+from dotenv import load_dotenv
+from db_driver import ExtranetDatabaseDriver
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(__file__), 'migrations')
+
+
+def list_migrations():
+    """Retourne les fichiers de migration triés par nom (préfixe numérique)."""
+    return sorted(f for f in os.listdir(MIGRATIONS_DIR) if re.match(r'^\d+_.*\.sql$', f))
+
+
+def split_statements(sql: str):
+    """Découpe un script en instructions (séparateur ';' en fin de ligne, commentaires '--' ignorés)."""
+    lines = [line for line in sql.splitlines() if not line.strip().startswith('--')]
+    return [stmt.strip() for stmt in re.split(r';\s*(?:\n|$)', "\n".join(lines)) if stmt.strip()]
+
+
+def applied_versions(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version VARCHAR(255) PRIMARY KEY,
+            applique_le DATETIME NOT NULL
+        )
+    """)
+    cursor.execute("SELECT version FROM schema_migrations")
+    return {row[0] for row in cursor.fetchall()}
+
+
+def migrate(db: ExtranetDatabaseDriver, status_only: bool = False):
+    with db._get_connection() as conn:
+        cursor = conn.cursor()
+        done = applied_versions(cursor)
+        for filename in list_migrations():
+            version = filename[:-4]
+            if version in done:
+                logger.info(f"[appliquée]  {version}")
+                continue
+            if status_only:
+                logger.info(f"[en attente] {version}")
+                continue
+            with open(os.path.join(MIGRATIONS_DIR, filename), 'r', encoding='utf-8') as f:
+                statements = split_statements(f.read())
+            logger.info(f"Application de la migration {version} ({len(statements)} instruction(s))...")
+            for statement in statements:
+                cursor.execute(statement)
+            cursor.execute("INSERT INTO schema_migrations (version, applique_le) VALUES (%s, NOW())", (version,))
+            conn.commit()
+            logger.info(f"Migration {version} appliquée.")
+
+
+if __name__ == '__main__':
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Applique les migrations SQL du schéma.")
+    parser.add_argument("--status", action="store_true", help="Affiche l'état des migrations sans rien appliquer.")
+    args = parser.parse_args()
+    migrate(ExtranetDatabaseDriver(), status_only=args.status)
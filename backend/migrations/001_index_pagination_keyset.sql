@@ -0,0 +1,10 @@
+-- 001_index_pagination_keyset.sql
+-- Index composites (timestamp, id) pour la pagination par curseur des endpoints
+-- /api/dashboard/calls, /db_log et /errors : chaque page est une lecture de plage
+-- d'index, sans OFFSET ni tri en mémoire, quelle que soit la profondeur de la page.
+
+CREATE INDEX idx_journal_appels_debut_id ON journal_appels (timestamp_debut, id_appel);
+
+CREATE INDEX idx_interactions_bd_ts_id ON interactions_bd (timestamp_interaction, id_interaction);
+
+CREATE INDEX idx_erreurs_systeme_ts_id ON erreurs_systeme (timestamp_erreur, id_erreur);
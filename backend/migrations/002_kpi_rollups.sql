@@ -0,0 +1,36 @@
+-- 002_kpi_rollups.sql
+-- Tables d'agrégats des KPIs, maintenues incrémentalement par db_driver / error_logger
+-- (début et fin d'appel, insertion d'erreur ou de feedback) et reconstructibles via
+-- `python kpi_rollups.py rebuild`. Les tableaux de bord lisent ces tables au lieu de
+-- parcourir journal_appels, actions_agent, erreurs_systeme et feedback_appel.
+
+CREATE TABLE IF NOT EXISTS kpi_rollup_jour (
+    jour DATE NOT NULL PRIMARY KEY,
+    nb_appels INT NOT NULL DEFAULT 0,
+    nb_appels_termines INT NOT NULL DEFAULT 0,
+    duree_totale_secondes BIGINT NOT NULL DEFAULT 0,
+    nb_appels_identifies INT NOT NULL DEFAULT 0,
+    nb_erreurs INT NOT NULL DEFAULT 0,
+    nb_feedbacks INT NOT NULL DEFAULT 0,
+    somme_notes_satisfaction BIGINT NOT NULL DEFAULT 0,
+    nb_appels_outils INT NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS kpi_rollup_heure (
+    heure DATETIME NOT NULL PRIMARY KEY,
+    nb_appels INT NOT NULL DEFAULT 0,
+    nb_appels_termines INT NOT NULL DEFAULT 0,
+    duree_totale_secondes BIGINT NOT NULL DEFAULT 0,
+    nb_appels_identifies INT NOT NULL DEFAULT 0,
+    nb_erreurs INT NOT NULL DEFAULT 0,
+    nb_feedbacks INT NOT NULL DEFAULT 0,
+    somme_notes_satisfaction BIGINT NOT NULL DEFAULT 0,
+    nb_appels_outils INT NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS kpi_rollup_outils_jour (
+    jour DATE NOT NULL,
+    nom_outil VARCHAR(255) NOT NULL,
+    nb_appels_outil INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (jour, nom_outil)
+);
@@ -0,0 +1,10 @@
+-- 003_erreurs_systeme_agregation.sql
+-- error_logger regroupe les erreurs répétées : une ligne de erreurs_systeme représente désormais
+-- nb_occurrences erreurs de même empreinte (source + type d'exception + dernière frame)
+-- survenues pendant une fenêtre de quelques secondes.
+
+ALTER TABLE erreurs_systeme
+    ADD COLUMN nb_occurrences INT NOT NULL DEFAULT 1,
+    ADD COLUMN empreinte_erreur CHAR(40) NULL;
+
+CREATE INDEX idx_erreurs_systeme_empreinte ON erreurs_systeme (empreinte_erreur, timestamp_erreur);
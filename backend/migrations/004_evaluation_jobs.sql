@@ -0,0 +1,27 @@
+-- 004_evaluation_jobs.sql
+-- File de travail des évaluations post-appel (evaluation_queue.py), alimentée à la fin de chaque appel.
+-- Les évaluateurs (performance_eval.py) réservent des jobs avec SELECT ... FOR UPDATE SKIP LOCKED :
+-- plusieurs processus vident la file en parallèle sans évaluer deux fois le même appel.
+-- disponible_a : date à partir de laquelle le job peut être réservé, c'est-à-dire
+--   - en_attente : immédiatement, ou après le délai de nouvelle tentative (backoff) ;
+--   - en_cours   : fin du bail de l'évaluateur ; passé ce délai (processus arrêté), le job est repris.
+
+CREATE TABLE IF NOT EXISTS evaluation_jobs (
+    id_job BIGINT AUTO_INCREMENT PRIMARY KEY,
+    id_appel_fk INT NOT NULL,
+    statut ENUM('en_attente', 'en_cours', 'termine', 'echec') NOT NULL DEFAULT 'en_attente',
+    nb_tentatives INT NOT NULL DEFAULT 0,
+    disponible_a DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    evaluateur VARCHAR(100) NULL,
+    derniere_erreur TEXT NULL,
+    cree_le DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    modifie_le DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    UNIQUE KEY uq_evaluation_jobs_appel (id_appel_fk),
+    KEY idx_evaluation_jobs_reservation (statut, disponible_a)
+);
+
+-- Reprise du backlog existant (ancienne sélection par parcours de journal_appels).
+INSERT IGNORE INTO evaluation_jobs (id_appel_fk)
+SELECT id_appel FROM journal_appels
+WHERE (resume_appel IS NULL OR resume_appel LIKE '%Erreur%' OR resume_appel LIKE '%Non généré%')
+  AND (transcription_complete IS NOT NULL AND transcription_complete != '[]');
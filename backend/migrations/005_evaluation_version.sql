@@ -0,0 +1,8 @@
+-- 005_evaluation_version.sql
+-- Version du prompt et modèle LLM ayant produit l'évaluation de l'appel :
+-- `python performance_eval.py --rescore` ne réévalue que les appels notés avec une autre version ou un autre modèle.
+
+ALTER TABLE journal_appels
+    ADD COLUMN evaluation_version_prompt VARCHAR(32) NULL,
+    ADD COLUMN evaluation_modele VARCHAR(100) NULL,
+    ADD COLUMN evaluation_le DATETIME NULL;
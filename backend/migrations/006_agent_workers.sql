@@ -0,0 +1,13 @@
+-- 006_agent_workers.sql
+-- Capacité des workers de l'agent, pour le contrôle d'admission du webhook SIP (admission.py).
+-- Chaque worker met à jour sa ligne toutes les quelques secondes (battement de cœur) ; une ligne
+-- dont derniere_activite est trop ancienne (worker arrêté) n'est plus comptée.
+
+CREATE TABLE IF NOT EXISTS agent_workers (
+    id_worker VARCHAR(100) PRIMARY KEY,
+    capacite INT NOT NULL,
+    appels_actifs INT NOT NULL DEFAULT 0,
+    demarre_le DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    derniere_activite DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    KEY idx_agent_workers_activite (derniere_activite)
+);
@@ -0,0 +1,36 @@
+-- 007_rappels.sql
+-- Campagnes d'appels sortants (campaign_dialer.py) : file des numéros à rappeler et issue de chaque tentative.
+-- Les rappels demandés pendant un appel (outil schedule_callback_with_advisor) sont ajoutés à la file.
+-- disponible_a : comme pour evaluation_jobs, date à partir de laquelle le rappel peut être composé
+--   - en_attente : immédiatement, ou après le délai de nouvelle tentative (dans la plage horaire suivante) ;
+--   - en_cours   : fin du bail du composeur ; passé ce délai (processus arrêté), le rappel est repris.
+
+CREATE TABLE IF NOT EXISTS rappels (
+    id_rappel BIGINT AUTO_INCREMENT PRIMARY KEY,
+    telephone VARCHAR(32) NOT NULL,
+    motif TEXT NULL,
+    campagne VARCHAR(100) NOT NULL DEFAULT 'rappels_conseiller',
+    id_appel_origine INT NULL,
+    id_adherent_fk INT NULL,
+    statut ENUM('en_attente', 'en_cours', 'joint', 'abandonne') NOT NULL DEFAULT 'en_attente',
+    nb_tentatives INT NOT NULL DEFAULT 0,
+    disponible_a DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    composeur VARCHAR(100) NULL,
+    derniere_issue VARCHAR(32) NULL,
+    cree_le DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    modifie_le DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    KEY idx_rappels_reservation (statut, disponible_a)
+);
+
+CREATE TABLE IF NOT EXISTS rappels_tentatives (
+    id_tentative BIGINT AUTO_INCREMENT PRIMARY KEY,
+    id_rappel_fk BIGINT NOT NULL,
+    numero_tentative INT NOT NULL,
+    debut DATETIME NOT NULL,
+    duree_ms INT NOT NULL,
+    issue VARCHAR(32) NOT NULL,
+    code_sip INT NULL,
+    detail VARCHAR(500) NULL,
+    salle VARCHAR(255) NULL,
+    KEY idx_rappels_tentatives_rappel (id_rappel_fk)
+);
@@ -1,70 +1,620 @@
-# ai/backend/performance_eval.py (Version Finale avec Gestion des Quotas)
+# ai/backend/performance_eval.py (Pipeline asynchrone avec limitation de débit)
+#
+# Évalue et résume les appels en attente avec le LLM.
+# - Le travail vient de la file evaluation_jobs (evaluation_queue.py), alimentée à la fin de chaque appel :
+#   plusieurs instances peuvent tourner en même temps sans évaluer deux fois le même appel ;
+#   un échec est retenté plus tard (backoff), puis abandonné après quelques tentatives.
+# - Plusieurs évaluations en parallèle (--concurrency), sous un limiteur requêtes/min et jetons/min
+#   qui se règle tout seul sur les refus 429 de l'API (rate_limiter.py).
+# - Les transcriptions sont lues par lot de jobs réservés et les résultats écrits par lots : une connexion n'est
+#   empruntée au pool que le temps d'une requête, jamais pendant un appel au LLM.
+# - Les transcriptions sont compactées (transcript_compaction.py) avant d'être envoyées au LLM.
+# - Un cache local (evaluation_cache.py) évite de repayer l'évaluation d'une transcription inchangée avec
+#   la même version de prompt et le même modèle ; --rescore remet en file les appels évalués avec une
+#   autre version du prompt (PERFORMANCE_EVALUATION_PROMPT_VERSION) ou un autre modèle.
+# - Mode par lots (--batch-tokens) : plusieurs transcriptions compactées courtes dans une même requête,
+#   sous un budget de jetons ; les appels absents ou invalides de la réponse sont réévalués un par un.
+# - Progression, débit, jetons économisés et coût LLM (comparé au mode unitaire) journalisés régulièrement.
+# --simulate N remplace la base et le LLM par des doublures locales (FakeLLM) pour tester le pipeline.
 
+import argparse
+import asyncio
 import logging
 import os
 import json
-import time # Import du module time pour la pause
+import random
+import re
+import time
+from dataclasses import dataclass, field
+from types import SimpleNamespace
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
 from dotenv import load_dotenv
-import mysql.connector
 from db_driver import ExtranetDatabaseDriver
 from error_logger import log_system_error, set_db_connection_params
-from prompts import PERFORMANCE_EVALUATION_PROMPT
+import evaluation_queue
+from evaluation_cache import EvaluationCache, cache_key
+from prompts import PERFORMANCE_EVALUATION_BATCH_PROMPT, PERFORMANCE_EVALUATION_PROMPT, PERFORMANCE_EVALUATION_PROMPT_VERSION
+from rate_limiter import AsyncRateLimiter
+from transcript_compaction import compact_transcript, estimate_tokens
 from langchain_google_genai import ChatGoogleGenerativeAI
 
 # Configuration du logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-def evaluate_and_summarize_call(id_appel: int, db: ExtranetDatabaseDriver, llm: ChatGoogleGenerativeAI):
+EVALUATION_MODEL = os.getenv("PERFORMANCE_EVAL_MODEL", "gemini-2.5-flash-lite")
+DEFAULT_CONCURRENCY = int(os.getenv("PERFORMANCE_EVAL_CONCURRENCY", "8"))
+DEFAULT_REQUESTS_PER_MINUTE = float(os.getenv("PERFORMANCE_EVAL_RPM", "60"))
+DEFAULT_TOKENS_PER_MINUTE = float(os.getenv("PERFORMANCE_EVAL_TPM", "250000"))
+DEFAULT_WRITE_BATCH_SIZE = int(os.getenv("PERFORMANCE_EVAL_WRITE_BATCH", "25"))
+DEFAULT_BATCH_TOKENS = int(os.getenv("PERFORMANCE_EVAL_BATCH_TOKENS", "0")) # Jetons de transcriptions par requête groupée (0 = mode unitaire)
+DEFAULT_BATCH_MAX_CALLS = int(os.getenv("PERFORMANCE_EVAL_BATCH_MAX_CALLS", "8"))
+FETCH_BATCH_SIZE = 50 # Transcriptions lues par requête (mode liste)
+QUEUE_POLL_SECONDS = 15 # Attente entre deux réservations quand la file est vide (--follow)
+FLUSH_SECONDS = 10.0 # Écriture des évaluations au plus tard après ce délai (bien en deçà du bail des jobs)
+PROGRESS_INTERVAL_SECONDS = 10
+MAX_ATTEMPTS = 5 # Tentatives par appel en cas de refus 429
+EXPECTED_OUTPUT_TOKENS = 600 # Réponse JSON du LLM, comptée dans le budget jetons/min
+
+PARSE_ERROR_TEXT = "Erreur de parsing."
+EvaluationRow = Tuple[int, str, str, str] # (id_appel, resume, conformite, resolution)
+
+
+def is_valid_transcription(transcription: Optional[str]) -> bool:
+    return bool(transcription) and transcription not in ('[]', 'Transcription non disponible.')
+
+
+def parse_evaluation_response(id_appel: int, content: str) -> Tuple[str, str, str]:
+    """Extrait (resume, conformite, resolution) de la réponse JSON du LLM."""
+    try:
+        # Gère le cas où le LLM retourne le JSON dans un bloc de code
+        response_content = content.strip()
+        if response_content.startswith("```json"):
+            response_content = response_content[7:-3].strip()
+
+        eval_data = json.loads(response_content)
+        resume = eval_data.get("resume_evaluation", "Résumé non fourni par l'IA.")
+        conformite = str(eval_data.get("conformite", "Évaluation de conformité non fournie."))
+        resolution = str(eval_data.get("points_amelioration", "Points d'amélioration non fournis."))
+        return resume, conformite, resolution
+    except (json.JSONDecodeError, AttributeError, KeyError) as e:
+        logger.error(f"Impossible de parser la réponse du LLM pour l'appel {id_appel}. Erreur: {e}. Réponse brute: {content}")
+        return PARSE_ERROR_TEXT, PARSE_ERROR_TEXT, PARSE_ERROR_TEXT
+
+
+def _strip_code_fence(content: str) -> str:
+    content = content.strip()
+    match = re.match(r"^```(?:json)?\s*(.*?)\s*```$", content, re.DOTALL)
+    return match.group(1) if match else content
+
+
+def parse_batch_response(content: str, expected_ids: List[int]) -> Dict[int, Tuple[str, str, str]]:
     """
-    Génère un résumé et une évaluation via un LLM, puis met à jour la base de données.
+    Extrait les évaluations valides d'une réponse par lots (tableau JSON d'objets avec "id_appel").
+    Les éléments invalides, en double ou d'identifiant inattendu sont ignorés : les appels absents
+    du résultat seront réévalués un par un.
     """
-    logger.info(f"Début de l'évaluation et du résumé pour l'appel ID: {id_appel}")
-    
     try:
-        with db._get_connection() as conn:
-            cursor = conn.cursor(dictionary=True)
-            cursor.execute("SELECT transcription_complete FROM journal_appels WHERE id_appel = %s", (id_appel,))
-            call_data = cursor.fetchone()
+        items = json.loads(_strip_code_fence(content))
+    except (json.JSONDecodeError, AttributeError) as e:
+        logger.warning(f"Réponse par lots non parsable ({e}) : les {len(expected_ids)} appels seront évalués un par un.")
+        return {}
+    if isinstance(items, dict): # Certains modèles enveloppent le tableau : {"evaluations": [...]}
+        items = next((value for value in items.values() if isinstance(value, list)), [])
+    if not isinstance(items, list):
+        return {}
+    expected = set(expected_ids)
+    results: Dict[int, Tuple[str, str, str]] = {}
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        try:
+            id_appel = int(item.get("id_appel"))
+        except (TypeError, ValueError):
+            continue
+        resume = item.get("resume_evaluation")
+        if id_appel not in expected or id_appel in results or not isinstance(resume, str) or not resume.strip():
+            continue
+        results[id_appel] = (
+            resume,
+            str(item.get("conformite", "Évaluation de conformité non fournie.")),
+            str(item.get("points_amelioration", "Points d'amélioration non fournis.")),
+        )
+    return results
+
+
+def rate_limit_details(exc: Exception) -> Tuple[bool, Optional[float]]:
+    """(refus 429 ?, délai Retry-After éventuel) pour une exception levée par le client LLM."""
+    response = getattr(exc, "response", None)
+    status = getattr(exc, "status_code", None) or getattr(response, "status_code", None)
+    text = f"{type(exc).__name__} {exc}"
+    limited = status == 429 or "429" in text or "ResourceExhausted" in text or "RESOURCE_EXHAUSTED" in text \
+        or "rate limit" in text.lower()
+    retry_after = None
+    headers = getattr(response, "headers", None)
+    if limited and headers:
+        try:
+            retry_after = float(headers.get("retry-after"))
+        except (TypeError, ValueError):
+            retry_after = None
+    return limited, retry_after
+
+
+@dataclass
+class EvaluationStats:
+    total: Optional[int] # Inconnu quand les appels viennent de la file
+    done: int = 0
+    skipped: int = 0
+    failed: int = 0
+    written: int = 0
+    cached: int = 0 # Évaluations reprises du cache, sans appel au LLM
+    llm_requests: int = 0
+    batch_requests: int = 0 # Dont requêtes groupées...
+    batch_fallbacks: int = 0 # ...et appels réévalués un par un faute de résultat valide dans le lot
+    prompt_tokens: int = 0 # Jetons d'entrée envoyés au LLM (estimation)...
+    single_prompt_tokens: int = 0 # ...et ce qu'auraient coûté les mêmes évaluations en mode unitaire
+    tokens_raw: int = 0 # Jetons estimés des transcriptions brutes...
+    tokens_compact: int = 0 # ...et après compactage
+    started_at: float = field(default_factory=time.monotonic)
+
+    def log_progress(self, limiter: AsyncRateLimiter):
+        elapsed = max(time.monotonic() - self.started_at, 1e-6)
+        processed = self.done + self.skipped + self.failed
+        rate = self.done / elapsed * 60
+        if self.total is not None and processed:
+            eta = f"{(self.total - processed) / (processed / elapsed) / 60:.1f} min"
+        else:
+            eta = "?"
+        logger.info(
+            f"Progression : {processed}/{self.total if self.total is not None else '?'} (évalués {self.done}, ignorés {self.skipped}, échecs {self.failed}, "
+            f"écrits {self.written}, depuis le cache {self.cached}) - {rate:.1f} appels/min - reste ~{eta} - "
+            f"limite actuelle {limiter.current_requests_per_minute:.0f} req/min, {limiter.rate_limited_count} refus 429 - "
+            f"transcriptions {self.tokens_raw} -> {self.tokens_compact} jetons"
+        )
+        if self.batch_requests:
+            evaluated = self.done - self.cached
+            saved = 1 - self.prompt_tokens / self.single_prompt_tokens if self.single_prompt_tokens else 0.0
+            logger.info(
+                f"Coût LLM : {self.llm_requests} requêtes pour {evaluated} appels évalués "
+                f"({self.batch_requests} groupées, {self.batch_fallbacks} reprises unitaires) ; "
+                f"{self.prompt_tokens} jetons d'entrée contre {self.single_prompt_tokens} en mode unitaire (-{saved:.0%})."
+            )
+
+
+class _EvaluationWriter:
+    """Accumule les évaluations et les écrit par lots (dans un thread : l'écriture est synchrone)."""
+
+    def __init__(self, save: Callable[[List[EvaluationRow]], int], batch_size: int, stats: EvaluationStats):
+        self.save = save
+        self.batch_size = batch_size
+        self.stats = stats
+        self._pending: List[EvaluationRow] = []
+        self._lock = asyncio.Lock()
+        self._flushed_at = time.monotonic()
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    async def add(self, row: EvaluationRow):
+        self._pending.append(row)
+        if len(self._pending) >= self.batch_size or time.monotonic() - self._flushed_at >= FLUSH_SECONDS:
+            await self.flush()
+
+    async def flush(self):
+        async with self._lock:
+            batch, self._pending = self._pending, []
+            self._flushed_at = time.monotonic()
+            if batch:
+                self.stats.written += await asyncio.to_thread(self.save, batch)
+
+
+async def _invoke(llm, limiter: AsyncRateLimiter, prompt: str, output_tokens: int,
+                  stats: Optional[EvaluationStats] = None) -> str:
+    """Une requête au LLM sous le limiteur, avec nouvelles tentatives sur refus 429. Retourne le texte de la réponse."""
+    prompt_tokens = estimate_tokens(prompt)
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        await limiter.acquire(prompt_tokens + output_tokens)
+        if stats is not None:
+            stats.llm_requests += 1
+            stats.prompt_tokens += prompt_tokens
+        try:
+            response = await llm.ainvoke(prompt)
+        except Exception as e:
+            limited, retry_after = rate_limit_details(e)
+            if not limited or attempt == MAX_ATTEMPTS:
+                raise
+            limiter.on_rate_limited(retry_after)
+            await asyncio.sleep(retry_after or min(30.0, 2 ** attempt) * random.uniform(0.5, 1.0))
+            continue
+        limiter.on_success()
+        return response.content
+
+
+def single_prompt(transcription: str) -> str:
+    return PERFORMANCE_EVALUATION_PROMPT.format(transcription=transcription)
+
+
+async def evaluate_call(id_appel: int, transcription: str, llm, limiter: AsyncRateLimiter,
+                        stats: Optional[EvaluationStats] = None) -> Tuple[str, str, str]:
+    """Un appel au LLM (avec nouvelles tentatives sur refus 429) et le parsing de sa réponse."""
+    prompt = single_prompt(transcription)
+    if stats is not None:
+        stats.single_prompt_tokens += estimate_tokens(prompt)
+    content = await _invoke(llm, limiter, prompt, EXPECTED_OUTPUT_TOKENS, stats)
+    return parse_evaluation_response(id_appel, content)
+
+
+async def evaluate_batch(items: List[Tuple[int, str]], llm, limiter: AsyncRateLimiter,
+                         stats: Optional[EvaluationStats] = None) -> Dict[int, Tuple[str, str, str]]:
+    """
+    Évalue plusieurs appels (id_appel, transcription compactée) en une seule requête.
+    Retourne les résultats valides par id_appel ; les appels manquants sont à réévaluer un par un.
+    """
+    blocks = "\n".join(f"=== Appel {id_appel} ===\n{transcription}\n" for id_appel, transcription in items)
+    prompt = PERFORMANCE_EVALUATION_BATCH_PROMPT.format(appels=blocks)
+    if stats is not None:
+        stats.batch_requests += 1
+        stats.single_prompt_tokens += sum(estimate_tokens(single_prompt(transcription)) for _, transcription in items)
+    content = await _invoke(llm, limiter, prompt, EXPECTED_OUTPUT_TOKENS * len(items), stats)
+    return parse_batch_response(content, [id_appel for id_appel, _ in items])
+
+
+async def evaluate_cached(id_appel: int, transcription: str, llm, limiter: AsyncRateLimiter,
+                          cache: Optional[EvaluationCache], model: str = EVALUATION_MODEL,
+                          stats: Optional[EvaluationStats] = None) -> Tuple[Tuple[str, str, str], bool]:
+    """evaluate_call précédé d'une recherche dans le cache. Retourne (résultat, pris dans le cache ?)."""
+    if cache is None:
+        return await evaluate_call(id_appel, transcription, llm, limiter, stats), False
+    key = cache_key(transcription, PERFORMANCE_EVALUATION_PROMPT_VERSION, model)
+    cached = await asyncio.to_thread(cache.get, key)
+    if cached is not None:
+        return tuple(cached), True
+    result = await evaluate_call(id_appel, transcription, llm, limiter, stats)
+    if result[0] != PARSE_ERROR_TEXT:
+        await asyncio.to_thread(cache.put, key, id_appel, result)
+    return result, False
+
+
+_FLUSH = object() # Marqueur interne de run_pipeline : envoyer le lot en cours
+
+
+def chunked(call_ids: List[int], size: int = FETCH_BATCH_SIZE) -> Iterator[List[int]]:
+    for start in range(0, len(call_ids), size):
+        yield call_ids[start:start + size]
+
+
+async def run_pipeline(
+    id_batches: Iterable[List[int]],
+    load_transcriptions: Callable[[List[int]], Dict[int, Optional[str]]],
+    save_evaluations: Callable[[List[EvaluationRow]], int],
+    llm,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    requests_per_minute: float = DEFAULT_REQUESTS_PER_MINUTE,
+    tokens_per_minute: float = DEFAULT_TOKENS_PER_MINUTE,
+    write_batch_size: int = DEFAULT_WRITE_BATCH_SIZE,
+    total: Optional[int] = None,
+    on_failed: Optional[Callable[[int, str, bool], None]] = None,
+    cache: Optional[EvaluationCache] = None,
+    model: str = EVALUATION_MODEL,
+    batch_tokens: int = DEFAULT_BATCH_TOKENS,
+    batch_max_calls: int = DEFAULT_BATCH_MAX_CALLS,
+) -> EvaluationStats:
+    """
+    Évalue les appels des lots `id_batches` avec `concurrency` évaluations simultanées au plus.
+    `id_batches` (itérable éventuellement bloquant, ex. réservation dans la file), `load_transcriptions`,
+    `save_evaluations` et `on_failed(id_appel, erreur, retenter)` sont synchrones et exécutés dans des threads.
+    Avec `on_failed`, une réponse du LLM non parsable est traitée comme un échec (retentée) au lieu d'être écrite.
+    Avec `batch_tokens` > 0, chaque évaluateur regroupe les transcriptions disponibles (jusqu'à `batch_max_calls`
+    appels et `batch_tokens` jetons de transcription) dans une seule requête.
+    """
+    limiter = AsyncRateLimiter(requests_per_minute, tokens_per_minute)
+    stats = EvaluationStats(total=total)
+    writer = _EvaluationWriter(save_evaluations, write_batch_size, stats)
+    # File bornée : seules quelques transcriptions d'avance sont gardées en mémoire.
+    work: asyncio.Queue = asyncio.Queue(maxsize=concurrency * 2)
+
+    async def failed(id_appel: int, error: str, retry: bool):
+        if on_failed is not None:
+            await asyncio.to_thread(on_failed, id_appel, error, retry)
+
+    async def produce():
+        batches = iter(id_batches)
+        while (chunk := await asyncio.to_thread(next, batches, None)) is not None:
+            transcriptions = await asyncio.to_thread(load_transcriptions, chunk)
+            for id_appel in chunk:
+                await work.put((id_appel, transcriptions.get(id_appel)))
+        for _ in range(concurrency):
+            await work.put(None)
+
+    def prepare(id_appel: int, transcription: Optional[str]) -> Optional[Tuple[int, str]]:
+        if not is_valid_transcription(transcription):
+            return None
+        compact = compact_transcript(transcription)
+        stats.tokens_raw += compact.tokens_before
+        stats.tokens_compact += compact.tokens_after
+        logger.debug(f"Appel {id_appel} : transcription compactée {compact.tokens_before} -> {compact.tokens_after} jetons.")
+        return id_appel, compact.text
+
+    async def record(id_appel: int, result: Tuple[str, str, str], from_cache: bool):
+        resume, conformite, resolution = result
+        if resume == PARSE_ERROR_TEXT and on_failed is not None:
+            stats.failed += 1
+            await failed(id_appel, "Réponse du LLM non parsable.", True)
+            return
+        stats.done += 1
+        stats.cached += from_cache
+        await writer.add((id_appel, resume, conformite, resolution))
+
+    async def evaluate_single(id_appel: int, text: str):
+        try:
+            result, from_cache = await evaluate_cached(id_appel, text, llm, limiter, cache, model, stats)
+        except Exception as e:
+            stats.failed += 1
+            logger.error(f"Erreur inattendue lors de l'évaluation de l'appel {id_appel}: {e}", exc_info=True)
+            log_system_error("performance_eval.evaluate_call", f"Unexpected Error: {e}", e, id_appel_fk=id_appel)
+            await failed(id_appel, f"{type(e).__name__}: {e}", True)
+            return
+        await record(id_appel, result, from_cache)
 
-            if not call_data or not call_data['transcription_complete'] or call_data['transcription_complete'] in ('[]', 'Transcription non disponible.'):
+    async def evaluate_pack(pack: List[Tuple[int, str]]):
+        if len(pack) == 1:
+            await evaluate_single(*pack[0])
+            return
+        keys = {}
+        to_evaluate = []
+        for id_appel, text in pack:
+            if cache is not None:
+                keys[id_appel] = cache_key(text, PERFORMANCE_EVALUATION_PROMPT_VERSION, model)
+                cached = await asyncio.to_thread(cache.get, keys[id_appel])
+                if cached is not None:
+                    await record(id_appel, tuple(cached), True)
+                    continue
+            to_evaluate.append((id_appel, text))
+        if len(to_evaluate) < 2:
+            for item in to_evaluate:
+                await evaluate_single(*item)
+            return
+        try:
+            results = await evaluate_batch(to_evaluate, llm, limiter, stats)
+        except Exception as e:
+            logger.warning(f"Requête groupée de {len(to_evaluate)} appels en échec ({type(e).__name__}: {e}) : évaluation un par un.")
+            results = {}
+        for id_appel, text in to_evaluate:
+            result = results.get(id_appel)
+            if result is None:
+                stats.batch_fallbacks += 1
+                await evaluate_single(id_appel, text)
+                continue
+            if cache is not None:
+                await asyncio.to_thread(cache.put, keys[id_appel], id_appel, result)
+            await record(id_appel, result, False)
+
+    def fits(pack: List[Tuple[int, str]], item: Tuple[int, str]) -> bool:
+        if batch_tokens <= 0 or len(pack) >= batch_max_calls:
+            return False
+        return sum(estimate_tokens(text) for _, text in pack) + estimate_tokens(item[1]) <= batch_tokens
+
+    async def consume():
+        pack: List[Tuple[int, str]] = []
+        while True:
+            if not pack and work.empty() and writer.pending:
+                # File vide (--follow entre deux réservations) : les évaluations terminées sont écrites
+                # et leurs jobs complétés avant l'expiration du bail.
+                await writer.flush()
+            # Lot partiel envoyé dès que plus rien n'est disponible immédiatement : pas d'attente du producteur.
+            item = await work.get() if not pack or not work.empty() else _FLUSH
+            if item is None or item is _FLUSH:
+                if pack:
+                    await evaluate_pack(pack)
+                    pack = []
+                if item is None:
+                    return
+                continue
+            id_appel, transcription = item
+            prepared = prepare(id_appel, transcription)
+            if prepared is None:
                 logger.warning(f"Pas de transcription valide pour l'appel {id_appel}. Annulation.")
+                stats.skipped += 1
+                await failed(id_appel, "Pas de transcription valide.", False)
+                continue
+            if pack and not fits(pack, prepared):
+                await evaluate_pack(pack)
+                pack = []
+            pack.append(prepared)
+            if batch_tokens <= 0:
+                await evaluate_pack(pack)
+                pack = []
+
+    async def report():
+        while True:
+            await asyncio.sleep(PROGRESS_INTERVAL_SECONDS)
+            stats.log_progress(limiter)
+
+    reporter = asyncio.create_task(report())
+    try:
+        await asyncio.gather(produce(), *(consume() for _ in range(concurrency)))
+    finally:
+        reporter.cancel()
+        await writer.flush()
+    stats.log_progress(limiter)
+    return stats
+
+
+# --- Accès à la base (synchrones, une connexion empruntée par requête) ---
+
+def claimed_batches(db: ExtranetDatabaseDriver, worker_id: str, batch_size: int,
+                    limit: Optional[int] = None, follow: bool = False) -> Iterator[List[int]]:
+    """Lots d'appels réservés dans la file ; s'arrête quand elle est vide (sauf `follow`) ou après `limit` appels."""
+    claimed = 0
+    while limit is None or claimed < limit:
+        size = batch_size if limit is None else min(batch_size, limit - claimed)
+        call_ids = evaluation_queue.claim_jobs(db, worker_id, size)
+        if not call_ids:
+            if not follow:
                 return
+            time.sleep(QUEUE_POLL_SECONDS)
+            continue
+        claimed += len(call_ids)
+        yield call_ids
 
-            transcription = call_data['transcription_complete']
-            
-            prompt = PERFORMANCE_EVALUATION_PROMPT.format(transcription=transcription)
-            response = llm.invoke(prompt)
-            
-            # --- Amélioration du parsing JSON ---
-            try:
-                # Gère le cas où le LLM retourne le JSON dans un bloc de code
-                response_content = response.content.strip()
-                if response_content.startswith("```json"):
-                    response_content = response_content[7:-3].strip()
-                
-                eval_data = json.loads(response_content)
-                resume = eval_data.get("resume_evaluation", "Résumé non fourni par l'IA.")
-                conformite = str(eval_data.get("conformite", "Évaluation de conformité non fournie."))
-                resolution = str(eval_data.get("points_amelioration", "Points d'amélioration non fournis."))
-            except (json.JSONDecodeError, AttributeError, KeyError) as e:
-                logger.error(f"Impossible de parser la réponse du LLM pour l'appel {id_appel}. Erreur: {e}. Réponse brute: {response.content}")
-                resume, conformite, resolution = "Erreur de parsing.", "Erreur de parsing.", "Erreur de parsing."
-            
-            success = db.enregistrer_evaluation_appel(id_appel, resume, conformite, resolution)
-            if success:
-                logger.info(f"Évaluation et résumé enregistrés pour l'appel {id_appel}.")
-            else:
-                logger.error(f"Échec de l'enregistrement de l'évaluation pour l'appel {id_appel}.")
 
-    except Exception as e:
-        logger.error(f"Erreur inattendue lors de l'évaluation de l'appel {id_appel}: {e}", exc_info=True)
-        log_system_error("performance_eval.evaluate_and_summarize_call", f"Unexpected Error: {e}", e, id_appel_fk=id_appel)
+def save_and_complete(db: ExtranetDatabaseDriver, worker_id: str, batch: List[EvaluationRow]) -> int:
+    """Écrit un lot d'évaluations puis clôt les jobs correspondants (ou les replanifie si l'écriture a échoué)."""
+    call_ids = [row[0] for row in batch]
+    written = db.enregistrer_evaluations_appels(batch, PERFORMANCE_EVALUATION_PROMPT_VERSION, EVALUATION_MODEL)
+    if written:
+        evaluation_queue.complete_jobs(db, worker_id, call_ids)
+    else:
+        for id_appel in call_ids:
+            evaluation_queue.fail_job(db, worker_id, id_appel, "Échec de l'écriture de l'évaluation.")
+    return written
+
+
+def fetch_transcriptions(db: ExtranetDatabaseDriver, call_ids: List[int]) -> Dict[int, Optional[str]]:
+    placeholders = ", ".join(["%s"] * len(call_ids))
+    with db._get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT id_appel, transcription_complete FROM journal_appels WHERE id_appel IN ({placeholders})", tuple(call_ids))
+        return {row[0]: row[1] for row in cursor.fetchall()}
+
+
+async def evaluate_and_store_call(db: ExtranetDatabaseDriver, llm, limiter: AsyncRateLimiter, id_appel: int,
+                                  worker_id: str, cache: Optional[EvaluationCache] = None) -> bool:
+    """
+    Évaluation immédiate d'un seul appel (étape post-appel, voir post_call.py), via la même file :
+    le job de l'appel est réservé, évalué, écrit puis clos. Retourne False si le job n'était pas
+    disponible (déjà traité, ou pris par un évaluateur batch). Lève une exception en cas d'échec,
+    après avoir replanifié le job.
+    """
+    if not await asyncio.to_thread(evaluation_queue.claim_call, db, worker_id, id_appel):
+        logger.info(f"Appel {id_appel} : pas de job d'évaluation disponible (déjà traité ou en cours ailleurs).")
+        return False
+    try:
+        transcription = (await asyncio.to_thread(fetch_transcriptions, db, [id_appel])).get(id_appel)
+        if not is_valid_transcription(transcription):
+            await asyncio.to_thread(evaluation_queue.fail_job, db, worker_id, id_appel, "Pas de transcription valide.", False)
+            return False
+        compact = compact_transcript(transcription)
+        (resume, conformite, resolution), from_cache = await evaluate_cached(id_appel, compact.text, llm, limiter, cache)
+        if resume == PARSE_ERROR_TEXT:
+            raise ValueError("Réponse du LLM non parsable.")
+        if not await asyncio.to_thread(db.enregistrer_evaluations_appels, [(id_appel, resume, conformite, resolution)],
+                                       PERFORMANCE_EVALUATION_PROMPT_VERSION, EVALUATION_MODEL):
+            raise RuntimeError("Échec de l'écriture de l'évaluation.")
+    except BaseException as e:
+        # Y compris l'annulation (délai de l'étape post-appel dépassé) : le job ne doit pas rester
+        # en_cours jusqu'à l'expiration du bail, sinon la nouvelle tentative ne peut pas le réserver.
+        error = "Délai dépassé (annulation)." if isinstance(e, asyncio.CancelledError) else f"{type(e).__name__}: {e}"
+        await asyncio.shield(asyncio.to_thread(evaluation_queue.fail_job, db, worker_id, id_appel, error))
+        raise
+    await asyncio.to_thread(evaluation_queue.complete_jobs, db, worker_id, [id_appel])
+    logger.info(f"Appel {id_appel} évalué ({compact.tokens_before} -> {compact.tokens_after} jetons de transcription"
+                f"{', depuis le cache' if from_cache else ''}).")
+    return True
+
+
+def create_llm() -> ChatGoogleGenerativeAI:
+    return ChatGoogleGenerativeAI(model=EVALUATION_MODEL, temperature=0.2)
+
+
+# --- Doublure locale du LLM pour les essais (--simulate) ---
+
+class FakeRateLimitError(Exception):
+    status_code = 429
+
+
+class FakeLLM:
+    """
+    LLM local : latence aléatoire, refus 429 quand plus de `max_requests_per_minute` requêtes
+    arrivent sur une fenêtre glissante d'une minute (comme un quota d'API), réponse JSON valide.
+    Les requêtes groupées reçoivent un tableau, dont une part `batch_drop_rate` des éléments est
+    omise pour exercer la reprise unitaire ; leur latence croît avec le nombre d'appels (sortie plus longue).
+    """
+
+    def __init__(self, latency: float = 0.5, max_requests_per_minute: float = 0, batch_drop_rate: float = 0.0):
+        self.latency = latency
+        self.max_requests_per_minute = max_requests_per_minute
+        self.batch_drop_rate = batch_drop_rate
+        self.calls = 0
+        self.rejected = 0
+        self._recent: List[float] = []
+
+    async def ainvoke(self, prompt: str):
+        now = time.monotonic()
+        if self.max_requests_per_minute:
+            self._recent = [t for t in self._recent if now - t < 60]
+            if len(self._recent) >= self.max_requests_per_minute:
+                self.rejected += 1
+                raise FakeRateLimitError("429 Resource exhausted (simulation)")
+            self._recent.append(now)
+        self.calls += 1
+        batch_ids = [int(i) for i in re.findall(r"=== Appel (\d+) ===", prompt)]
+        await asyncio.sleep(self.latency * (0.5 + 0.5 * max(1, len(batch_ids))) * random.uniform(0.5, 1.5))
+        evaluation = {
+            "resume_evaluation": f"Résumé simulé ({estimate_tokens(prompt)} jetons).",
+            "conformite": "Conforme (simulation).",
+            "points_amelioration": "Aucun (simulation).",
+        }
+        if not batch_ids:
+            return SimpleNamespace(content=json.dumps(evaluation, ensure_ascii=False))
+        items = [dict(evaluation, id_appel=i) for i in batch_ids if random.random() >= self.batch_drop_rate]
+        return SimpleNamespace(content="```json\n" + json.dumps(items, ensure_ascii=False) + "\n```")
+
+
+def run_simulation(count: int, args) -> EvaluationStats:
+    def transcription(id_appel: int) -> str:
+        # Surtout des appels courts, quelques longs.
+        turns = 40 if id_appel % 10 == 0 else 4 + id_appel % 6
+        return json.dumps([{"type": "message", "role": "user" if t % 2 else "assistant",
+                            "content": ["Bonjour, je voudrais déclarer un sinistre pour mon véhicule."]} for t in range(turns)],
+                          ensure_ascii=False)
+
+    saved: List[EvaluationRow] = []
+
+    def save(batch: List[EvaluationRow]) -> int:
+        saved.extend(batch)
+        return len(batch)
+
+    llm = FakeLLM(latency=args.fake_latency, max_requests_per_minute=args.fake_quota, batch_drop_rate=args.fake_batch_drop)
+    stats = asyncio.run(run_pipeline(
+        chunked(list(range(1, count + 1))), lambda ids: {i: transcription(i) for i in ids}, save, llm,
+        concurrency=args.concurrency, requests_per_minute=args.rpm, tokens_per_minute=args.tpm,
+        write_batch_size=args.batch_size, total=count,
+        batch_tokens=args.batch_tokens, batch_max_calls=args.batch_max_calls,
+    ))
+    logger.info(f"Simulation : {llm.calls} requêtes LLM, {llm.rejected} refus 429, {len(saved)} évaluations écrites.")
+    return stats
 
 
 if __name__ == '__main__':
     load_dotenv()
 
+    parser = argparse.ArgumentParser(description="Évaluation et résumé des appels en attente par le LLM.")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY, help="Évaluations simultanées au plus.")
+    parser.add_argument("--rpm", type=float, default=DEFAULT_REQUESTS_PER_MINUTE, help="Requêtes LLM par minute.")
+    parser.add_argument("--tpm", type=float, default=DEFAULT_TOKENS_PER_MINUTE, help="Jetons LLM par minute (0 = sans limite).")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_WRITE_BATCH_SIZE, help="Évaluations par écriture en base.")
+    parser.add_argument("--limit", type=int, default=None, help="Nombre maximal d'appels à traiter.")
+    parser.add_argument("--follow", action="store_true", help="Continuer à attendre de nouveaux jobs quand la file est vide.")
+    parser.add_argument("--batch-tokens", type=int, default=DEFAULT_BATCH_TOKENS,
+                        help="Mode par lots : jetons de transcription par requête (0 = une requête par appel).")
+    parser.add_argument("--batch-max-calls", type=int, default=DEFAULT_BATCH_MAX_CALLS, help="Appels par requête groupée au plus.")
+    parser.add_argument("--rescore", action="store_true",
+                        help="Remettre en file les appels évalués avec une autre version du prompt ou un autre modèle.")
+    parser.add_argument("--no-cache", action="store_true", help="Ignorer le cache des évaluations.")
+    parser.add_argument("--worker-id", default=evaluation_queue.default_worker_id(), help="Identifiant de cet évaluateur.")
+    parser.add_argument("--simulate", type=int, default=0, metavar="N", help="N appels fictifs, LLM et base simulés.")
+    parser.add_argument("--fake-latency", type=float, default=0.5, help="Latence moyenne du LLM simulé (s).")
+    parser.add_argument("--fake-quota", type=float, default=0, help="Quota req/min du LLM simulé (0 = aucun).")
+    parser.add_argument("--fake-batch-drop", type=float, default=0.05,
+                        help="Part des appels omis par le LLM simulé dans ses réponses groupées.")
+    args = parser.parse_args()
+
+    if args.simulate:
+        run_simulation(args.simulate, args)
+        exit(0)
+
     try:
         db_params = {
             'host': os.getenv("DB_HOST"), 'user': os.getenv("DB_USER"),
@@ -78,7 +628,7 @@ if __name__ == '__main__':
         exit(1)
 
     try:
-        llm = ChatGoogleGenerativeAI(model="gemini-2.5-flash-lite", temperature=0.2)
+        llm = create_llm()
     except Exception as e:
         logger.critical(f"Impossible d'initialiser le modèle LLM. Vérifiez votre clé d'API Google. Erreur: {e}")
         exit(1)
@@ -86,28 +636,23 @@ if __name__ == '__main__':
     db_driver = ExtranetDatabaseDriver()
 
     try:
-        with db_driver._get_connection() as conn:
-            cursor = conn.cursor(dictionary=True)
-            query = """
-                SELECT id_appel FROM journal_appels 
-                WHERE (resume_appel IS NULL OR resume_appel LIKE '%Erreur%' OR resume_appel LIKE '%Non généré%')
-                  AND (transcription_complete IS NOT NULL AND transcription_complete != '[]')
-            """
-            cursor.execute(query)
-            appels_a_evaluer = cursor.fetchall()
-            
-            if not appels_a_evaluer:
-                logger.info("Aucun nouvel appel à évaluer.")
-            else:
-                logger.info(f"Trouvé {len(appels_a_evaluer)} appel(s) à traiter.")
-                for appel in appels_a_evaluer:
-                    evaluate_and_summarize_call(appel['id_appel'], db_driver, llm)
-                    
-                    # --- AJOUT DE LA PAUSE ICI ---
-                    logger.info("Pause de 1 secondes pour respecter les quotas de l'API...")
-                    time.sleep(1)
-                    # --- FIN DE L'AJOUT ---
-        
+        if args.rescore:
+            count = evaluation_queue.enqueue_stale(db_driver, PERFORMANCE_EVALUATION_PROMPT_VERSION, EVALUATION_MODEL)
+            logger.info(f"Réévaluation : {count} ligne(s) de file affectée(s) (prompt v{PERFORMANCE_EVALUATION_PROMPT_VERSION}, {EVALUATION_MODEL}).")
+        cache = None if args.no_cache else EvaluationCache()
+        logger.info(f"Évaluateur {args.worker_id} : traitement de la file des évaluations...")
+        stats = asyncio.run(run_pipeline(
+            claimed_batches(db_driver, args.worker_id, args.concurrency, args.limit, args.follow),
+            lambda ids: fetch_transcriptions(db_driver, ids),
+            lambda batch: save_and_complete(db_driver, args.worker_id, batch),
+            llm,
+            concurrency=args.concurrency, requests_per_minute=args.rpm, tokens_per_minute=args.tpm,
+            write_batch_size=args.batch_size,
+            on_failed=lambda id_appel, error, retry: evaluation_queue.fail_job(db_driver, args.worker_id, id_appel, error, retry),
+            cache=cache, batch_tokens=args.batch_tokens, batch_max_calls=args.batch_max_calls,
+        ))
+        if not stats.done + stats.skipped + stats.failed:
+            logger.info("Aucun nouvel appel à évaluer.")
         logger.info("Processus d'évaluation terminé.")
     except Exception as e:
-        logger.error(f"Le processus principal d'évaluation a échoué: {e}", exc_info=True)
\ No newline at end of file
+        logger.error(f"Le processus principal d'évaluation a échoué: {e}", exc_info=True)
@@ -0,0 +1,366 @@
+# post_call.py
+#
+# Traitements post-appel (évaluation LLM, etc.) déclenchés par la fin de l'appel au lieu d'un
+# batch lancé à la main : le crochet d'arrêt de agent.py dépose une tâche par étape dans une file
+# locale durable (SQLite, POST_CALL_QUEUE_FILE), et un processeur exécute les étapes avec une
+# concurrence bornée et des nouvelles tentatives (backoff exponentiel).
+#
+# Le processeur tourne dans le processus principal du worker (start_post_call_worker, désactivable
+# avec POST_CALL_PROCESSING=0) ou à part sur la même machine : python post_call.py run
+# Les tâches survivent à un redémarrage ; une tâche en cours dont le processeur a disparu est
+# reprise à l'expiration de son bail.
+#
+# Nouvelle étape : décorer une coroutine `async def etape(task: PostCallTask)` avec @post_call_stage("nom").
+# Une étape sans rien à faire (ex. évaluation déjà traitée ailleurs) retourne STAGE_SKIPPED : la tâche
+# est close sans être comptée comme une réussite.
+
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, List, Optional, Sequence
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_QUEUE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "post_call_queue.sqlite3")
+POLL_SECONDS = float(os.getenv("POST_CALL_POLL_SECONDS", "1"))
+DEFAULT_CONCURRENCY = int(os.getenv("POST_CALL_CONCURRENCY", "4"))
+RETRY_BASE_SECONDS = 10
+RETRY_MAX_SECONDS = 900
+LEASE_MARGIN_SECONDS = 60 # Ajouté au timeout de l'étape pour le bail d'une tâche en cours
+KEEP_FINISHED_HOURS = 72
+STAGE_SKIPPED = "ignoree"
+
+POST_CALL_TASKS = metrics.REGISTRY.counter("artex_post_call_tasks", "Étapes post-appel exécutées, par étape et issue.", ["etape", "issue"])
+POST_CALL_DELAY = metrics.REGISTRY.histogram(
+    "artex_post_call_delay_seconds", "Délai entre la fin de l'appel et la réussite de l'étape.", ["etape"],
+    buckets=(1, 2.5, 5, 10, 30, 60, 300, 900, 3600),
+)
+
+
+@dataclass
+class PostCallTask:
+    id_tache: int
+    id_appel: int
+    job_id: Optional[str]
+    etape: str
+    tentatives: int
+    payload: Dict
+    cree_le: float
+
+
+@dataclass
+class _Stage:
+    name: str
+    func: Callable[[PostCallTask], Awaitable[Optional[str]]]
+    max_attempts: int
+    timeout: float
+
+
+_stages: Dict[str, _Stage] = {}
+
+
+def post_call_stage(name: str, max_attempts: int = 3, timeout: float = 180.0):
+    """Enregistre une étape post-appel, exécutée pour chaque appel terminé."""
+    def decorator(func):
+        _stages[name] = _Stage(name, func, max_attempts, timeout)
+        return func
+    return decorator
+
+
+def registered_stages() -> List[str]:
+    return list(_stages)
+
+
+# --- File durable ---
+
+class PostCallStore:
+    """File de tâches post-appel dans une base SQLite locale (mode WAL, plusieurs processus possibles)."""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS taches_post_appel (
+            id_tache INTEGER PRIMARY KEY AUTOINCREMENT,
+            id_appel INTEGER NOT NULL,
+            job_id TEXT,
+            etape TEXT NOT NULL,
+            statut TEXT NOT NULL DEFAULT 'en_attente', -- en_attente, en_cours, termine, echec
+            tentatives INTEGER NOT NULL DEFAULT 0,
+            disponible_a REAL NOT NULL, -- en_cours : fin du bail
+            payload TEXT,
+            derniere_erreur TEXT,
+            cree_le REAL NOT NULL,
+            modifie_le REAL NOT NULL,
+            UNIQUE (id_appel, etape)
+        );
+        CREATE INDEX IF NOT EXISTS idx_taches_post_appel_reservation ON taches_post_appel (statut, disponible_a);
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or os.getenv("POST_CALL_QUEUE_FILE", DEFAULT_QUEUE_FILE)
+        with self._connection() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(self.SCHEMA)
+
+    @contextmanager
+    def _connection(self):
+        # Connexion courte par opération (mode autocommit) : utilisable depuis n'importe quel thread ou processus.
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            conn.execute("PRAGMA synchronous=NORMAL")
+            yield conn
+        finally:
+            conn.close()
+
+    def enqueue(self, id_appel: int, stages: Sequence[str], job_id: Optional[str] = None,
+                payload: Optional[Dict] = None) -> int:
+        """Une tâche par étape ; une étape déjà en file pour cet appel n'est pas dupliquée."""
+        now = time.time()
+        data = json.dumps(payload or {}, ensure_ascii=False, default=str)
+        with self._connection() as conn:
+            cursor = conn.executemany(
+                "INSERT OR IGNORE INTO taches_post_appel (id_appel, job_id, etape, disponible_a, payload, cree_le, modifie_le) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(id_appel, job_id, stage, now, data, now, now) for stage in stages],
+            )
+            return cursor.rowcount
+
+    def claim(self, limit: int) -> List[PostCallTask]:
+        """Réserve jusqu'à `limit` tâches disponibles (en attente, ou en cours avec un bail expiré)."""
+        now = time.time()
+        with self._connection() as conn:
+            conn.execute("BEGIN IMMEDIATE") # Verrou d'écriture : deux processeurs ne réservent pas la même tâche
+            rows = conn.execute(
+                "SELECT id_tache, id_appel, job_id, etape, tentatives, payload, cree_le FROM taches_post_appel "
+                "WHERE statut IN ('en_attente', 'en_cours') AND disponible_a <= ? ORDER BY disponible_a LIMIT ?",
+                (now, limit),
+            ).fetchall()
+            tasks = []
+            for id_tache, id_appel, job_id, etape, tentatives, payload, cree_le in rows:
+                stage = _stages.get(etape)
+                lease = (stage.timeout if stage else 0) + LEASE_MARGIN_SECONDS
+                conn.execute(
+                    "UPDATE taches_post_appel SET statut = 'en_cours', tentatives = tentatives + 1, "
+                    "disponible_a = ?, modifie_le = ? WHERE id_tache = ?",
+                    (now + lease, now, id_tache),
+                )
+                tasks.append(PostCallTask(id_tache, id_appel, job_id, etape, tentatives + 1, json.loads(payload or "{}"), cree_le))
+            conn.execute("COMMIT") # Sans COMMIT (exception), la fermeture de la connexion annule la transaction
+            return tasks
+
+    def _finish(self, id_tache: int, statut: str, error: Optional[str] = None, delay: float = 0):
+        now = time.time()
+        with self._connection() as conn:
+            conn.execute(
+                "UPDATE taches_post_appel SET statut = ?, derniere_erreur = ?, disponible_a = ?, modifie_le = ? WHERE id_tache = ?",
+                (statut, error[:2000] if error else None, now + delay, now, id_tache),
+            )
+
+    def complete(self, id_tache: int):
+        self._finish(id_tache, 'termine')
+
+    def retry(self, id_tache: int, error: str, delay: float):
+        self._finish(id_tache, 'en_attente', error, delay)
+
+    def fail(self, id_tache: int, error: str):
+        self._finish(id_tache, 'echec', error)
+
+    def purge(self, older_than_hours: float = KEEP_FINISHED_HOURS) -> int:
+        with self._connection() as conn:
+            return conn.execute(
+                "DELETE FROM taches_post_appel WHERE statut IN ('termine', 'echec') AND modifie_le < ?",
+                (time.time() - older_than_hours * 3600,),
+            ).rowcount
+
+    def counts(self) -> Dict[str, int]:
+        with self._connection() as conn:
+            return dict(conn.execute("SELECT statut, COUNT(*) FROM taches_post_appel GROUP BY statut").fetchall())
+
+    def pending(self) -> int:
+        with self._connection() as conn:
+            return conn.execute("SELECT COUNT(*) FROM taches_post_appel WHERE statut IN ('en_attente', 'en_cours')").fetchone()[0]
+
+
+# --- Processeur ---
+
+def retry_delay(attempts: int) -> float:
+    return min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * 2 ** max(0, attempts - 1))
+
+
+class PostCallProcessor:
+    """Exécute les tâches de la file, `concurrency` à la fois au plus."""
+
+    def __init__(self, store: PostCallStore, concurrency: int = DEFAULT_CONCURRENCY):
+        self.store = store
+        self.concurrency = concurrency
+        self._running: set = set()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._stopping = False
+
+    def notify(self):
+        """Réveille le processeur (tâche déposée dans ce processus) sans attendre le prochain sondage."""
+        if self._loop is not None and self._wake is not None:
+            self._loop.call_soon_threadsafe(self._wake.set)
+
+    def stop(self):
+        self._stopping = True
+        self.notify()
+
+    async def run(self):
+        self._loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        last_purge = 0.0
+        logger.info(f"Processeur post-appel démarré (étapes : {', '.join(_stages) or 'aucune'}, concurrence {self.concurrency}).")
+        while not self._stopping:
+            free = self.concurrency - len(self._running)
+            if free > 0:
+                try:
+                    for task in await asyncio.to_thread(self.store.claim, free):
+                        running = asyncio.create_task(self._execute(task))
+                        self._running.add(running)
+                        running.add_done_callback(self._task_done)
+                except Exception as e:
+                    logger.error(f"Lecture de la file post-appel impossible : {e}", exc_info=True)
+            if time.time() - last_purge > 3600:
+                last_purge = time.time()
+                await asyncio.to_thread(self.store.purge)
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+        if self._running:
+            await asyncio.gather(*self._running, return_exceptions=True)
+
+    def _task_done(self, task: asyncio.Task):
+        self._running.discard(task)
+        self.notify() # Une place s'est libérée
+
+    async def _execute(self, task: PostCallTask):
+        stage = _stages.get(task.etape)
+        if stage is None:
+            await asyncio.to_thread(self.store.fail, task.id_tache, f"Étape inconnue : {task.etape}")
+            return
+        prefix = f"[{task.job_id or '-'}] Appel {task.id_appel}, étape '{task.etape}'"
+        try:
+            result = await asyncio.wait_for(stage.func(task), stage.timeout)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            if task.tentatives >= stage.max_attempts:
+                POST_CALL_TASKS.labels(task.etape, "echec").inc()
+                logger.error(f"{prefix} abandonnée après {task.tentatives} tentative(s) : {error}", exc_info=True)
+                await asyncio.to_thread(self.store.fail, task.id_tache, error)
+            else:
+                POST_CALL_TASKS.labels(task.etape, "nouvelle_tentative").inc()
+                delay = retry_delay(task.tentatives)
+                logger.warning(f"{prefix} en échec ({error}), nouvelle tentative dans {delay:.0f} s.")
+                await asyncio.to_thread(self.store.retry, task.id_tache, error, delay)
+            return
+        if result == STAGE_SKIPPED:
+            POST_CALL_TASKS.labels(task.etape, STAGE_SKIPPED).inc()
+            await asyncio.to_thread(self.store.complete, task.id_tache)
+            logger.info(f"{prefix} sans objet, close.")
+            return
+        POST_CALL_TASKS.labels(task.etape, "succes").inc()
+        POST_CALL_DELAY.labels(task.etape).observe(time.time() - task.cree_le)
+        await asyncio.to_thread(self.store.complete, task.id_tache)
+        logger.info(f"{prefix} terminée ({time.time() - task.cree_le:.1f} s après la fin de l'appel).")
+
+
+_store: Optional[PostCallStore] = None
+_processor: Optional[PostCallProcessor] = None
+_processor_pid: Optional[int] = None
+_lock = threading.Lock()
+
+
+def get_store() -> PostCallStore:
+    global _store
+    with _lock:
+        if _store is None:
+            _store = PostCallStore()
+        return _store
+
+
+def enqueue_post_call(id_appel: int, job_id: Optional[str] = None, stages: Optional[Sequence[str]] = None,
+                      payload: Optional[Dict] = None) -> int:
+    """Dépose les étapes post-appel de `id_appel` (toutes les étapes enregistrées par défaut)."""
+    count = get_store().enqueue(id_appel, stages or registered_stages(), job_id, payload)
+    if _processor is not None and _processor_pid == os.getpid():
+        _processor.notify() # Sinon (processus d'appel), le processeur du worker la verra au prochain sondage
+    return count
+
+
+def start_post_call_worker(concurrency: Optional[int] = None) -> Optional[PostCallProcessor]:
+    """Démarre (une fois) le processeur dans un thread dédié avec sa propre boucle asyncio."""
+    global _processor, _processor_pid
+    if os.getenv("POST_CALL_PROCESSING", "1").lower() in ("0", "false", "no", "off"):
+        return None
+    with _lock:
+        if _processor is not None and _processor_pid == os.getpid():
+            return _processor
+        _processor = PostCallProcessor(PostCallStore() if _store is None else _store, concurrency or DEFAULT_CONCURRENCY)
+        _processor_pid = os.getpid()
+    metrics.QUEUE_DEPTH.labels("post_appel").set_function(lambda: _processor.store.pending())
+    threading.Thread(target=asyncio.run, args=(_processor.run(),), name="post-call", daemon=True).start()
+    return _processor
+
+
+# --- Étapes fournies ---
+
+_evaluation_context = None
+
+
+def _get_evaluation_context():
+    """Driver BD, client LLM, limiteur de débit et cache partagés par toutes les évaluations du processus."""
+    global _evaluation_context
+    if _evaluation_context is None:
+        import performance_eval # Import tardif : client LLM inutile dans les processus d'appel
+        from db_driver import ExtranetDatabaseDriver
+        from rate_limiter import AsyncRateLimiter
+        from evaluation_cache import EvaluationCache
+        import evaluation_queue
+        _evaluation_context = (
+            performance_eval,
+            ExtranetDatabaseDriver(),
+            performance_eval.create_llm(),
+            AsyncRateLimiter(performance_eval.DEFAULT_REQUESTS_PER_MINUTE, performance_eval.DEFAULT_TOKENS_PER_MINUTE),
+            f"post-appel-{evaluation_queue.default_worker_id()}",
+            EvaluationCache(),
+        )
+    return _evaluation_context
+
+
+@post_call_stage("evaluation", max_attempts=3, timeout=300.0)
+async def evaluation_stage(task: PostCallTask):
+    """Résumé et évaluation LLM de l'appel, écrits dans journal_appels quelques secondes après la fin."""
+    performance_eval, db, llm, limiter, worker_id, cache = _get_evaluation_context()
+    if not await performance_eval.evaluate_and_store_call(db, llm, limiter, task.id_appel, worker_id, cache):
+        return STAGE_SKIPPED # Pas de job disponible ou transcription invalide : rien d'évalué
+
+
+if __name__ == "__main__":
+    import argparse
+    from dotenv import load_dotenv
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="File des traitements post-appel.")
+    parser.add_argument("commande", choices=["run", "status"])
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY)
+    args = parser.parse_args()
+
+    if args.commande == "status":
+        for status, count in sorted(get_store().counts().items()):
+            logger.info(f"{status:<12} {count}")
+    else:
+        try:
+            asyncio.run(PostCallProcessor(get_store(), args.concurrency).run())
+        except KeyboardInterrupt:
+            pass
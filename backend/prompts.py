@@ -86,6 +86,9 @@ INSTRUCTIONS = (
     - **`get_product_guarantees`**
         - **Contexte :** Récupère les garanties détaillées pour un nom de produit spécifique et exact.
         - **Quand l'appeler ?** **Uniquement** après avoir utilisé `list_available_products` et que le prospect a choisi un des produits de la liste.
+    - **`rechercher_documentation_produit`**
+        - **Contexte :** Recherche dans la documentation officielle des produits (fiches produit, IPID, notices) les passages répondant à une question précise.
+        - **Quand l'appeler ?** Quand une question porte sur un détail (exclusion, délai de carence, condition) que `get_product_guarantees` ne couvre pas.
     - **`qualifier_prospect_pour_conseiller`**
         - **Contexte :** Collecte les informations d'un prospect (nom, téléphone, besoins, budget) et envoie une notification interne pour qu'un conseiller prépare un devis et rappelle.
         - **Quand l'appeler ?** C'est l'action finale du parcours prospect, après avoir suivi la séquence de questions de l'ÉTAPE 2B.
@@ -136,7 +139,23 @@ WELCOME_MESSAGE = (
     "Bonjour, vous êtes en communication avec ARIA, votre assistante chez ARTEX Assurances. En quoi puis-je vous aider aujourd'hui ?"
 )
 
+# Appel sortant d'une campagne de rappels (campaign_dialer.py), quand l'appelé n'est pas pré-identifié.
+CALLBACK_MESSAGE = (
+    "Bonjour, ARIA, votre assistante chez ARTEX Assurances. Je vous rappelle suite à votre demande. En quoi puis-je vous aider ?"
+)
+
+# Appel en débordement (tous les agents occupés, SIP_OVERFLOW_ACTION=message) : annonce puis raccroché.
+OVERFLOW_BUSY_MESSAGE = (
+    "Bonjour, vous êtes bien chez ARTEX Assurances. Tous nos conseillers sont actuellement occupés. "
+    "Merci de renouveler votre appel dans quelques minutes. Au revoir."
+)
+
 # --- Prompt d'Évaluation (Mis à jour pour vérifier l'usage des outils) ---
+# À incrémenter à chaque modification du prompt (ou du prompt par lots ci-dessous, qui applique les
+# mêmes critères) : la version est enregistrée avec chaque évaluation
+# et fait partie de la clé du cache des évaluations (performance_eval.py --rescore réévalue les appels
+# notés avec une autre version).
+PERFORMANCE_EVALUATION_PROMPT_VERSION = "1"
 PERFORMANCE_EVALUATION_PROMPT = (
     """
     Vous êtes un auditeur qualité pour un centre d'appel d'assurance.
@@ -157,4 +176,27 @@ PERFORMANCE_EVALUATION_PROMPT = (
     ---
     Produisez uniquement la sortie JSON.
     """
-)
\ No newline at end of file
+)
+
+# --- Prompt d'Évaluation par lots (plusieurs appels courts dans une seule requête) ---
+# Mêmes critères que PERFORMANCE_EVALUATION_PROMPT ; {appels} reçoit les transcriptions précédées
+# de « === Appel <id> === ».
+PERFORMANCE_EVALUATION_BATCH_PROMPT = (
+    """
+    Vous êtes un auditeur qualité pour un centre d'appel d'assurance.
+    Votre tâche est d'analyser, indépendamment les unes des autres, les transcriptions de plusieurs appels entre l'agent IA (ARIA) et des clients.
+    Pour chaque appel, évaluez la performance de l'IA sur les critères suivants :
+    1.  **Conformité** : L'IA a-t-elle suivi les procédures obligatoires (triage, qualification, feedback) ? A-t-elle appelé les outils aux moments clés ?
+    2.  **Précision** : Les informations fournies par l'IA étaient-elles correctes et basées sur les outils ?
+    3.  **Efficacité** : Le problème du client a-t-il été résolu rapidement ?
+    4.  **Ton et Empathie** : Le ton de l'IA était-il approprié et empathique ?
+
+    Fournissez un tableau JSON contenant un objet par appel, avec la clé "id_appel" (l'identifiant indiqué dans l'en-tête de l'appel) et les clés "conformite", "precision", "efficacite", "ton_empathie", une "note_globale" (de 1 à 5), "resume_evaluation" avec un bref résumé de vos conclusions et "points_amelioration" pour les suggestions.
+
+    **Point d'attention critique : Vérifiez si l'agent a SIMULÉ une action (ex: "J'envoie un email") sans appeler l'outil correspondant. Si c'est le cas, la note de conformité doit être basse.**
+
+    Voici les transcriptions à analyser :
+    {appels}
+    Produisez uniquement le tableau JSON, avec exactement un objet par appel.
+    """
+)
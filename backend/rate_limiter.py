@@ -0,0 +1,116 @@
+# rate_limiter.py
+#
+# Limiteur de débit asynchrone à seaux de jetons, pour les appels aux API externes (LLM, SIP...).
+# Deux seaux indépendants : requêtes par minute et jetons (tokens LLM) par minute.
+# Le débit s'adapte aux refus du fournisseur (HTTP 429) : division par deux à chaque refus,
+# puis remontée progressive vers le débit configuré tant que les requêtes aboutissent (AIMD).
+
+import asyncio
+import logging
+import time
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+class _TokenBucket:
+    """Seau de jetons : `capacity` jetons au plus, rechargé à `rate` jetons par seconde."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self._updated_at = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Secondes à attendre avant de pouvoir prélever `amount` (0 si disponible tout de suite)."""
+        self._refill(now)
+        # Une demande plus grosse que le seau est servie dès qu'il est plein, sans bloquer indéfiniment.
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def take(self, amount: float):
+        self.tokens -= min(amount, self.capacity)
+
+
+class AsyncRateLimiter:
+    """
+    Limite le débit à `requests_per_minute` requêtes et `tokens_per_minute` jetons (0 = pas de limite).
+    Usage :
+        await limiter.acquire(tokens=estimation)
+        ... appel ...
+        limiter.on_success()  /  limiter.on_rate_limited(retry_after)
+    """
+
+    def __init__(self, requests_per_minute: float, tokens_per_minute: float = 0,
+                 min_fraction: float = 0.05, recovery_step: float = 0.02, burst_seconds: float = 1.0):
+        self.max_requests_per_minute = requests_per_minute
+        self.max_tokens_per_minute = tokens_per_minute
+        self.min_fraction = min_fraction
+        self.recovery_step = recovery_step
+        self.burst_seconds = burst_seconds
+        self.fraction = 1.0 # Part du débit configuré actuellement autorisée
+        self.rate_limited_count = 0
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+        self._requests = self._make_bucket(requests_per_minute)
+        self._tokens = self._make_bucket(tokens_per_minute)
+
+    def _make_bucket(self, per_minute: float) -> Optional[_TokenBucket]:
+        if not per_minute or per_minute <= 0:
+            return None
+        rate = per_minute / 60.0
+        # Rafale limitée à `burst_seconds` de débit (au moins une unité) pour lisser le démarrage.
+        return _TokenBucket(rate, max(1.0, rate * self.burst_seconds))
+
+    def _apply_fraction(self):
+        for bucket, per_minute in ((self._requests, self.max_requests_per_minute), (self._tokens, self.max_tokens_per_minute)):
+            if bucket is not None:
+                bucket.rate = per_minute / 60.0 * self.fraction
+
+    @property
+    def current_requests_per_minute(self) -> float:
+        return self.max_requests_per_minute * self.fraction
+
+    async def acquire(self, tokens: float = 0):
+        """Attend que la requête (et ses `tokens` estimés) tienne dans les limites, puis la compte."""
+        # Le verrou sert les demandes dans l'ordre d'arrivée : une grosse demande n'est pas affamée.
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                wait = max(0.0, self._paused_until - now)
+                if self._requests is not None:
+                    wait = max(wait, self._requests.wait_time(1, now))
+                if self._tokens is not None and tokens:
+                    wait = max(wait, self._tokens.wait_time(tokens, now))
+                if wait <= 0:
+                    break
+                await asyncio.sleep(wait)
+            if self._requests is not None:
+                self._requests.take(1)
+            if self._tokens is not None and tokens:
+                self._tokens.take(tokens)
+
+    def on_success(self):
+        """Requête acceptée : remontée additive du débit vers le maximum configuré."""
+        if self.fraction < 1.0:
+            self.fraction = min(1.0, self.fraction + self.recovery_step)
+            self._apply_fraction()
+
+    def on_rate_limited(self, retry_after: Optional[float] = None):
+        """Refus du fournisseur (429) : débit divisé par deux et pause éventuelle (en-tête Retry-After)."""
+        self.rate_limited_count += 1
+        self.fraction = max(self.min_fraction, self.fraction / 2)
+        self._apply_fraction()
+        if retry_after:
+            self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+        logger.warning(
+            f"Limite de débit atteinte côté fournisseur : débit ramené à "
+            f"{self.current_requests_per_minute:.1f} requêtes/min."
+        )
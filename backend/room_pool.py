@@ -0,0 +1,138 @@
+# room_pool.py
+#
+# Pool de salles LiveKit créées à l'avance pour le webhook SIP entrant (inbound_sip_handler.py).
+# Sans pool, chaque webhook attend un aller-retour CreateRoom avant de pouvoir router l'appelant ;
+# avec le pool, il prend une salle déjà créée (claim, sans I/O) et une tâche de fond recomplète le pool.
+# Si le pool est vide (pic d'appels, LiveKit indisponible), le webhook revient à la création synchrone.
+#
+# LiveKit ferme une salle restée vide `empty_timeout` secondes après sa création : une salle du pool
+# n'est plus distribuée au-delà de `max_age` (à régler sous empty_timeout) et est simplement abandonnée.
+#
+# À n'activer qu'avec un dispatch explicite de l'agent (AGENT_NAME, voir agent.py ; le webhook dispatche
+# l'agent dans la salle de chaque appel) : en dispatch automatique, LiveKit démarre un job d'agent dès la
+# création de chaque salle du pool. inbound_sip_handler.py refuse de démarrer le pool sans AGENT_NAME.
+
+import asyncio
+import logging
+import time
+import uuid
+from collections import deque
+from typing import Awaitable, Callable, Deque, Optional, Tuple
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+WARM_ROOMS = metrics.REGISTRY.gauge("artex_sip_warm_rooms", "Salles LiveKit pré-créées disponibles.")
+WARM_ROOM_CLAIMS = metrics.REGISTRY.counter("artex_sip_warm_room_claims", "Demandes de salle au pool, par résultat.", ["resultat"])
+WARM_ROOMS_EXPIRED = metrics.REGISTRY.counter("artex_sip_warm_rooms_expired", "Salles du pool abandonnées car trop anciennes.")
+CREATE_ROOM_LATENCY = metrics.REGISTRY.histogram("artex_livekit_create_room_seconds", "Durée des appels CreateRoom à LiveKit.", ["origine"])
+
+RETRY_MAX_SECONDS = 30
+
+
+class WarmRoomPool:
+    """
+    `create_room(nom)` crée la salle côté LiveKit ; `size` salles sont maintenues prêtes,
+    au plus `refill_concurrency` créations simultanées.
+    """
+
+    def __init__(self, create_room: Callable[[str], Awaitable[object]], size: int, max_age: float,
+                 prefix: str = "sip-", refill_concurrency: int = 4, check_interval: float = 5.0):
+        self.create_room = create_room
+        self.size = size
+        self.max_age = max_age
+        self.prefix = prefix
+        self.refill_concurrency = max(1, refill_concurrency)
+        self.check_interval = check_interval
+        self._rooms: Deque[Tuple[str, float]] = deque() # (nom, créée à), la plus ancienne à gauche
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._hits = WARM_ROOM_CLAIMS.labels("pool")
+        self._misses = WARM_ROOM_CLAIMS.labels("vide")
+        self._create_latency = CREATE_ROOM_LATENCY.labels("pool")
+
+    @property
+    def available(self) -> int:
+        return len(self._rooms)
+
+    def start(self):
+        """Démarre le remplissage en tâche de fond (à appeler depuis la boucle du serveur)."""
+        if self._task is not None:
+            return
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._refill_loop(), name="warm_room_pool")
+        WARM_ROOMS.set_function(lambda: len(self._rooms))
+        logger.info(f"Pool de salles SIP démarré ({self.size} salles, durée de vie {self.max_age:.0f}s).")
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        # Les salles restantes sont fermées par LiveKit à l'expiration de leur empty_timeout.
+        self._rooms.clear()
+
+    async def wait_ready(self, timeout: float) -> bool:
+        """Attend que le pool soit plein (démarrage, tests de charge). Retourne False à l'expiration du délai."""
+        deadline = time.monotonic() + timeout
+        while len(self._rooms) < self.size:
+            if time.monotonic() >= deadline:
+                return False
+            await asyncio.sleep(0.05)
+        return True
+
+    def claim(self) -> Optional[str]:
+        """Retourne le nom d'une salle prête (la plus ancienne encore valide), ou None si le pool est vide."""
+        self._drop_expired()
+        if self._wakeup is not None:
+            self._wakeup.set()
+        if not self._rooms:
+            self._misses.inc()
+            return None
+        self._hits.inc()
+        return self._rooms.popleft()[0]
+
+    def _drop_expired(self):
+        limit = time.monotonic() - self.max_age
+        while self._rooms and self._rooms[0][1] < limit:
+            name, _ = self._rooms.popleft()
+            WARM_ROOMS_EXPIRED.inc()
+            logger.debug(f"Salle {name} retirée du pool (trop ancienne).")
+
+    async def _create_one(self):
+        name = f"{self.prefix}{uuid.uuid4().hex}"
+        with self._create_latency.time():
+            await self.create_room(name)
+        self._rooms.append((name, time.monotonic()))
+
+    async def _refill_loop(self):
+        failures = 0
+        while True:
+            self._drop_expired()
+            missing = self.size - len(self._rooms)
+            if missing > 0:
+                results = await asyncio.gather(
+                    *(self._create_one() for _ in range(min(missing, self.refill_concurrency))),
+                    return_exceptions=True,
+                )
+                errors = [r for r in results if isinstance(r, Exception)]
+                if not errors:
+                    failures = 0
+                    continue
+                failures += 1
+                delay = min(RETRY_MAX_SECONDS, 2 ** failures)
+                logger.warning(f"Création de salles pour le pool en échec ({len(errors)}/{len(results)}) : "
+                               f"{errors[0]}. Nouvel essai dans {delay}s.")
+                await asyncio.sleep(delay) # Les claims pendant l'incident ne raccourcissent pas le délai
+                continue
+            # Le pool est plein : réveil au prochain claim, ou périodiquement pour écarter les salles expirées.
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.check_interval)
+            except asyncio.TimeoutError:
+                pass
@@ -1,16 +1,23 @@
 import os
-from flask import Flask, request
-from dotenv import load_dotenv
-from flask_cors import CORS
-from livekit.api import LiveKitAPI, AccessToken, VideoGrants, ListRoomsRequest # Importations mises à jour
+import logging
 import uuid
-import os # Assurez-vous que os est importé pour getenv
+from contextlib import asynccontextmanager
+from dotenv import load_dotenv
+from fastapi import FastAPI, Request
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.wsgi import WSGIMiddleware
+from fastapi.responses import JSONResponse
+from flask import Flask
+from livekit.api import LiveKitAPI, AccessToken, VideoGrants, CreateRoomRequest
+import uvicorn
 
 # Importer le logger d'erreurs et sa fonction de configuration
 from error_logger import set_db_connection_params, log_system_error
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 # Configurer les paramètres de connexion pour le error_logger au démarrage
 # Ceci suppose que les mêmes variables d'environnement DB_* sont utilisées par db_driver et error_logger
 try:
@@ -26,61 +33,73 @@ try:
     set_db_connection_params(db_params_for_error_logger)
 except ValueError as ve:
     # Utiliser le logger standard Python si la configuration de error_logger échoue.
-    import logging
     logging.critical(f"Échec de la configuration des paramètres BD pour error_logger: {ve}. La journalisation des erreurs BD sera désactivée.")
 except Exception as e:
-    import logging
     logging.critical(f"Erreur inattendue lors de la configuration de error_logger: {e}. La journalisation des erreurs BD sera désactivée.")
 
+# Création explicite des salles générées (permet de fixer empty_timeout dès la création).
+# Désactivée par défaut : LiveKit crée la salle automatiquement à la première connexion.
+PRECREATE_ROOMS = os.getenv("LIVEKIT_PRECREATE_ROOMS", "0").lower() in ("1", "true", "oui")
+ROOM_EMPTY_TIMEOUT_SECONDS = int(os.getenv("LIVEKIT_ROOM_EMPTY_TIMEOUT", "300"))
 
-app = Flask(__name__)
-CORS(app, resources={r"/*": {"origins": "*"}})
-
-# Enregistrer le blueprint du tableau de bord
-from dashboard_api import dashboard_bp
-app.register_blueprint(dashboard_bp)
-
-async def generate_room_name():
-    name = "room-" + str(uuid.uuid4())[:8]
-    rooms = await get_rooms()
-    while name in rooms:
-        name = "room-" + str(uuid.uuid4())[:8]
-    return name
 
-async def get_rooms():
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Un seul client LiveKit (et sa session HTTP) pour toute la durée de vie du processus."""
     livekit_host = os.getenv("LIVEKIT_URL")
     livekit_api_key = os.getenv("LIVEKIT_API_KEY")
     livekit_api_secret = os.getenv("LIVEKIT_API_SECRET")
-
-    if not all([livekit_host, livekit_api_key, livekit_api_secret]):
-        print("Avertissement : L'URL du serveur LiveKit, la clé API ou le secret API ne sont pas entièrement configurés pour get_rooms.")
-        return [] # Retourner une liste vide car l'appel API échouera
-
-    # Utiliser l'importation directe de LiveKitAPI, ListRoomsRequest
-    lk_api = LiveKitAPI(host=livekit_host, api_key=livekit_api_key, api_secret=livekit_api_secret)
+    if all([livekit_host, livekit_api_key, livekit_api_secret]):
+        app.state.livekit_api = LiveKitAPI(livekit_host, livekit_api_key, livekit_api_secret)
+    else:
+        logger.warning("L'URL du serveur LiveKit, la clé API ou le secret API ne sont pas entièrement configurés : client LiveKit désactivé.")
+        app.state.livekit_api = None
     try:
-        rooms_response = await lk_api.room.list_rooms(ListRoomsRequest())
+        yield
     finally:
-        await lk_api.aclose()
-    
-    return [room.name for room in rooms_response.rooms]
+        if app.state.livekit_api is not None:
+            await app.state.livekit_api.aclose()
+
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"])
+
 
-@app.route("/create-token", methods=['POST'])
-async def get_token():
-    data = request.get_json()
+def generate_room_name() -> str:
+    """
+    Nom de salle aléatoire (UUID4 complet, 122 bits d'aléa) : une collision est improbable au point
+    qu'il n'est plus nécessaire de lister les salles existantes pour vérifier l'unicité.
+    """
+    return "room-" + uuid.uuid4().hex
+
+
+@app.post("/create-token")
+async def get_token(request: Request):
+    try:
+        data = await request.json()
+    except ValueError:
+        data = {}
+    data = data if isinstance(data, dict) else {}
     room_name = data.get("room_name")
     identity = data.get("identity", "default-identity") # Identité par défaut
 
-    if not room_name:
-        room_name = await generate_room_name() # Conserver la logique originale pour générer la salle si non fournie
-
     livekit_api_key = os.getenv("LIVEKIT_API_KEY")
     livekit_api_secret = os.getenv("LIVEKIT_API_SECRET")
 
     if not all([livekit_api_key, livekit_api_secret]): # L'hôte n'est pas strictement nécessaire pour la génération de token elle-même
-        return {"error": "La clé API ou le secret API LiveKit ne sont pas configurés"}, 500
+        return JSONResponse({"error": "La clé API ou le secret API LiveKit ne sont pas configurés"}, status_code=500)
+
+    if not room_name:
+        room_name = generate_room_name()
+        lk_api = request.app.state.livekit_api
+        if PRECREATE_ROOMS and lk_api is not None:
+            try:
+                await lk_api.room.create_room(CreateRoomRequest(name=room_name, empty_timeout=ROOM_EMPTY_TIMEOUT_SECONDS))
+            except Exception as e:
+                # La salle sera de toute façon créée à la connexion du participant.
+                logger.warning(f"Création anticipée de la salle {room_name} impossible : {e}")
+                log_system_error("server.get_token", f"Création anticipée de la salle impossible: {e}", e)
 
-    # Utiliser l'importation directe de AccessToken, VideoGrants
     token_builder = AccessToken(livekit_api_key, livekit_api_secret) \
         .with_identity(identity) \
         .with_name(identity) \
@@ -88,8 +107,16 @@ async def get_token():
             room_join=True,
             room=room_name
         ))
-    
+
     return {"token": token_builder.to_jwt()} # Retourner comme objet JSON
 
+
+# Enregistrer le blueprint du tableau de bord (Flask, synchrone) : servi via WSGI sous la même application.
+# Monté en dernier sur "/" pour que les routes FastAPI ci-dessus restent prioritaires.
+from dashboard_api import dashboard_bp
+dashboard_app = Flask(__name__)
+dashboard_app.register_blueprint(dashboard_bp)
+app.mount("/", WSGIMiddleware(dashboard_app))
+
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5001, debug=True)
\ No newline at end of file
+    uvicorn.run("server:app", host="0.0.0.0", port=5001)
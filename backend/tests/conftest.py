@@ -0,0 +1,7 @@
+# Les modules du backend s'importent à plat (import metrics, import campaign_dialer...) :
+# les tests se lancent depuis la racine du dépôt avec python -m pytest backend/tests.
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,98 @@
+import asyncio
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+import pytest
+
+from admission import AdmissionController
+
+
+class StubCapacityDb:
+    """Table agent_workers réduite à une ligne (workers, capacité, appels actifs)."""
+
+    def __init__(self, workers, capacity, active):
+        self.row = (workers, capacity, active)
+
+    @contextmanager
+    def _get_connection(self):
+        cursor = SimpleNamespace(execute=lambda query, params=None: None, fetchone=lambda: self.row)
+        yield SimpleNamespace(cursor=lambda: cursor)
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_unknown_capacity_admits_everything():
+    async def scenario():
+        controller = AdmissionController(StubCapacityDb(0, 0, 0))
+        await controller.refresh()
+        return [await controller.admit() for _ in range(5)]
+
+    assert all(decision.admitted for decision in run(scenario()))
+
+
+def test_admits_up_to_free_slots_then_overflows():
+    async def scenario():
+        controller = AdmissionController(StubCapacityDb(1, 4, 2), overflow_action="message", queue_timeout=0.05)
+        await controller.refresh()
+        decisions = [await controller.admit() for _ in range(3)]
+        return controller, decisions
+
+    controller, (first, second, third) = run(scenario())
+    assert first.admitted and second.admitted
+    assert not third.admitted
+    assert third.overflow_action == "message"
+    assert third.waited >= 0.04
+    assert controller.free_slots() == 0 # Deux réservations en attente de déclaration par les workers
+
+
+def test_queued_call_admitted_when_a_slot_frees():
+    async def scenario():
+        db = StubCapacityDb(1, 2, 2)
+        controller = AdmissionController(db, queue_timeout=2.0)
+        await controller.refresh()
+        waiting = asyncio.create_task(controller.admit())
+        await asyncio.sleep(0.05)
+        db.row = (1, 2, 1)
+        await controller.refresh()
+        return await waiting
+
+    decision = run(scenario())
+    assert decision.admitted
+    assert 0.04 <= decision.waited < 1.0
+
+
+def test_full_queue_overflows_immediately():
+    async def scenario():
+        controller = AdmissionController(StubCapacityDb(1, 1, 1), overflow_action="transfert", max_queue=0)
+        await controller.refresh()
+        return await controller.admit()
+
+    decision = run(scenario())
+    assert not decision.admitted
+    assert decision.overflow_action == "transfert"
+    assert decision.waited < 0.05
+
+
+def test_unreadable_capacity_disables_control():
+    class BrokenDb:
+        def _get_connection(self):
+            raise ConnectionError("BD indisponible")
+
+    async def scenario():
+        controller = AdmissionController(StubCapacityDb(1, 1, 1), max_queue=0)
+        await controller.refresh()
+        refused = await controller.admit()
+        controller.db = BrokenDb()
+        await controller.refresh()
+        return refused, await controller.admit()
+
+    refused, admitted = run(scenario())
+    assert not refused.admitted
+    assert admitted.admitted
+
+
+def test_unknown_overflow_action():
+    with pytest.raises(ValueError):
+        AdmissionController(StubCapacityDb(0, 0, 0), overflow_action="messagerie")
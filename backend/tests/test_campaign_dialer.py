@@ -0,0 +1,136 @@
+import asyncio
+from datetime import datetime
+from types import SimpleNamespace
+from zoneinfo import ZoneInfo
+
+import pytest
+from livekit import api
+
+import campaign_dialer
+from campaign_dialer import CallbackJob, CallingWindow, LiveKitSipClient, RateLimitedError, RetryPolicy
+
+PARIS = ZoneInfo("Europe/Paris")
+
+
+# --- LiveKitSipClient contre une doublure de l'API LiveKit ---
+
+class StubSip:
+    def __init__(self, error=None):
+        self.error = error
+        self.requests = []
+
+    async def create_sip_participant(self, request):
+        self.requests.append(request)
+        if self.error is not None:
+            raise self.error
+
+
+class StubRoom:
+    def __init__(self):
+        self.deleted = []
+
+    async def delete_room(self, request):
+        self.deleted.append(request.room)
+
+
+class StubDispatch:
+    def __init__(self):
+        self.rooms = []
+
+    async def create_dispatch(self, request):
+        self.rooms.append(request.room)
+
+
+def make_client(error=None, agent_name=""):
+    lk_api = SimpleNamespace(sip=StubSip(error), room=StubRoom(), agent_dispatch=StubDispatch())
+    return LiveKitSipClient(lk_api, "ST_trunk", agent_name), lk_api
+
+
+def sip_error(sip_status, code="unavailable", message="échec de l'appel"):
+    return api.TwirpError(code, message, status=503, metadata={"sip_status_code": str(sip_status)})
+
+
+def dial(client, room_name="rappel-1"):
+    return asyncio.run(client.dial(CallbackJob(1, "+33612345678", motif="Devis"), room_name))
+
+
+def test_dial_answered_keeps_room():
+    client, lk_api = make_client(agent_name="artex-agent")
+    assert dial(client) == (campaign_dialer.REPONDU, 200, None)
+    request = lk_api.sip.requests[0]
+    assert request.wait_until_answered
+    assert request.sip_call_to == "+33612345678"
+    assert lk_api.agent_dispatch.rooms == ["rappel-1"]
+    assert lk_api.room.deleted == []
+
+
+@pytest.mark.parametrize("sip_status, issue", [
+    (486, campaign_dialer.OCCUPE),
+    (480, campaign_dialer.PAS_DE_REPONSE),
+    (404, campaign_dialer.NUMERO_INVALIDE),
+    (603, campaign_dialer.REFUSE),
+    (500, campaign_dialer.ERREUR),
+])
+def test_dial_maps_sip_status_and_deletes_room(sip_status, issue):
+    client, lk_api = make_client(sip_error(sip_status))
+    assert dial(client) == (issue, sip_status, "échec de l'appel")
+    assert lk_api.room.deleted == ["rappel-1"]
+
+
+def test_dial_without_sip_status_is_an_error():
+    client, lk_api = make_client(api.TwirpError("internal", "panne", status=500))
+    assert dial(client) == (campaign_dialer.ERREUR, None, "panne")
+    assert lk_api.room.deleted == ["rappel-1"]
+
+
+def test_dial_resource_exhausted_raises_rate_limited():
+    client, lk_api = make_client(api.TwirpError("resource_exhausted", "quota", status=429))
+    with pytest.raises(RateLimitedError):
+        dial(client)
+    assert lk_api.room.deleted == ["rappel-1"]
+
+
+# --- Politique de nouvelles tentatives ---
+
+def test_retry_policy_decide():
+    policy = RetryPolicy(max_attempts=4)
+    assert policy.decide(campaign_dialer.REPONDU, 1) == ("joint", 0)
+    assert policy.decide(campaign_dialer.NUMERO_INVALIDE, 1) == ("abandonne", 0)
+    assert policy.decide(campaign_dialer.OCCUPE, 1) == ("en_attente", 600)
+    assert policy.decide(campaign_dialer.OCCUPE, 2) == ("en_attente", 1200)
+    assert policy.decide(campaign_dialer.OCCUPE, 4) == ("abandonne", 0)
+
+
+def test_retry_policy_caps_delay():
+    policy = RetryPolicy(max_attempts=10, max_delay=3600)
+    assert policy.decide(campaign_dialer.PAS_DE_REPONSE, 3) == ("en_attente", 3600)
+
+
+# --- Plages horaires ---
+
+def test_calling_window_open_now():
+    window = CallingWindow.parse("09:00-12:30,13:30-19:00")
+    when = datetime(2024, 3, 5, 10, 0, tzinfo=PARIS) # mardi
+    assert window.is_open(when)
+    assert window.next_open(when) == when
+    assert window.seconds_until_open(when) == 0
+
+
+def test_calling_window_next_open_after_lunch_break():
+    window = CallingWindow.parse("09:00-12:30,13:30-19:00")
+    when = datetime(2024, 3, 5, 12, 45, tzinfo=PARIS)
+    assert not window.is_open(when)
+    assert window.next_open(when) == datetime(2024, 3, 5, 13, 30, tzinfo=PARIS)
+
+
+def test_calling_window_next_open_skips_weekend():
+    window = CallingWindow.parse("09:00-12:30,13:30-19:00")
+    friday_evening = datetime(2024, 3, 8, 19, 0, tzinfo=PARIS)
+    assert window.next_open(friday_evening) == datetime(2024, 3, 11, 9, 0, tzinfo=PARIS)
+    assert window.seconds_until_open(friday_evening) == 62 * 3600
+
+
+def test_calling_window_converts_timezone():
+    window = CallingWindow.parse("09:00-18:00")
+    utc_morning = datetime(2024, 3, 5, 7, 30, tzinfo=ZoneInfo("UTC")) # 08:30 à Paris
+    assert window.next_open(utc_morning) == datetime(2024, 3, 5, 9, 0, tzinfo=PARIS)
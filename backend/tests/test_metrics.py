@@ -0,0 +1,66 @@
+import multiprocessing
+
+import metrics
+
+
+def test_render_prometheus_text():
+    counter = metrics.REGISTRY.counter("test_rendu", "Compteur de test.", ["outil"])
+    counter.labels("recherche").inc(3)
+    histogram = metrics.REGISTRY.histogram("test_rendu_seconds", "Histogramme de test.", buckets=(0.1, 1))
+    histogram.observe(0.05)
+    histogram.observe(0.5)
+    text = metrics.REGISTRY.render()
+    assert 'test_rendu_total{outil="recherche"} 3' in text
+    assert 'test_rendu_seconds_bucket{le="0.1"} 1' in text
+    assert 'test_rendu_seconds_bucket{le="+Inf"} 2' in text
+    assert "test_rendu_seconds_count 2" in text
+
+
+def _call_process():
+    metrics.REGISTRY.counter("test_agrege", "Compteur des processus d'appels.").inc(2)
+    metrics.REGISTRY.gauge("test_agrege_actifs", "Jauge des processus d'appels.").inc()
+    metrics.REGISTRY.histogram("test_agrege_seconds", "Histogramme des processus d'appels.", buckets=(1,)).observe(0.5)
+    metrics.flush_process_metrics()
+
+
+def test_aggregates_finished_call_processes(tmp_path, monkeypatch):
+    monkeypatch.setenv(metrics.METRICS_DIR_ENV, "")
+    monkeypatch.setenv(metrics.AGGREGATOR_PID_ENV, "")
+    metrics.enable_process_aggregation(str(tmp_path))
+
+    for _ in range(2):
+        process = multiprocessing.get_context("fork").Process(target=_call_process)
+        process.start()
+        process.join()
+        assert process.exitcode == 0
+
+    metrics.REGISTRY.counter("test_agrege", "Compteur des processus d'appels.").inc()
+    for _ in range(2): # Les processus terminés sont repris une seule fois, puis leurs fichiers supprimés
+        text = metrics.REGISTRY.render()
+        assert "test_agrege_total 5" in text
+        assert 'test_agrege_seconds_bucket{le="1"} 2' in text
+        assert "test_agrege_actifs" not in text # Jauge des processus terminés ignorée
+        assert not list(tmp_path.glob("*.json"))
+
+
+def test_live_call_process_gauges(tmp_path, monkeypatch):
+    monkeypatch.setenv(metrics.METRICS_DIR_ENV, "")
+    monkeypatch.setenv(metrics.AGGREGATOR_PID_ENV, "")
+    metrics.enable_process_aggregation(str(tmp_path))
+    reader, writer = multiprocessing.get_context("fork").Pipe()
+
+    def live_process():
+        metrics.REGISTRY.gauge("test_vivant_actifs", "Jauge d'un processus vivant.").inc(4)
+        metrics.flush_process_metrics()
+        writer.send("écrit")
+        writer.recv() # Reste vivant jusqu'à la fin de la collecte
+
+    process = multiprocessing.get_context("fork").Process(target=live_process)
+    process.start()
+    try:
+        assert reader.recv() == "écrit"
+        assert "test_vivant_actifs 4" in metrics.REGISTRY.render()
+        assert len(list(tmp_path.glob("*.json"))) == 1
+    finally:
+        reader.send("fin")
+        process.join()
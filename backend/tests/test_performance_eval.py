@@ -0,0 +1,133 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import performance_eval
+from performance_eval import FakeLLM, parse_batch_response, run_pipeline
+
+
+def evaluation(id_appel, resume="Résumé."):
+    return {"id_appel": id_appel, "resume_evaluation": resume, "conformite": "Conforme", "points_amelioration": "Aucun"}
+
+
+# --- Réponses par lots ---
+
+def test_parse_batch_response_keeps_expected_ids():
+    content = json.dumps([evaluation(1), evaluation(2), evaluation(99)])
+    results = parse_batch_response(content, [1, 2, 3])
+    assert sorted(results) == [1, 2] # 99 inattendu ignoré, 3 manquant
+    assert results[1] == ("Résumé.", "Conforme", "Aucun")
+
+
+def test_parse_batch_response_ignores_duplicates_and_invalid_items():
+    content = json.dumps([
+        evaluation(1, "Premier"), evaluation(1, "Doublon"),
+        evaluation(2, "  "), {"id_appel": "x"}, "texte", evaluation("3"),
+    ])
+    results = parse_batch_response(content, [1, 2, 3])
+    assert results[1][0] == "Premier"
+    assert sorted(results) == [1, 3]
+
+
+def test_parse_batch_response_accepts_code_fence_and_wrapper():
+    fenced = "```json\n" + json.dumps({"evaluations": [evaluation(4)]}) + "\n```"
+    assert list(parse_batch_response(fenced, [4])) == [4]
+
+
+def test_parse_batch_response_invalid_json():
+    assert parse_batch_response("pas du JSON", [1, 2]) == {}
+    assert parse_batch_response(json.dumps({"erreur": "quota"}), [1]) == {}
+
+
+# --- Pipeline avec un LLM simulé ---
+
+def transcription(id_appel):
+    return json.dumps([{"type": "message", "role": "user" if t % 2 else "assistant",
+                        "content": [f"Message {t} de l'appel {id_appel}, déclaration de sinistre."]} for t in range(4)],
+                      ensure_ascii=False)
+
+
+def run(llm, count=6, **kwargs):
+    saved = []
+    failures = []
+
+    def save(batch):
+        saved.extend(batch)
+        return len(batch)
+
+    kwargs.setdefault("requests_per_minute", 6000)
+    stats = asyncio.run(run_pipeline(
+        [list(range(1, count + 1))], lambda ids: {i: transcription(i) for i in ids}, save, llm,
+        concurrency=3, tokens_per_minute=0, write_batch_size=4, total=count,
+        on_failed=lambda id_appel, error, retry: failures.append((id_appel, retry)), **kwargs,
+    ))
+    return stats, sorted(row[0] for row in saved), failures
+
+
+def test_pipeline_evaluates_every_call():
+    llm = FakeLLM(latency=0.001)
+    stats, saved, failures = run(llm)
+    assert saved == [1, 2, 3, 4, 5, 6]
+    assert stats.done == stats.written == 6
+    assert llm.calls == stats.llm_requests == 6
+    assert failures == []
+
+
+class RateLimitedOnce(Exception):
+    status_code = 429
+
+    def __init__(self):
+        super().__init__("429 Resource exhausted")
+        self.response = SimpleNamespace(status_code=429, headers={"retry-after": "0.01"})
+
+
+class FlakyLLM(FakeLLM):
+    """Refuse (429) les `rejections` premières requêtes."""
+
+    def __init__(self, rejections):
+        super().__init__(latency=0.001)
+        self.rejections = rejections
+
+    async def ainvoke(self, prompt):
+        if self.rejections > 0:
+            self.rejections -= 1
+            self.rejected += 1
+            raise RateLimitedOnce()
+        return await super().ainvoke(prompt)
+
+
+def test_pipeline_retries_after_rate_limit():
+    llm = FlakyLLM(rejections=2)
+    stats, saved, failures = run(llm)
+    assert saved == [1, 2, 3, 4, 5, 6]
+    assert failures == []
+    assert llm.rejected == 2
+    assert stats.llm_requests == 6 + 2
+
+
+def test_pipeline_gives_up_after_max_attempts(monkeypatch):
+    monkeypatch.setattr(performance_eval, "MAX_ATTEMPTS", 2)
+    llm = FlakyLLM(rejections=1000)
+    stats, saved, failures = run(llm, count=2)
+    assert saved == []
+    assert stats.failed == 2
+    assert sorted(failures) == [(1, True), (2, True)]
+    assert llm.rejected == 4
+
+
+def test_pipeline_batches_calls():
+    llm = FakeLLM(latency=0.001)
+    stats, saved, _ = run(llm, batch_tokens=100000, batch_max_calls=3)
+    assert saved == [1, 2, 3, 4, 5, 6]
+    assert stats.batch_requests >= 2
+    assert stats.batch_fallbacks == 0
+    assert llm.calls == stats.llm_requests < 6 # Un appel isolé peut rester en mode unitaire
+
+
+def test_pipeline_falls_back_to_single_calls_when_batch_drops_items():
+    llm = FakeLLM(latency=0.001, batch_drop_rate=1.0)
+    stats, saved, _ = run(llm, batch_tokens=100000, batch_max_calls=3)
+    assert saved == [1, 2, 3, 4, 5, 6]
+    assert stats.batch_requests >= 2
+    assert stats.batch_fallbacks >= 4
+    assert stats.llm_requests == stats.batch_requests + 6 # Aucun résultat groupé : chaque appel en unitaire
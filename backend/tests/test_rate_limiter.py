@@ -0,0 +1,56 @@
+import asyncio
+import time
+
+from rate_limiter import AsyncRateLimiter
+
+
+def elapsed(coro_factory):
+    async def measure():
+        started = time.monotonic()
+        await coro_factory()
+        return time.monotonic() - started
+    return asyncio.run(measure())
+
+
+def test_burst_then_paced():
+    limiter = AsyncRateLimiter(1200, burst_seconds=0.25) # 20 req/s, rafale de 5
+
+    async def requests(count):
+        for _ in range(count):
+            await limiter.acquire()
+
+    assert elapsed(lambda: requests(5)) < 0.05
+    limiter = AsyncRateLimiter(1200, burst_seconds=0.25)
+    assert elapsed(lambda: requests(9)) >= 0.18 # 4 requêtes au-delà de la rafale, 50 ms chacune
+
+
+def test_token_budget():
+    limiter = AsyncRateLimiter(0, tokens_per_minute=6000) # 100 jetons/s, seau de 100
+
+    async def acquire_twice():
+        await limiter.acquire(tokens=500) # Plus gros que le seau : servi dès qu'il est plein
+        await limiter.acquire(tokens=20)
+
+    assert 0.15 <= elapsed(acquire_twice) < 1.0
+
+
+def test_aimd_fraction():
+    limiter = AsyncRateLimiter(600, min_fraction=0.1, recovery_step=0.05)
+    limiter.on_rate_limited()
+    assert limiter.fraction == 0.5
+    assert limiter.current_requests_per_minute == 300
+    for _ in range(5):
+        limiter.on_rate_limited()
+    assert limiter.fraction == 0.1
+    assert limiter.rate_limited_count == 6
+    limiter.on_success()
+    assert abs(limiter.fraction - 0.15) < 1e-9
+    for _ in range(100):
+        limiter.on_success()
+    assert limiter.fraction == 1.0
+
+
+def test_retry_after_pauses_requests():
+    limiter = AsyncRateLimiter(6000)
+    limiter.on_rate_limited(retry_after=0.2)
+    assert elapsed(limiter.acquire) >= 0.19
@@ -6,6 +6,7 @@ from datetime import date
 from decimal import Decimal
 import os
 import json
+import asyncio
 
 # Imports pour les services externes (e-mail, etc.)
 from sendgrid import SendGridAPIClient
@@ -15,6 +16,8 @@ from sendgrid.helpers.mail import Mail
 from livekit.agents import function_tool, RunContext
 from db_driver import ExtranetDatabaseDriver, Adherent
 from error_logger import log_system_error
+from kb_index import get_knowledge_index
+from metrics import timed_tool
 
 logger = logging.getLogger("artex_agent.tools")
 
@@ -81,6 +84,7 @@ def _handle_lookup_result(context: RunContext, result: Optional[Adherent] | List
 # --- Outils d'Identité et de Contexte (Inchangé) ---
 
 @function_tool
+@timed_tool
 async def confirm_identity(context: RunContext, date_of_birth: str, postal_code: str) -> str:
     """
     Confirme l'identité de l'utilisateur en utilisant sa date de naissance ET son code postal.
@@ -134,6 +138,7 @@ async def confirm_identity(context: RunContext, date_of_birth: str, postal_code:
     return result_str
 
 @function_tool
+@timed_tool
 async def clear_context(context: RunContext) -> str:
     """
     Efface l'adhérent actuellement sélectionné du contexte de l'assistant. À utiliser si la mauvaise personne a été identifiée ou pour terminer la session.
@@ -158,6 +163,7 @@ async def clear_context(context: RunContext) -> str:
 # --- Outils de Recherche et de Gestion des Adhérents (Inchangé) ---
 
 @function_tool
+@timed_tool
 async def lookup_adherent_by_email(context: RunContext, email: str) -> str:
     """Recherche un adhérent en utilisant son adresse e-mail pour commencer le processus d'identification."""
     db: ExtranetDatabaseDriver = context.userdata["db_driver"]
@@ -178,6 +184,7 @@ async def lookup_adherent_by_email(context: RunContext, email: str) -> str:
     return result_str
 
 @function_tool
+@timed_tool
 async def lookup_adherent_by_telephone(context: RunContext, telephone: str) -> str:
     """Recherche un adhérent par son numéro de téléphone. Destiné à la recherche automatique au début d'un appel."""
     db: ExtranetDatabaseDriver = context.userdata["db_driver"]
@@ -199,6 +206,7 @@ async def lookup_adherent_by_telephone(context: RunContext, telephone: str) -> s
     return result_str
 
 @function_tool
+@timed_tool
 async def lookup_adherent_by_fullname(context: RunContext, nom: str, prenom: str) -> str:
     """Recherche un adhérent en utilisant son nom complet pour commencer le processus d'identification."""
     db: ExtranetDatabaseDriver = context.userdata["db_driver"]
@@ -219,6 +227,7 @@ async def lookup_adherent_by_fullname(context: RunContext, nom: str, prenom: str
     return result_str
 
 @function_tool
+@timed_tool
 async def get_adherent_details(context: RunContext) -> str:
     """Obtient les détails personnels de l'adhérent actuellement chargé et confirmé dans le contexte de l'assistant."""
     adherent: Optional[Adherent] = context.userdata.get("adherent_context")
@@ -230,6 +239,7 @@ async def get_adherent_details(context: RunContext) -> str:
             f"Adresse: {adherent.adresse}, {adherent.code_postal} {adherent.ville}.")
 
 @function_tool
+@timed_tool
 async def update_contact_information(context: RunContext, address: Optional[str] = None, postal_code: Optional[str] = None, 
                                      city: Optional[str] = None, phone: Optional[str] = None, email: Optional[str] = None) -> str:
     """Met à jour les informations de contact (adresse, téléphone, e-mail) de l'adhérent actuellement confirmé."""
@@ -266,6 +276,7 @@ async def update_contact_information(context: RunContext, address: Optional[str]
 # --- OUTILS KB & Transactionnels (Inchangé) ---
 
 @function_tool
+@timed_tool
 async def list_available_products(context: RunContext, product_keyword: str) -> str:
     """
     Étape 1 : Recherche les noms des produits disponibles correspondant à un mot-clé 
@@ -298,6 +309,7 @@ async def list_available_products(context: RunContext, product_keyword: str) ->
 
 
 @function_tool
+@timed_tool
 async def get_product_guarantees(context: RunContext, product_name: str) -> str:
     """
     Étape 2 : Récupère et liste les garanties détaillées pour UN SEUL produit spécifique,
@@ -330,6 +342,33 @@ async def get_product_guarantees(context: RunContext, product_name: str) -> str:
         return "Une erreur technique est survenue lors de la récupération des garanties."
 
 @function_tool
+@timed_tool
+async def rechercher_documentation_produit(context: RunContext, question: str) -> str:
+    """
+    Recherche dans la documentation des produits (fiches produit, IPID, notices) les passages
+    qui répondent à une question précise sur une garantie, une exclusion ou une condition.
+    """
+    tool_name = "rechercher_documentation_produit"
+    logger.info(f"Outil KB: '{tool_name}' appelé avec la question: '{question}'")
+
+    try:
+        # La version de l'index est figée pour toute la durée de la recherche,
+        # même si une nouvelle version est activée entre-temps.
+        with get_knowledge_index().acquire() as vector_store:
+            if vector_store is None:
+                return "La documentation produit n'est pas disponible pour le moment."
+            documents = await asyncio.to_thread(vector_store.similarity_search, question, 4)
+
+        if not documents:
+            return "Je n'ai trouvé aucun passage de la documentation correspondant à cette question."
+        return "Extraits de la documentation produit :\n" + "\n---\n".join(doc.page_content for doc in documents)
+
+    except Exception as e:
+        logger.error(f"Erreur dans {tool_name}: {e}", exc_info=True)
+        return "Une erreur technique est survenue lors de la recherche dans la documentation."
+
+@function_tool
+@timed_tool
 async def list_adherent_contracts(context: RunContext) -> str:
     """Liste tous les contrats associés à l'adhérent actuellement confirmé dans le contexte."""
     db: ExtranetDatabaseDriver = context.userdata["db_driver"]
@@ -348,6 +387,7 @@ async def list_adherent_contracts(context: RunContext) -> str:
     return "\\n".join(response_lines)
 
 @function_tool
+@timed_tool
 async def create_claim(context: RunContext, contract_id: int, claim_type: str, description: str, incident_date: str) -> str:
     """Crée un nouveau sinistre pour l'adhérent actuellement confirmé."""
     db: ExtranetDatabaseDriver = context.userdata["db_driver"]
@@ -371,6 +411,7 @@ async def create_claim(context: RunContext, contract_id: int, claim_type: str, d
 
 
 @function_tool
+@timed_tool
 async def send_confirmation_email(context: RunContext, subject: str, body: str) -> str:
     """Envoie un e-mail de confirmation à l'adhérent actuellement identifié."""
     adherent: Optional[Adherent] = context.userdata.get("adherent_context")
@@ -403,6 +444,7 @@ async def send_confirmation_email(context: RunContext, subject: str, body: str)
 # --- OUTILS DE PROSPECTION MIS À JOUR ---
 
 @function_tool
+@timed_tool
 async def request_quote(context: RunContext, product_type: str, user_details: str) -> str:
     """
     À utiliser lorsqu'un prospect demande un devis. Enregistre la demande et envoie une notification interne.
@@ -423,6 +465,7 @@ async def request_quote(context: RunContext, product_type: str, user_details: st
     return "J'ai bien noté votre demande de devis. Pour vous fournir une offre précise, un conseiller commercial va vous recontacter très prochainement. Puis-je faire autre chose pour vous ?"
 
 @function_tool
+@timed_tool
 async def log_issue(context: RunContext, issue_type: str, issue_description: str) -> str:
     """Enregistre un problème complexe pour qu'un conseiller puisse le traiter."""
     adherent: Optional[Adherent] = context.userdata.get("adherent_context")
@@ -430,6 +473,7 @@ async def log_issue(context: RunContext, issue_type: str, issue_description: str
     return "Je comprends parfaitement votre situation. J'ai enregistré tous les détails de votre problème. Un conseiller spécialisé va examiner votre dossier et vous recontacter dans les plus brefs délais."
 
 @function_tool
+@timed_tool
 async def schedule_callback_with_advisor(context: RunContext, reason: str) -> str:
     """
     Planifie un rappel téléphonique avec un conseiller pour un prospect et envoie une notification interne.
@@ -452,9 +496,19 @@ async def schedule_callback_with_advisor(context: RunContext, reason: str) -> st
     await _send_notification_email(subject, body)
     # --- FIN DE L'AJOUT ---
 
+    # Rappel ajouté à la file des campagnes sortantes (campaign_dialer.py), au numéro de l'appelant à défaut d'un numéro connu.
+    db: ExtranetDatabaseDriver = context.userdata["db_driver"]
+    id_rappel = await asyncio.to_thread(
+        db.planifier_rappel, reason, context.userdata.get("current_call_journal_id"),
+        adherent.id_adherent if adherent else None, adherent.telephone if adherent else None,
+    )
+    if id_rappel:
+        logger.info(f"Rappel {id_rappel} ajouté à la file des appels sortants.")
+
     return "Parfait. J'ai transmis une demande de rappel à un conseiller. Il vous contactera dans les meilleurs délais."
 
 @function_tool
+@timed_tool
 async def expliquer_garantie_specifique(context: RunContext, nom_garantie: str) -> str:
     """
     Fournit les détails (plafond, taux, franchise, conditions) d'une garantie spécifique
@@ -489,6 +543,7 @@ async def expliquer_garantie_specifique(context: RunContext, nom_garantie: str)
     return response
 
 @function_tool
+@timed_tool
 async def envoyer_document_adherent(context: RunContext, type_document: str) -> str:
     """
     Envoie un document standard (comme les Conditions Générales ou une Notice d'Information)
@@ -523,6 +578,7 @@ async def envoyer_document_adherent(context: RunContext, type_document: str) ->
 
 
 @function_tool
+@timed_tool
 async def qualifier_prospect_pour_conseiller(context: RunContext, produit_interesse: str, nombre_personnes: int, budget_approximatif: str, details_supplementaires: str) -> str:
     """
     Qualifie un prospect avec des questions précises avant de planifier un rappel
@@ -545,6 +601,7 @@ async def qualifier_prospect_pour_conseiller(context: RunContext, produit_intere
     return "Merci pour ces précisions. J'ai transmis toutes ces informations à un conseiller qui vous recontactera très prochainement avec une offre adaptée. Puis-je faire autre chose pour vous ?"
 
 @function_tool
+@timed_tool
 async def enregistrer_feedback_appel(context: RunContext, note: int, commentaire: Optional[str] = None) -> str:
     """
     Enregistre le feedback de l'utilisateur sur la qualité de l'appel à la fin de la conversation.
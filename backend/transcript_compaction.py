@@ -0,0 +1,151 @@
+# transcript_compaction.py
+#
+# Compactage de la transcription d'un appel avant évaluation par le LLM.
+# `transcription_complete` contient les `model_dump()` complets de l'historique de la session
+# (identifiants, horodatages, arguments et retours d'outils en JSON...) : l'essentiel des jetons
+# facturés est du bruit. Le compactage produit un dialogue minimal, une ligne par tour :
+#
+#   Client: Bonjour, je voudrais déclarer un sinistre.
+#   ARIA: Pouvez-vous me donner votre numéro d'adhérent ?
+#   [outil] rechercher_adherent(numero_adherent=1234) -> {"nom": "Dupont", ...} (tronqué)
+
+import json
+import os
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+MAX_TOOL_OUTPUT_CHARS = int(os.getenv("TRANSCRIPT_TOOL_OUTPUT_MAX_CHARS", "300"))
+MAX_TOOL_ARGUMENT_CHARS = 120 # Par argument
+
+ROLE_LABELS = {"user": "Client", "assistant": "ARIA"} # Les messages system / developer sont ignorés
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimation grossière (≈ 4 caractères par jeton), suffisante pour les budgets et les rapports."""
+    return len(text) // 4 + 1
+
+
+@dataclass
+class CompactTranscript:
+    text: str
+    tokens_before: int
+    tokens_after: int
+    turns: int = 0
+    tool_calls: int = 0
+
+    @property
+    def reduction(self) -> float:
+        """Part des jetons économisés (0.75 = 75 % de moins)."""
+        return 1 - self.tokens_after / self.tokens_before if self.tokens_before else 0.0
+
+
+def _truncate(text: str, limit: int) -> str:
+    text = " ".join(text.split()) # Une seule ligne
+    if len(text) <= limit:
+        return text
+    return text[:limit].rstrip() + f"… (tronqué, {len(text)} car.)"
+
+
+def _message_text(content: Any) -> str:
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        # Seuls les morceaux textuels comptent (les contenus audio / image sont des dicts).
+        return " ".join(str(part) for part in content if isinstance(part, str))
+    return ""
+
+
+def _format_arguments(arguments: Any) -> str:
+    if isinstance(arguments, str):
+        try:
+            arguments = json.loads(arguments) if arguments.strip() else {}
+        except ValueError:
+            return _truncate(arguments, MAX_TOOL_ARGUMENT_CHARS)
+    if not isinstance(arguments, dict):
+        return _truncate(str(arguments), MAX_TOOL_ARGUMENT_CHARS)
+    return ", ".join(
+        f"{name}={_truncate(json.dumps(value, ensure_ascii=False), MAX_TOOL_ARGUMENT_CHARS)}"
+        for name, value in arguments.items()
+        if value is not None
+    )
+
+
+def compact_history(items: List[Dict[str, Any]], max_tool_output_chars: int = MAX_TOOL_OUTPUT_CHARS) -> List[str]:
+    """Historique (liste de model_dump) -> lignes du dialogue compact."""
+    lines: List[str] = []
+    call_lines: Dict[str, int] = {} # call_id -> index de la ligne de l'appel d'outil
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        item_type = item.get("type", "message")
+
+        if item_type == "message":
+            label = ROLE_LABELS.get(item.get("role"))
+            text = " ".join(_message_text(item.get("content")).split())
+            if label and text:
+                suffix = " (interrompu)" if item.get("interrupted") else ""
+                lines.append(f"{label}: {text}{suffix}")
+
+        elif item_type == "function_call":
+            lines.append(f"[outil] {item.get('name', '?')}({_format_arguments(item.get('arguments'))})")
+            if item.get("call_id"):
+                call_lines[item["call_id"]] = len(lines) - 1
+
+        elif item_type == "function_call_output":
+            output = item.get("output")
+            output = output if isinstance(output, str) else json.dumps(output, ensure_ascii=False, default=str)
+            result = ("erreur: " if item.get("is_error") else "") + _truncate(output, max_tool_output_chars)
+            index = call_lines.pop(item.get("call_id"), None)
+            if index is not None:
+                lines[index] += f" -> {result}"
+            else:
+                lines.append(f"[outil] {item.get('name', '?')} -> {result}")
+
+        elif item_type == "agent_handoff":
+            lines.append(f"[transfert] vers {item.get('new_agent_id', '?')}")
+
+    return lines
+
+
+def compact_transcript(raw: Optional[str], max_tool_output_chars: int = MAX_TOOL_OUTPUT_CHARS) -> CompactTranscript:
+    """
+    Compacte `transcription_complete`. Une transcription qui n'est pas un historique JSON
+    (ancien format, texte libre) est renvoyée telle quelle.
+    """
+    raw = raw or ""
+    tokens_before = estimate_tokens(raw)
+    try:
+        items = json.loads(raw)
+    except ValueError:
+        items = None
+    if not isinstance(items, list):
+        return CompactTranscript(raw, tokens_before, tokens_before)
+
+    lines = compact_history(items, max_tool_output_chars)
+    text = "\n".join(lines)
+    return CompactTranscript(
+        text,
+        tokens_before,
+        estimate_tokens(text),
+        turns=sum(1 for line in lines if not line.startswith("[")),
+        tool_calls=sum(1 for line in lines if line.startswith("[outil]")),
+    )
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description="Affiche la version compacte d'une transcription JSON.")
+    parser.add_argument("fichier", nargs="?", help="Fichier de transcription (défaut : entrée standard).")
+    parser.add_argument("--max-tool-output", type=int, default=MAX_TOOL_OUTPUT_CHARS)
+    args = parser.parse_args()
+
+    with (open(args.fichier, encoding="utf-8") if args.fichier else sys.stdin) as source:
+        compact = compact_transcript(source.read(), args.max_tool_output)
+    print(compact.text)
+    print(
+        f"\n{compact.turns} tours, {compact.tool_calls} appels d'outils - "
+        f"{compact.tokens_before} -> {compact.tokens_after} jetons estimés (-{compact.reduction:.0%})",
+        file=sys.stderr,
+    )
@@ -4,7 +4,6 @@ import streamlit as st
 import plotly.express as px
 from core.db_connector import run_query
 from PIL import Image
-import pandas as pd
 import os
 
 # --- CONFIGURATION DE LA PAGE ---
@@ -18,49 +17,56 @@ st.set_page_config(
 @st.cache_data(ttl=300)
 def load_static_kpis():
     kpis = {}
-    # --- KPIs sur le volume d'appels ---
-    total_calls_df = run_query("SELECT COUNT(*) as total FROM journal_appels;")
-    kpis['Nombre Total d\'Appels'] = total_calls_df['total'].iloc[0] if not total_calls_df.empty else 0
+    # Les KPIs sont lus dans les tables d'agrégats (kpi_rollup_*), maintenues à chaque début/fin d'appel,
+    # erreur et feedback : le coût ne dépend plus du volume de journal_appels.
+    totals_df = run_query("""
+        SELECT COALESCE(SUM(nb_appels), 0) as nb_appels,
+               COALESCE(SUM(nb_appels_termines), 0) as nb_appels_termines,
+               COALESCE(SUM(duree_totale_secondes), 0) as duree_totale_secondes,
+               COALESCE(SUM(nb_appels_identifies), 0) as nb_appels_identifies,
+               COALESCE(SUM(nb_erreurs), 0) as nb_erreurs,
+               COALESCE(SUM(nb_feedbacks), 0) as nb_feedbacks,
+               COALESCE(SUM(somme_notes_satisfaction), 0) as somme_notes_satisfaction,
+               COALESCE(SUM(nb_appels_outils), 0) as nb_appels_outils,
+               COALESCE(SUM(CASE WHEN jour = CURDATE() THEN nb_appels ELSE 0 END), 0) as nb_appels_aujourdhui
+        FROM kpi_rollup_jour;
+    """)
+    totals = totals_df.iloc[0] if not totals_df.empty else None
 
-    calls_today_df = run_query("SELECT COUNT(*) as total FROM journal_appels WHERE DATE(timestamp_debut) = CURDATE();")
-    kpis['Appels Aujourd\'hui'] = calls_today_df['total'].iloc[0] if not calls_today_df.empty else 0
+    # --- KPIs sur le volume d'appels ---
+    kpis['Nombre Total d\'Appels'] = int(totals['nb_appels']) if totals is not None else 0
+    kpis['Appels Aujourd\'hui'] = int(totals['nb_appels_aujourdhui']) if totals is not None else 0
 
     # --- KPIs sur la durée et la performance ---
-    avg_duration_query = "SELECT AVG(COALESCE(duree_appel_secondes, TIMESTAMPDIFF(SECOND, timestamp_debut, timestamp_fin))) as avg_duration FROM journal_appels WHERE timestamp_fin IS NOT NULL;"
-    avg_duration_df = run_query(avg_duration_query)
-    kpis['Durée Moyenne des Appels (sec)'] = f"{avg_duration_df['avg_duration'].iloc[0]:.0f}" if not avg_duration_df.empty and pd.notna(avg_duration_df['avg_duration'].iloc[0]) else 0
-
-    # --- KPIs sur l'identification ---
-    identity_df = run_query("SELECT COUNT(id_adherent_contexte) as confirmed, COUNT(*) as total FROM journal_appels;")
-    if not identity_df.empty and identity_df['total'].iloc[0] > 0:
-        confirmed_count = identity_df['confirmed'].iloc[0]
-        total_for_rate = identity_df['total'].iloc[0]
-        kpis['Taux d\'Identification Réussie'] = f"{(confirmed_count / total_for_rate) * 100:.2f}%"
-        kpis['Appels Non Identifiés'] = total_for_rate - confirmed_count
+    if totals is not None and totals['nb_appels_termines'] > 0:
+        kpis['Durée Moyenne des Appels (sec)'] = f"{totals['duree_totale_secondes'] / totals['nb_appels_termines']:.0f}"
+    else:
+        kpis['Durée Moyenne des Appels (sec)'] = 0
+
+    # --- KPIs sur l'identification (connue à la clôture de l'appel) ---
+    if totals is not None and totals['nb_appels_termines'] > 0:
+        kpis['Taux d\'Identification Réussie'] = f"{(totals['nb_appels_identifies'] / totals['nb_appels_termines']) * 100:.2f}%"
+        kpis['Appels Non Identifiés'] = int(totals['nb_appels_termines'] - totals['nb_appels_identifies'])
     else:
         kpis['Taux d\'Identification Réussie'] = "0.00%"
         kpis['Appels Non Identifiés'] = 0
 
     # --- KPIs sur la satisfaction client ---
-    feedback_df = run_query("SELECT AVG(note_satisfaction) as avg_rating, COUNT(*) as total_ratings FROM feedback_appel WHERE note_satisfaction IS NOT NULL;")
-    if not feedback_df.empty and pd.notna(feedback_df['avg_rating'].iloc[0]):
-        kpis['Satisfaction Client Moyenne'] = f"{feedback_df['avg_rating'].iloc[0]:.2f}/5 ⭐"
-        kpis['Nombre de Feedbacks Reçus'] = feedback_df['total_ratings'].iloc[0]
+    if totals is not None and totals['nb_feedbacks'] > 0:
+        kpis['Satisfaction Client Moyenne'] = f"{totals['somme_notes_satisfaction'] / totals['nb_feedbacks']:.2f}/5 ⭐"
+        kpis['Nombre de Feedbacks Reçus'] = int(totals['nb_feedbacks'])
     else:
         kpis['Satisfaction Client Moyenne'] = "N/A"
         kpis['Nombre de Feedbacks Reçus'] = 0
 
     # --- KPIs sur la santé du système ---
-    errors_df = run_query("SELECT COUNT(*) as total FROM erreurs_systeme;")
-    kpis['Nombre Total d\'Erreurs'] = errors_df['total'].iloc[0] if not errors_df.empty else 0
-    
+    kpis['Nombre Total d\'Erreurs'] = int(totals['nb_erreurs']) if totals is not None else 0
+
     # --- KPIs sur l'utilisation des outils ---
-    tool_usage_df = run_query("SELECT COUNT(*) as total FROM actions_agent WHERE type_action = 'TOOL_CALL';")
-    kpis['Nombre d\'Appels aux Outils'] = tool_usage_df['total'].iloc[0] if not tool_usage_df.empty else 0
-    
+    kpis['Nombre d\'Appels aux Outils'] = int(totals['nb_appels_outils']) if totals is not None else 0
+
     most_used_tool_df = run_query("""
-        SELECT nom_outil, COUNT(*) as count FROM actions_agent
-        WHERE type_action = 'TOOL_CALL' AND nom_outil IS NOT NULL
+        SELECT nom_outil, SUM(nb_appels_outil) as count FROM kpi_rollup_outils_jour
         GROUP BY nom_outil ORDER BY count DESC LIMIT 1;
     """)
     kpis['Outil le Plus Utilisé'] = most_used_tool_df['nom_outil'].iloc[0] if not most_used_tool_df.empty else "N/A"
@@ -68,26 +74,38 @@ def load_static_kpis():
     return kpis
 
 # --- FONCTION POUR LES GRAPHIQUES D'ÉVOLUTION ---
-def create_evolution_chart(title, table, date_col, value_expr, y_axis_title):
+def create_evolution_chart(title, value_expr, y_axis_title):
+    """
+    Trace l'évolution d'un KPI à partir des agrégats : kpi_rollup_heure pour les dernières 24 heures,
+    kpi_rollup_jour sinon. `value_expr` est une expression sur les colonnes des tables d'agrégats.
+    """
     with st.expander(f"Évolution de : {title}", expanded=True):
-        period_options = {"7 derniers jours": 7, "30 derniers jours": 30, "90 derniers jours": 90}
+        period_options = {"Dernières 24 heures": None, "7 derniers jours": 7, "30 derniers jours": 30, "90 derniers jours": 90}
         selected_period_label = st.selectbox("Choisir la période :", options=list(period_options.keys()), key=f"select_{title}")
         days = period_options[selected_period_label]
 
-        query = f"""
-            SELECT DATE({date_col}) as jour, {value_expr} as valeur
-            FROM {table}
-            WHERE {date_col} >= DATE_SUB(CURDATE(), INTERVAL {days} DAY)
-            GROUP BY jour ORDER BY jour ASC;
-        """
-        
+        if days is None:
+            query = f"""
+                SELECT heure as periode, {value_expr} as valeur
+                FROM kpi_rollup_heure
+                WHERE heure >= DATE_SUB(NOW(), INTERVAL 24 HOUR) AND ({value_expr}) IS NOT NULL
+                ORDER BY periode ASC;
+            """
+        else:
+            query = f"""
+                SELECT jour as periode, {value_expr} as valeur
+                FROM kpi_rollup_jour
+                WHERE jour >= DATE_SUB(CURDATE(), INTERVAL {days} DAY) AND ({value_expr}) IS NOT NULL
+                ORDER BY periode ASC;
+            """
+
         data = run_query(query)
 
         if not data.empty:
-            fig = px.line(data, x='jour', y='valeur', title=title, markers=True, labels={"jour": "Date", "valeur": y_axis_title})
+            fig = px.line(data, x='periode', y='valeur', title=title, markers=True, labels={"periode": "Date", "valeur": y_axis_title})
             st.plotly_chart(fig, use_container_width=True)
         else:
-            st.info(f"Aucune donnée disponible pour les {days} derniers jours.")
+            st.info(f"Aucune donnée disponible pour la période : {selected_period_label.lower()}.")
 
 # --- INTERFACE UTILISATEUR ---
 try:
@@ -119,9 +137,8 @@ st.info("Chaque graphique dispose de son propre filtre de période.")
 
 col1, col2 = st.columns(2)
 with col1:
-    create_evolution_chart("Nombre d'Appels par Jour", "journal_appels", "timestamp_debut", "COUNT(id_appel)", "Nombre d'Appels")
-    # --- CORRECTION DE LA REQUÊTE SQL ICI ---
-    create_evolution_chart("Taux d'Identification Réussie (%) par Jour", "journal_appels", "timestamp_debut", "(COUNT(id_adherent_contexte) / COUNT(id_appel)) * 100", "Taux d'Identification (%)")
+    create_evolution_chart("Nombre d'Appels", "nb_appels", "Nombre d'Appels")
+    create_evolution_chart("Taux d'Identification Réussie (%)", "nb_appels_identifies / NULLIF(nb_appels_termines, 0) * 100", "Taux d'Identification (%)")
 with col2:
-    create_evolution_chart("Satisfaction Client Moyenne par Jour", "feedback_appel", "timestamp_feedback", "AVG(note_satisfaction)", "Note Moyenne (/5)")
-    create_evolution_chart("Nombre d'Erreurs par Jour", "erreurs_systeme", "timestamp_erreur", "COUNT(id_erreur)", "Nombre d'Erreurs")
\ No newline at end of file
+    create_evolution_chart("Satisfaction Client Moyenne", "somme_notes_satisfaction / NULLIF(nb_feedbacks, 0)", "Note Moyenne (/5)")
+    create_evolution_chart("Nombre d'Erreurs", "nb_erreurs", "Nombre d'Erreurs")
@@ -1,7 +1,9 @@
 # dashboard/core/db_connector.py
+from typing import Any, Dict, Optional
+
 import streamlit as st
 import pandas as pd
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, text
 from sqlalchemy.exc import SQLAlchemyError
 
 # Utilise st.cache_resource pour ne créer l'engine qu'une seule fois
@@ -37,15 +39,16 @@ def init_db_engine():
 
 # Utilise st.cache_data pour mettre en cache les résultats des requêtes
 @st.cache_data(ttl=600)
-def run_query(query: str) -> pd.DataFrame:
+def run_query(query: str, params: Optional[Dict[str, Any]] = None) -> pd.DataFrame:
     """
     Exécute une requête SQL en utilisant l'engine SQLAlchemy et retourne les résultats 
     dans un DataFrame Pandas. Les résultats sont mis en cache.
+    Avec `params`, la requête utilise des paramètres nommés (:nom) liés par le pilote.
     """
     engine = init_db_engine()
     if engine:
         try:
-            df = pd.read_sql(query, engine)
+            df = pd.read_sql(text(query), engine, params=params) if params else pd.read_sql(query, engine)
             return df
         except SQLAlchemyError as e:
             st.error(f"Erreur lors de l'exécution de la requête : {e}")
@@ -0,0 +1,130 @@
+# dashboard/core/log_tail.py
+import json
+import os
+import threading
+from collections import deque
+from typing import Dict, Iterable, List, Optional
+
+# Octets du début de fichier comparés d'une lecture à l'autre pour détecter une réécriture.
+HEAD_BYTES = 64
+
+
+class LogTailReader:
+    """
+    Lecture incrémentale d'un fichier de logs JSON lines (agent.log).
+    Seuls les octets ajoutés depuis la lecture précédente sont lus et parsés ; les entrées sont
+    conservées dans un tampon circulaire borné (les plus anciennes sont oubliées).
+    Gère la rotation (fichier renommé puis recréé) et la troncature (fichier vidé).
+    """
+
+    def __init__(self, path: str, max_entries: int = 5000, initial_bytes: int = 4 * 1024 * 1024):
+        self.path = path
+        self.initial_bytes = initial_bytes
+        self.entries: deque = deque(maxlen=max_entries)
+        self.lines_read = 0
+        self.malformed_lines = 0
+        self._file = None
+        self._file_id = None
+        self._partial = b""
+        self._head = b""
+        self._lock = threading.Lock()
+
+    def _open(self, from_start: bool):
+        self._file = open(self.path, "rb")
+        stat = os.fstat(self._file.fileno())
+        self._file_id = (stat.st_dev, stat.st_ino)
+        self._partial = b""
+        self._head = b""
+        if not from_start and stat.st_size > self.initial_bytes:
+            # Premier chargement d'un gros fichier : seule la fin est utile (le tampon est borné).
+            self._file.seek(stat.st_size - self.initial_bytes)
+            self._file.readline() # Ligne probablement incomplète
+
+    def _close(self):
+        if self._file is not None:
+            self._file.close()
+        self._file = None
+        self._file_id = None
+
+    def _read_head(self) -> bytes:
+        position = self._file.tell() # os.pread n'existe pas sous Windows
+        self._file.seek(0)
+        head = self._file.read(HEAD_BYTES)
+        self._file.seek(position)
+        return head
+
+    def _rewritten(self, size: int) -> bool:
+        """
+        Vrai si le fichier a été vidé puis réécrit depuis la dernière lecture : taille inférieure à
+        la position lue, ou début du fichier différent (il commence par l'horodatage de la 1re ligne).
+        """
+        if size < self._file.tell():
+            return True
+        return not self._read_head().startswith(self._head)
+
+    def _consume(self, data: bytes):
+        data = self._partial + data
+        lines = data.split(b"\n")
+        self._partial = lines.pop() # Dernière ligne pas encore terminée
+        for line in lines:
+            if not line.strip():
+                continue
+            self.lines_read += 1
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                self.malformed_lines += 1
+                continue
+            if isinstance(entry, dict):
+                self.entries.append(entry)
+
+    def read_new(self) -> int:
+        """Lit ce qui a été ajouté depuis le dernier appel. Retourne le nombre d'entrées ajoutées."""
+        with self._lock:
+            before = self.lines_read
+            try:
+                stat = os.stat(self.path)
+            except FileNotFoundError:
+                return 0 # Rotation en cours, ou agent jamais démarré
+
+            if self._file is None:
+                self._open(from_start=False)
+            elif (stat.st_dev, stat.st_ino) != self._file_id:
+                # Rotation : terminer l'ancien fichier, puis lire le nouveau depuis le début.
+                self._consume(self._file.read())
+                self._close()
+                self._open(from_start=True)
+            elif self._rewritten(stat.st_size):
+                # Fichier vidé (ou tronqué) : les entrées en mémoire ne correspondent plus à rien.
+                self.entries.clear()
+                self._file.seek(0)
+                self._partial = b""
+                self._head = b""
+
+            self._consume(self._file.read())
+            if len(self._head) < HEAD_BYTES:
+                self._head = self._read_head()
+            return self.lines_read - before
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+
+    def levels(self) -> List[str]:
+        with self._lock:
+            return sorted({str(e.get("level", "UNKNOWN")) for e in self.entries})
+
+    def filtered(self, levels: Optional[Iterable[str]] = None, search: Optional[str] = None) -> List[Dict]:
+        """Entrées du tampon (les plus récentes en premier) filtrées par niveau et par texte du message."""
+        level_set = set(levels) if levels is not None else None
+        needle = search.lower() if search else None
+        with self._lock:
+            snapshot = list(self.entries)
+        result = []
+        for entry in reversed(snapshot):
+            if level_set is not None and entry.get("level", "UNKNOWN") not in level_set:
+                continue
+            if needle and needle not in str(entry.get("message", "")).lower():
+                continue
+            result.append(entry)
+        return result
@@ -2,9 +2,9 @@ import streamlit as st
 import subprocess
 import os
 import time
-import json
 import pandas as pd
 import sys
+from core.log_tail import LogTailReader
 
 # --- Configuration de la page ---
 st.set_page_config(
@@ -142,10 +142,10 @@ with c1:
     st.subheader("Serveur API")
     sc1, sc2 = st.columns(2)
     server_running = os.path.exists(SERVER_PID_FILE)
-    # **MODIFICATION CLÉ ICI**
-    waitress_command = [PYTHON_EXEC, "-m", "waitress", "--host", "0.0.0.0", "--port", "5001", "server:app"]
+    # server:app est une application ASGI (FastAPI) : elle est servie par Uvicorn.
+    uvicorn_command = [PYTHON_EXEC, "-m", "uvicorn", "server:app", "--host", "0.0.0.0", "--port", "5001"]
 
-    sc1.button("🚀 Démarrer", on_click=start_process, args=(waitress_command, BACKEND_DIR, SERVER_PID_FILE, "Serveur API"), key="start_server", use_container_width=True, disabled=server_running)
+    sc1.button("🚀 Démarrer", on_click=start_process, args=(uvicorn_command, BACKEND_DIR, SERVER_PID_FILE, "Serveur API"), key="start_server", use_container_width=True, disabled=server_running)
     sc2.button("🛑 Arrêter", on_click=stop_process, args=(SERVER_PID_FILE, "Serveur API"), key="stop_server", use_container_width=True, disabled=not server_running)
     if server_running:
         st.success("Le serveur API est en cours d'exécution.")
@@ -168,64 +168,53 @@ st.markdown("---")
 # --- Visualiseur de Logs Amélioré ---
 st.header("Analyseur de Logs de l'Agent")
 
-@st.cache_data(ttl=2)
-def parse_logs():
-    """Lit et parse les logs JSON depuis le fichier agent.log."""
-    logs = []
-    if not os.path.exists(AGENT_LOG_FILE):
-        return pd.DataFrame()
-    try:
-        with open(AGENT_LOG_FILE, "r", encoding="utf-8") as f:
-            for line in f:
-                try:
-                    logs.append(json.loads(line))
-                except json.JSONDecodeError:
-                    continue # Ignorer les lignes mal formées
-        return pd.DataFrame(logs)
-    except Exception as e:
-        st.error(f"Erreur lors de la lecture du fichier de log : {e}")
-        return pd.DataFrame()
+LOG_BUFFER_SIZE = 5000
+LOG_DISPLAY_COLUMNS = ['timestamp', 'level', 'name', 'job_id', 'call_id', 'message']
+
+@st.cache_resource
+def get_log_reader():
+    """Lecteur incrémental partagé entre les sessions : seuls les octets ajoutés à agent.log sont parsés."""
+    return LogTailReader(AGENT_LOG_FILE, max_entries=LOG_BUFFER_SIZE)
 
-logs_df = parse_logs()
+log_reader = get_log_reader()
+log_reader.read_new()
 
-if not logs_df.empty:
-    # --- Filtres pour les logs ---
+if log_reader.entries:
+    # --- Filtres pour les logs (appliqués au tampon en mémoire) ---
     filter_c1, filter_c2 = st.columns([1, 2])
-    
-    log_levels = sorted(logs_df['level'].unique())
+
+    log_levels = log_reader.levels()
     selected_levels = filter_c1.multiselect("Filtrer par niveau", options=log_levels, default=log_levels)
     search_term = filter_c2.text_input("Rechercher dans le message")
 
-    # Appliquer les filtres
-    filtered_logs = logs_df[logs_df['level'].isin(selected_levels)]
-    if search_term:
-        filtered_logs = filtered_logs[filtered_logs['message'].str.contains(search_term, case=False, na=False)]
-
-    st.write(f"{len(filtered_logs)} logs trouvés sur {len(logs_df)} au total.")
-    
-    # --- Affichage des logs formatés ---
-    log_container = st.container(height=500)
-    
-    for _, log in filtered_logs.iloc[::-1].iterrows():
-        level = log.get('level', 'UNKNOWN')
-        icon = {"INFO": "ℹ️", "WARNING": "⚠️", "ERROR": "❌", "CRITICAL": "🔥"}.get(level, "💬")
-        
-        with log_container:
-            message = f"**{icon} {level}** | `{log.get('timestamp')}` | **{log.get('name')}**\n> {log.get('message')}"
-            
-            # Utiliser des couleurs différentes pour attirer l'attention
-            if level in ["ERROR", "CRITICAL"]:
-                st.error(message)
-            elif level == "WARNING":
-                st.warning(message)
-            else:
-                st.info(message)
-            
-            # Afficher les détails supplémentaires dans un expander
-            extra_details = {k: v for k, v in log.items() if k not in ['level', 'timestamp', 'name', 'message']}
-            if extra_details:
-                with st.expander("Voir les détails complets du log"):
-                    st.json(extra_details)
+    filtered_logs = log_reader.filtered(levels=selected_levels, search=search_term)
+    st.write(f"{len(filtered_logs)} logs trouvés sur {len(log_reader.entries)} en mémoire "
+             f"(les {LOG_BUFFER_SIZE} plus récents au maximum).")
+
+    # --- Affichage paginé : un seul tableau (virtualisé) par page au lieu d'un widget par ligne ---
+    page_c1, page_c2 = st.columns([1, 1])
+    page_size = page_c1.selectbox("Logs par page", options=[50, 100, 250, 500], index=1)
+    page_count = max(1, (len(filtered_logs) + page_size - 1) // page_size)
+    page = page_c2.number_input(f"Page (sur {page_count})", min_value=1, max_value=page_count, value=1, step=1)
+    page_logs = filtered_logs[(page - 1) * page_size: page * page_size]
+
+    if page_logs:
+        page_df = pd.DataFrame(page_logs)
+        for column in LOG_DISPLAY_COLUMNS:
+            if column not in page_df.columns:
+                page_df[column] = None
+        st.dataframe(page_df[LOG_DISPLAY_COLUMNS], use_container_width=True, hide_index=True, height=500)
+
+        # Détails complets d'une ligne de la page (trace d'exception, champs supplémentaires)
+        detail_index = st.selectbox(
+            "Voir les détails complets du log",
+            options=range(len(page_logs)),
+            format_func=lambda i: f"{page_logs[i].get('timestamp')} | {page_logs[i].get('level')} | {str(page_logs[i].get('message'))[:80]}"
+        )
+        with st.expander("Détails", expanded=page_logs[detail_index].get('level') in ["ERROR", "CRITICAL"]):
+            st.json(page_logs[detail_index])
+    else:
+        st.info("Aucun log ne correspond aux filtres.")
 
 else:
     st.info("Aucun log à afficher. Démarrez l'agent pour commencer la journalisation.")
@@ -234,7 +223,7 @@ else:
 log_c1, log_c2, _ = st.columns([1, 1, 3])
 
 def refresh_logs():
-    parse_logs.clear()
+    log_reader.read_new()
 
 if log_c1.button("🔄 Rafraîchir les logs", on_click=refresh_logs, use_container_width=True):
     st.rerun()
@@ -243,7 +232,7 @@ def clear_log_file():
     try:
         with open(AGENT_LOG_FILE, "w") as f:
             f.write("")
-        parse_logs.clear()
+        log_reader.clear()
         st.success("Fichier de log vidé.")
         time.sleep(1)
         st.rerun()
@@ -13,42 +13,91 @@ st.set_page_config(
     layout="wide"
 )
 
-# --- CHARGEMENT DES DONNÉES (avec la colonne numero_appelant) ---
+# --- CHARGEMENT DES DONNÉES (filtrage et pagination côté serveur) ---
+# La liste ne lit que des colonnes légères, pour une page d'appels à la fois ; la transcription, le résumé
+# et les évaluations ne sont chargés que pour l'appel sélectionné (load_call_details).
+PAGE_SIZES = [25, 50, 100]
+IDENTITY_OPTIONS = ["Tous", "Confirmé", "Non confirmé"]
+DEFAULT_STATUS = 'TERMINÉ'
+
+
 @st.cache_data(ttl=60)
-def load_call_data():
+def load_date_bounds():
+    """Premier et dernier jour d'appel (lecture de l'index sur timestamp_debut)."""
+    df = run_query("SELECT MIN(timestamp_debut) AS premier, MAX(timestamp_debut) AS dernier FROM journal_appels")
+    if df.empty or pd.isna(df.iloc[0]['premier']):
+        return None
+    return pd.to_datetime(df.iloc[0]['premier']).date(), pd.to_datetime(df.iloc[0]['dernier']).date()
+
+
+@st.cache_data(ttl=600)
+def load_statuses():
+    df = run_query(f"SELECT DISTINCT COALESCE(statut_appel, '{DEFAULT_STATUS}') AS statut_appel FROM journal_appels")
+    return sorted(df['statut_appel'].tolist()) if not df.empty else []
+
+
+def build_filters(start_date, end_date, statuses, identity, search_term):
+    """Clause WHERE et paramètres nommés partagés par le comptage et la page."""
+    clauses = ["ja.timestamp_debut >= :debut", "ja.timestamp_debut < :fin"]
+    params = {
+        "debut": datetime.datetime.combine(start_date, datetime.time.min),
+        "fin": datetime.datetime.combine(end_date + datetime.timedelta(days=1), datetime.time.min),
+    }
+    if statuses:
+        names = [f"statut_{i}" for i in range(len(statuses))]
+        clauses.append(f"COALESCE(ja.statut_appel, '{DEFAULT_STATUS}') IN ({', '.join(':' + n for n in names)})")
+        params.update(zip(names, statuses))
+    if identity == "Confirmé":
+        clauses.append("ja.id_adherent_contexte IS NOT NULL")
+    elif identity == "Non confirmé":
+        clauses.append("ja.id_adherent_contexte IS NULL")
+    if search_term:
+        # Lecture des transcriptions de la plage de dates seulement.
+        clauses.append("ja.transcription_complete LIKE :recherche")
+        params["recherche"] = f"%{search_term}%"
+    return " AND ".join(clauses), params
+
+
+@st.cache_data(ttl=60)
+def count_calls(where: str, params: dict) -> int:
+    df = run_query(f"SELECT COUNT(*) AS total FROM journal_appels ja WHERE {where}", params)
+    return int(df.iloc[0]['total']) if not df.empty else 0
+
+
+@st.cache_data(ttl=60)
+def load_call_page(where: str, params: dict, page: int, page_size: int):
     """
-    Charge les données des appels en y joignant les feedbacks et en agrégeant les outils utilisés.
+    Une page d'appels (les plus récents d'abord), avec leur note et la séquence d'outils.
+    La page est sélectionnée avant les jointures : feedback_appel et actions_agent ne sont lus que pour ses appels.
     """
-    query = """
-    SELECT 
-        ja.id_appel, 
-        ANY_VALUE(ja.timestamp_debut) as timestamp_debut, 
-        ANY_VALUE(ja.numero_appelant) as numero_appelant, -- Ajout de la colonne manquante
-        ANY_VALUE(ja.id_adherent_contexte) as id_adherent_contexte, 
-        ANY_VALUE(ja.resume_appel) as resume_appel,
-        ANY_VALUE(COALESCE(ja.duree_appel_secondes, TIMESTAMPDIFF(SECOND, ja.timestamp_debut, ja.timestamp_fin))) as duree_appel_secondes,
-        ANY_VALUE(COALESCE(ja.statut_appel, 'TERMINÉ')) as statut_appel,
-        ANY_VALUE(COALESCE(ja.transcription_complete, '[]')) as transcription_complete,
-        ANY_VALUE(ja.chemin_enregistrement_audio) as chemin_enregistrement_audio,
-        ANY_VALUE(COALESCE(ja.evaluation_conformite, 'Non évalué')) as evaluation_conformite,
-        ANY_VALUE(COALESCE(ja.evaluation_resolution_appel, 'Non évalué')) as evaluation_resolution_appel,
-        ANY_VALUE(CASE WHEN ja.id_adherent_contexte IS NOT NULL THEN 'Confirmé' ELSE 'Non confirmé' END) as identite_confirmee,
-        ANY_VALUE(fb.note_satisfaction) as note_satisfaction,
-        ANY_VALUE(fb.commentaire) as commentaire,
-        GROUP_CONCAT(DISTINCT aa.nom_outil SEPARATOR ', ') as outils_appeles
-    FROM 
-        journal_appels ja
-    LEFT JOIN 
-        feedback_appel fb ON ja.id_appel = fb.id_appel_fk
-    LEFT JOIN 
-        actions_agent aa ON ja.id_appel = aa.id_appel_fk AND aa.type_action = 'TOOL_CALL'
-    GROUP BY
-        ja.id_appel
-    ORDER BY 
-        ANY_VALUE(ja.timestamp_debut) DESC;
+    query = f"""
+    SELECT
+        p.id_appel,
+        p.timestamp_debut,
+        p.numero_appelant,
+        p.id_adherent_contexte,
+        p.duree_appel_secondes,
+        p.statut_appel,
+        (SELECT fb.note_satisfaction FROM feedback_appel fb WHERE fb.id_appel_fk = p.id_appel LIMIT 1) AS note_satisfaction,
+        (SELECT GROUP_CONCAT(DISTINCT aa.nom_outil SEPARATOR ', ') FROM actions_agent aa
+         WHERE aa.id_appel_fk = p.id_appel AND aa.type_action = 'TOOL_CALL') AS outils_appeles
+    FROM (
+        SELECT
+            ja.id_appel,
+            ja.timestamp_debut,
+            ja.numero_appelant,
+            ja.id_adherent_contexte,
+            COALESCE(ja.duree_appel_secondes, TIMESTAMPDIFF(SECOND, ja.timestamp_debut, ja.timestamp_fin)) AS duree_appel_secondes,
+            COALESCE(ja.statut_appel, '{DEFAULT_STATUS}') AS statut_appel
+        FROM journal_appels ja
+        WHERE {where}
+        ORDER BY ja.timestamp_debut DESC, ja.id_appel DESC
+        LIMIT :limite OFFSET :decalage
+    ) p
+    ORDER BY p.timestamp_debut DESC, p.id_appel DESC
     """
     try:
-        df = run_query(query)
+        df = run_query(query, {**params, "limite": page_size, "decalage": (page - 1) * page_size})
         if not df.empty:
             df['timestamp_debut'] = pd.to_datetime(df['timestamp_debut'])
         return df
@@ -56,44 +105,64 @@ def load_call_data():
         st.error(f"Erreur lors du chargement des données des appels: {e}")
         return pd.DataFrame()
 
+
+@st.cache_data(ttl=60)
+def load_call_details(id_appel: int):
+    """Transcription, résumé, évaluations et feedback d'un seul appel (chargés à la sélection)."""
+    query = """
+    SELECT
+        ja.id_appel,
+        ja.resume_appel,
+        COALESCE(ja.transcription_complete, '[]') AS transcription_complete,
+        ja.chemin_enregistrement_audio,
+        COALESCE(ja.evaluation_conformite, 'Non évalué') AS evaluation_conformite,
+        COALESCE(ja.evaluation_resolution_appel, 'Non évalué') AS evaluation_resolution_appel,
+        fb.note_satisfaction,
+        fb.commentaire
+    FROM journal_appels ja
+    LEFT JOIN feedback_appel fb ON fb.id_appel_fk = ja.id_appel
+    WHERE ja.id_appel = :id_appel
+    LIMIT 1
+    """
+    df = run_query(query, {"id_appel": int(id_appel)})
+    return df.iloc[0] if not df.empty else None
+
 # --- INTERFACE UTILISATEUR ---
 st.title("🔎 Explorateur d'Appels")
 st.markdown("Filtrez et explorez les enregistrements de chaque appel traité par l'agent IA.")
 
-calls_df_raw = load_call_data()
+date_bounds = load_date_bounds()
 
 # --- BARRE LATÉRALE DE FILTRES ---
 st.sidebar.header("Filtres")
-if calls_df_raw.empty:
+total_calls = 0
+filtered_df = pd.DataFrame()
+if date_bounds is None:
     st.sidebar.warning("Aucune donnée d'appel à filtrer.")
-    filtered_df = pd.DataFrame()
 else:
-    min_date = calls_df_raw['timestamp_debut'].min().date()
-    max_date = calls_df_raw['timestamp_debut'].max().date()
+    min_date, max_date = date_bounds
     date_range = st.sidebar.date_input(
-        "Plage de dates", (min_date, max_date), min_value=min_date, max_value=max_date
+        "Plage de dates", (max(min_date, max_date - datetime.timedelta(days=30)), max_date),
+        min_value=min_date, max_value=max_date
     )
-    search_term = st.sidebar.text_input("Rechercher dans la transcription")
-    available_statuses = calls_df_raw['statut_appel'].unique()
-    selected_statuses = st.sidebar.multiselect("Statut de l'appel", options=available_statuses, default=list(available_statuses))
-    identity_options = ["Tous", "Confirmé", "Non confirmé"]
-    selected_identity = st.sidebar.selectbox("Confirmation d'identité", options=identity_options)
-
-    # --- APPLICATION DES FILTRES ---
-    filtered_df = calls_df_raw.copy()
-    if len(date_range) == 2:
-        start_date = datetime.datetime.combine(date_range[0], datetime.time.min)
-        end_date = datetime.datetime.combine(date_range[1], datetime.time.max)
-        filtered_df = filtered_df[(filtered_df['timestamp_debut'] >= start_date) & (filtered_df['timestamp_debut'] <= end_date)]
-    if search_term:
-        filtered_df = filtered_df[filtered_df['transcription_complete'].str.contains(search_term, case=False, na=False)]
-    if selected_statuses:
-        filtered_df = filtered_df[filtered_df['statut_appel'].isin(selected_statuses)]
-    if selected_identity != "Tous":
-        filtered_df = filtered_df[filtered_df['identite_confirmee'] == selected_identity]
+    search_term = st.sidebar.text_input("Rechercher dans la transcription", help="Plus lent sur une longue plage de dates.")
+    available_statuses = load_statuses()
+    selected_statuses = st.sidebar.multiselect("Statut de l'appel", options=available_statuses, default=available_statuses)
+    selected_identity = st.sidebar.selectbox("Confirmation d'identité", options=IDENTITY_OPTIONS)
+    page_size = st.sidebar.selectbox("Appels par page", options=PAGE_SIZES)
+
+    # --- APPLICATION DES FILTRES (requête SQL) ---
+    start_date, end_date = (date_range[0], date_range[1]) if len(date_range) == 2 else (date_range[0], date_range[0])
+    where, params = build_filters(start_date, end_date, selected_statuses, selected_identity, search_term.strip())
+    total_calls = count_calls(where, params)
+    page_count = max(1, -(-total_calls // page_size))
+    # Clé liée aux filtres : retour à la première page quand ils changent.
+    page = st.sidebar.number_input(f"Page (sur {page_count})", min_value=1, max_value=page_count, value=1, step=1,
+                                   key=f"page_{where}_{sorted(params.items())}_{page_size}")
+    filtered_df = load_call_page(where, params, int(page), page_size)
 
 # --- AFFICHAGE DU TABLEAU PRINCIPAL ---
-st.header(f"Liste des Appels Filtrés ({len(filtered_df)})")
+st.header(f"Liste des Appels Filtrés ({total_calls})")
 if not filtered_df.empty:
     df_display = filtered_df.copy()
     
@@ -133,8 +202,8 @@ if not filtered_df.empty:
     call_ids = filtered_df['id_appel'].tolist()
     selected_call_id = st.selectbox("Choisissez un ID d'appel dans la liste ci-dessus pour voir les détails", options=call_ids)
 
-    if selected_call_id:
-        call_details = filtered_df[filtered_df['id_appel'] == selected_call_id].iloc[0]
+    call_details = load_call_details(selected_call_id) if selected_call_id else None
+    if call_details is not None:
         
         col1, col2 = st.columns([1, 2])
 